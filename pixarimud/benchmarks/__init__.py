@@ -0,0 +1,28 @@
+"""
+Benchmarks
+
+Benchmarks of the game's hot paths - combat commands, experience, death
+and respawn, and room messages - run by Evennia's test runner against its
+in-memory test database:
+
+    evennia test --settings settings.py benchmarks
+
+Each benchmark reports operations per second, database queries per
+operation and memory use (see `harness.py`), prints them and writes them to
+`benchmarks/results.json`. They are compared with `benchmarks/baseline.json`:
+a benchmark doing more queries per operation than its baseline fails, one
+slower than `BENCHMARK_TOLERANCE` (default 0.25, so 25%) only warns, as
+timings vary between machines. Set `BENCHMARK_STRICT=1` to fail on those
+too.
+
+The baseline is only written when running with `BENCHMARK_UPDATE=1`,
+which replaces the baseline of each benchmark run with this run's results;
+commit it along with the change that made things faster (or slower), or
+that added a benchmark. A benchmark with no baseline yet only warns.
+`BENCHMARK_OPS` sets the operations per benchmark (default 200).
+
+`test_query_budgets.py` also checks the hot commands and hooks against
+their query budgets in `settings.QUERY_BUDGETS` (see
+`world/query_budget.py`).
+
+"""
@@ -0,0 +1,167 @@
+"""
+Benchmark harness
+
+`measure()` runs an operation many times, three times over:
+
+1. timed, with the garbage collector off, for `ops_per_sec`;
+2. with the database queries captured, for `queries_per_op`;
+3. traced by `tracemalloc`, for `retained_blocks_per_op` (memory blocks
+   still allocated after the run, per operation - growing caches or
+   leaks) and `peak_kib` (the most memory in use at once during the run,
+   above what was in use before it).
+
+Each benchmark runs its operation once before measuring, so loading
+Attributes, cmdsets etc into the caches is not counted.
+
+"""
+
+import gc
+import json
+import os
+import time
+import tracemalloc
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, "baseline.json")
+RESULTS_FILE = os.path.join(BENCHMARK_DIR, "results.json")
+
+OPS = int(os.environ.get("BENCHMARK_OPS", 200))
+TOLERANCE = float(os.environ.get("BENCHMARK_TOLERANCE", 0.25))
+STRICT = bool(os.environ.get("BENCHMARK_STRICT"))
+UPDATE = bool(os.environ.get("BENCHMARK_UPDATE"))
+
+# {name: result} of this run
+RESULTS = {}
+
+
+def measure(operation, ops=None):
+    """
+    Measure an operation.
+
+    Args:
+        operation (callable): Called with no arguments, once per operation.
+        ops (int, optional): Operations per measurement, default
+            `BENCHMARK_OPS`.
+
+    Returns:
+        dict: With keys `ops`, `ops_per_sec`, `queries_per_op`,
+        `retained_blocks_per_op` and `peak_kib`.
+
+    """
+    ops = ops or OPS
+    operation()
+
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(ops):
+            operation()
+        seconds = time.perf_counter() - start
+    finally:
+        gc.enable()
+
+    with CaptureQueriesContext(connection) as queries:
+        for _ in range(ops):
+            operation()
+
+    gc.collect()
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot().filter_traces(ignore)
+        tracemalloc.reset_peak()
+        start_size, _ = tracemalloc.get_traced_memory()
+        for _ in range(ops):
+            operation()
+        _, peak = tracemalloc.get_traced_memory()
+        gc.collect()
+        after = tracemalloc.take_snapshot().filter_traces(ignore)
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+
+    return {
+        "ops": ops,
+        "ops_per_sec": round(ops / seconds, 1) if seconds else 0.0,
+        "queries_per_op": round(len(queries.captured_queries) / ops, 2),
+        "retained_blocks_per_op": round(blocks / ops, 2),
+        "peak_kib": round((peak - start_size) / 1024, 1),
+    }
+
+
+def _load(path):
+    try:
+        with open(path, encoding="utf-8") as fil:
+            return json.load(fil)
+    except FileNotFoundError:
+        return {}
+
+
+def _save(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fil:
+        json.dump(data, fil, indent=2, sort_keys=True)
+        fil.write("\n")
+    os.replace(tmp_path, path)
+
+
+def compare(result, baseline):
+    """
+    Compare a result with its baseline.
+
+    Returns:
+        tuple: `(failures, warnings)`, lists of strings.
+
+    """
+    failures, warnings = [], []
+    if result["queries_per_op"] > baseline["queries_per_op"]:
+        failures.append(
+            f"{result['queries_per_op']} queries/op, baseline {baseline['queries_per_op']}"
+        )
+    if result["ops_per_sec"] < baseline["ops_per_sec"] * (1 - TOLERANCE):
+        slower = f"slower, {result['ops_per_sec']} ops/sec, baseline {baseline['ops_per_sec']}"
+        (failures if STRICT else warnings).append(slower)
+    return failures, warnings
+
+
+def run(name, operation, ops=None):
+    """
+    Measure an operation, report it and compare it with the baseline.
+
+    Args:
+        name (str): The benchmark's name in the results and baseline.
+        operation (callable): Called once per operation.
+        ops (int, optional): Operations per measurement.
+
+    Returns:
+        tuple: `(result, failures)`, with `failures` a list of strings
+        (empty if the benchmark is within its baseline).
+
+    """
+    result = measure(operation, ops=ops)
+    RESULTS[name] = result
+
+    baseline = _load(BASELINE_FILE)
+    failures, warnings = [], []
+    if UPDATE:
+        baseline[name] = result
+        _save(BASELINE_FILE, baseline)
+    elif name in baseline:
+        failures, warnings = compare(result, baseline[name])
+    else:
+        warnings.append("no baseline, run with BENCHMARK_UPDATE=1 to add it")
+    print(
+        f"\n{name}: {result['ops_per_sec']} ops/sec, {result['queries_per_op']} queries/op, "
+        f"{result['retained_blocks_per_op']} blocks/op retained, peak {result['peak_kib']} KiB"
+    )
+    for message in warnings:
+        print(f"  WARNING: {message}")
+
+    results = _load(RESULTS_FILE)
+    results[name] = result
+    _save(RESULTS_FILE, results)
+    return result, failures
@@ -0,0 +1,131 @@
+"""
+Benchmarks of the combat and command hot paths. See `benchmarks/__init__.py`
+for how to run them.
+
+"""
+
+import evennia
+from evennia.utils import create
+from evennia.utils.test_resources import EvenniaTest
+
+from commands.command import CmdHit, CmdJump, CmdStats
+from typeclasses.characters import Character
+from typeclasses.objects import BottomlessPit, CombatDummy, WornOutDummy
+from typeclasses.rooms import Room
+
+from . import harness
+
+
+def _discard(*args, **kwargs):
+    # instead of the test Mock, which would keep every message sent
+    pass
+
+
+def command_runner(cmdclass, caller, args):
+    """
+    Get a callable running a command the way the cmdhandler does, minus
+    finding it in the caller's cmdsets.
+
+    """
+    cmd = cmdclass()
+    cmd.caller = caller
+    cmd.cmdname = cmd.raw_cmdname = cmd.key
+    cmd.args = f" {args}" if args else ""
+    cmd.raw_string = f"{cmd.key}{cmd.args}"
+    cmd.session = None
+    cmd.account = caller.account
+    cmd.obj = caller
+    cmd.cmdset = None
+
+    def run():
+        if cmd.at_pre_cmd():
+            return
+        cmd.parse()
+        cmd.func()
+        cmd.at_post_cmd()
+
+    return run
+
+
+class BenchmarkTest(EvenniaTest):
+    """
+    Base for benchmarks: `self.bench()` measures an operation and fails if
+    it does more queries than its baseline.
+
+    """
+
+    def setUp(self):
+        super().setUp()
+        evennia.SESSION_HANDLER.data_out = _discard
+
+    def bench(self, name, operation, ops=None):
+        _, failures = harness.run(name, operation, ops=ops)
+        if failures:
+            self.fail(f"{name} regressed: {'; '.join(failures)}")
+
+
+class TestCombatBenchmarks(BenchmarkTest):
+    """
+    Hitting dummies and jumping into the pit.
+
+    """
+
+    def test_hit_combat_dummy(self):
+        create.create_object(CombatDummy, key="dummy", location=self.room1)
+        self.bench("hit_combat_dummy", command_runner(CmdHit, self.char1, "dummy"))
+
+    def test_hit_worn_out_dummy(self):
+        dummy = create.create_object(WornOutDummy, key="dummy", location=self.room1)
+        # so it isn't destroyed (and gone) halfway through
+        dummy.db.health = 10**9
+        self.bench("hit_worn_out_dummy", command_runner(CmdHit, self.char1, "dummy"))
+
+    def test_jump_into_pit(self):
+        create.create_object(BottomlessPit, key="pit", location=self.room1)
+        # respawning where the pit is, to jump again
+        self.char1.db.respawn_location = self.room1
+        self.bench("jump_into_pit", command_runner(CmdJump, self.char1, "in pit"))
+
+
+class TestCharacterBenchmarks(BenchmarkTest):
+    """
+    Experience, death and respawn, and the stats command.
+
+    """
+
+    def test_gain_experience(self):
+        # every other gain is a level up
+        self.bench("gain_experience", lambda: self.char1.gain_experience(50))
+
+    def test_die_and_respawn(self):
+        self.char1.db.respawn_location = self.room1
+        self.bench("die_and_respawn", self.char1.die)
+
+    def test_stats_command(self):
+        self.char1.ensure_stats_initialized()
+        self.bench("stats_command", command_runner(CmdStats, self.char1, ""))
+
+
+class TestRoomMessageBenchmarks(BenchmarkTest):
+    """
+    `msg_contents` in rooms with 1, 10 and 100 characters in them.
+
+    """
+
+    def _bench_occupants(self, count):
+        room = create.create_object(Room, key=f"Room of {count}")
+        for num in range(count):
+            create.create_object(Character, key=f"Occupant{num}", location=room, home=room)
+        self.bench(
+            f"msg_contents_{count}",
+            lambda: room.msg_contents("|yOccupant0 strikes the dummy!|n"),
+        )
+
+    def test_msg_contents_1(self):
+        self._bench_occupants(1)
+
+    def test_msg_contents_10(self):
+        self._bench_occupants(10)
+
+    def test_msg_contents_100(self):
+        self._bench_occupants(100)
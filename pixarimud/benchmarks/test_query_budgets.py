@@ -0,0 +1,41 @@
+"""
+Query budgets of the hot commands and hooks, from `settings.QUERY_BUDGETS`
+(see `world/query_budget.py`). Each is run once first, so loading
+Attributes into the cache is not counted.
+
+"""
+
+from evennia.commands.default.general import CmdLook
+from evennia.utils import create
+
+from commands.command import CmdHit, CmdStats
+from typeclasses.objects import CombatDummy
+from world.query_budget import assert_query_budget
+
+from .test_benchmarks import BenchmarkTest, command_runner
+
+
+class TestQueryBudgets(BenchmarkTest):
+    """
+    Commands and hooks within their query budgets.
+
+    """
+
+    def check_budget(self, name, operation):
+        operation()
+        with assert_query_budget(name):
+            operation()
+
+    def test_hit(self):
+        create.create_object(CombatDummy, key="dummy", location=self.room1)
+        self.check_budget("hit", command_runner(CmdHit, self.char1, "dummy"))
+
+    def test_stats(self):
+        self.check_budget("stats", command_runner(CmdStats, self.char1, ""))
+
+    def test_look(self):
+        self.check_budget("look", command_runner(CmdLook, self.char1, ""))
+
+    def test_character_die(self):
+        self.char1.db.respawn_location = self.room1
+        self.check_budget("Character.die", self.char1.die)
@@ -5,12 +5,27 @@ Commands describe the input the account can do to the game.
 
 """
 
+import re
+import time
+
+from django.conf import settings
+
 from evennia.commands.command import Command as BaseCommand
+from evennia.commands.default.comms import CmdChannel as BaseCmdChannel
+from evennia.commands.default.help import CmdHelp as BaseCmdHelp
+from evennia.commands.default.unloggedin import CmdUnconnectedConnect as BaseCmdUnconnectedConnect
+from evennia.commands.default.unloggedin import CmdUnconnectedCreate as BaseCmdUnconnectedCreate
+from evennia.commands.default.unloggedin import CmdUnconnectedLook as BaseCmdUnconnectedLook
+from evennia.objects.objects import DefaultRoom
+from evennia.utils.utils import class_from_module, inherits_from
+
+from world import channel_log, connection_screen_cache, help_index, room_graph
+from world.query_budget import QueryBudgetCommandMixin
 
 # from evennia import default_cmds
 
 
-class Command(BaseCommand):
+class Command(QueryBudgetCommandMixin, BaseCommand):
     """
     Base command (you may see this if a child command had no help text defined)
 
@@ -139,6 +154,7 @@ class CmdStats(Command):
 |wHealth:|n |{'g' if char.db.health > 20 else 'r'}{char.db.health}|n / {char.db.max_health}
 |wExperience:|n {char.db.experience}
 |wNext Level:|n {((char.level * 100) - char.db.experience)} XP needed
+|wDeaths:|n {char.db.deaths or 0}
 """
         
         char.msg(stats_display)
@@ -222,6 +238,286 @@ class CmdSuicide(Command):
         char.die()
 
 
+class CmdTravel(Command):
+    """
+    Walk to a room by the shortest way.
+
+    Usage:
+        travel <room>
+        travel
+
+    Walks you there one exit at a time. Use travel on its own to
+    stop walking.
+    """
+
+    key = "travel"
+    help_category = "Movement"
+
+    def func(self):
+        """Start or stop walking."""
+        caller = self.caller
+        if not self.args:
+            if caller.stop_walking():
+                caller.msg("You stop walking.")
+            else:
+                caller.msg("Travel where?")
+            return
+
+        target = caller.search(self.args.strip(), global_search=True)
+        if not target:
+            return
+        if not inherits_from(target, DefaultRoom):
+            caller.msg(f"{target.get_display_name(caller)} is not a place you can travel to.")
+            return
+
+        route = caller.walk_to(target)
+        if route is None:
+            caller.msg(f"You know of no way to {target.get_display_name(caller)}.")
+        elif not route:
+            caller.msg("You are already there.")
+        else:
+            exits = [room_graph.get_exit(exit_id) for exit_id, _ in route]
+            caller.msg(
+                f"You set off for {target.get_display_name(caller)}: "
+                + ", ".join(exit_obj.key for exit_obj in exits if exit_obj)
+                + "."
+            )
+
+
+class CmdUnconnectedLook(BaseCmdUnconnectedLook):
+    """
+    look when in unlogged-in state
+
+    Usage:
+      look
+
+    This is called by the server when a session first connects and shows
+    the connection screen. Screens are pre-rendered for the session's client
+    (see `world/connection_screen_cache.py`).
+    """
+
+    def func(self):
+        """Show the pre-rendered connect screen, if available."""
+        cached = connection_screen_cache.get_screen(self.session)
+        if not cached:
+            super().func()
+            return
+        text, options = cached
+        self.msg(text, options=options)
+
+
+def _split_login_args(args):
+    """
+    Split `<name> <password>`, where either may be in double quotes.
+
+    """
+    parts = [part.strip() for part in re.split(r"\"", args.strip()) if part.strip()]
+    if len(parts) == 1:
+        parts = parts[0].split(None, 1)
+    return parts
+
+
+class CmdUnconnectedConnect(BaseCmdUnconnectedConnect):
+    __doc__ = BaseCmdUnconnectedConnect.__doc__
+
+    def func(self):
+        """Log in, checking the password in the login queue."""
+        session = self.caller
+        parts = _split_login_args(self.args)
+        if len(parts) != 2:
+            # guest logins and usage
+            super().func()
+            return
+        name, password = parts
+        Account = class_from_module(settings.BASE_ACCOUNT_TYPECLASS)
+        Account.authenticate_deferred(
+            name, password, ip=session.address, session=session
+        ).addCallback(self._at_authenticated)
+
+    def _at_authenticated(self, result):
+        session = self.caller
+        if session.sessid not in session.sessionhandler or session.logged_in:
+            # disconnected, or logged in some other way, while waiting
+            return
+        account, errors = result
+        if account:
+            session.sessionhandler.login(session, account)
+        else:
+            session.msg("|R%s|n" % "\n".join(errors))
+
+
+class CmdUnconnectedCreate(BaseCmdUnconnectedCreate):
+    __doc__ = BaseCmdUnconnectedCreate.__doc__
+
+    def func(self):
+        """Create an account, hashing the password in the login queue."""
+        session = self.caller
+        parts = _split_login_args(self.args)
+        if len(parts) != 2:
+            session.msg(
+                "\n Usage (without <>): create <name> <password>"
+                "\nIf <name> or <password> contains spaces, enclose it in double quotes."
+            )
+            return
+        username, password = parts
+        Account = class_from_module(settings.BASE_ACCOUNT_TYPECLASS)
+        normalized = Account.normalize_username(username)
+        if normalized != username:
+            session.msg(
+                "Note: your username was normalized to strip spaces and remove characters "
+                "that could be visually confusing."
+            )
+        username = normalized
+
+        answer = yield (
+            f"You want to create an account '{username}' with password '{password}'."
+            "\nIs this what you intended? [Y]/N?"
+        )
+        if answer.lower() in ("n", "no"):
+            session.msg("Aborted. If your user name contains spaces, surround it by quotes.")
+            return
+        Account.create_deferred(
+            username=username, password=password, ip=session.address, session=session
+        ).addCallback(self._at_created, username)
+
+    def _at_created(self, result, username):
+        account, errors = result
+        if not account:
+            self.caller.msg("|R%s|n" % "\n".join(errors))
+            return
+        if " " in username:
+            hint = f"connect \"{username}\" <your password>"
+        else:
+            hint = f"connect {username} <your password>"
+        self.caller.msg(
+            f"A new account '{username}' was created. Welcome!"
+            f"\n\nYou can now log in with the command '{hint}'."
+        )
+
+
+class CmdHelp(BaseCmdHelp):
+    """
+    Get help.
+
+    Usage:
+      help
+      help <topic, command or category>
+      help <topic>/<subtopic>
+      help <topic>/<subtopic>/<subsubtopic> ...
+
+    Use the 'help' command alone to see an index of all help topics, organized
+    by category. Some long topics may offer additional sub-topics.
+
+    A topic is found by a word of its name, alias or category, the start of
+    one or with a small typo. If nothing matches, topics mentioning the word
+    in their text are suggested.
+    """
+
+    def do_search(self, query, candidate_entries, search_fields=None):
+        """
+        Search the help index (see `world/help_index.py`) instead of building
+        a Lunr index for every lookup. The help command searches for `query`,
+        then `query*` and then `*query`; these become an exact, prefix and
+        typo-tolerant lookup.
+
+        Args:
+            query (str): The search query.
+            candidate_entries (list): The entries the caller may read.
+            search_fields (list, optional): Lunr-style
+                `[{"field_name": ..., "boost": ...}, ...]` to match in.
+
+        Returns:
+            tuple: `(matches, suggestions)`, best first.
+
+        """
+        if query.endswith("*"):
+            mode = help_index.PREFIX
+        elif query.startswith("*"):
+            mode = help_index.FUZZY
+        else:
+            mode = help_index.EXACT
+        boosts = None
+        if search_fields:
+            boosts = {field["field_name"]: field.get("boost", 1) for field in search_fields}
+
+        # the same candidates are searched up to three times per lookup
+        cached = getattr(self, "_help_candidates", None)
+        if not cached or cached[0] is not candidate_entries:
+            allowed = {}
+            for entry in candidate_entries:
+                entry_id = help_index.doc_id(entry)
+                if entry_id not in help_index.HELP_INDEX.docs:
+                    help_index.HELP_INDEX.add(entry_id, entry)
+                allowed[entry_id] = entry
+            cached = self._help_candidates = (candidate_entries, allowed)
+
+        return help_index.HELP_INDEX.search(
+            query.strip("*"), cached[1], boosts=boosts, mode=mode, maxnum=self.suggestion_maxnum
+        )
+
+
+class CmdChannel(BaseCmdChannel):
+    __doc__ = (
+        BaseCmdChannel.__doc__.rstrip()
+        + """
+
+    To see all messages of the last while instead, give an age like 30s,
+    10m, 2h or 1d:
+      channel/history <channel> = <age>
+    """
+    )
+
+    # messages shown by channel/history
+    history_size = 20
+    # max messages shown by channel/history with an age
+    history_since_size = 200
+
+    _re_age = re.compile(r"^\s*(\d+)\s*([smhdw])\s*$", re.I)
+    _age_units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+    def func(self):
+        """Show history since a time; everything else as normal."""
+        age = self._re_age.match(self.rhs or "")
+        if not (age and {"history", "hist"}.intersection(self.switches)):
+            super().func()
+            return
+        channels = self.search_channel(self.lhs)
+        if not channels:
+            return
+        channel = channels[0]
+        log_file = channel.get_log_filename()
+        if not log_file:
+            self.msg(f"Channel {channel.key} keeps no history.")
+            return
+        seconds = int(age.group(1)) * self._age_units[age.group(2).lower()]
+        channel_log.since(
+            log_file, time.time() - seconds, limit=self.history_since_size
+        ).addCallback(self._show_history)
+
+    def get_channel_history(self, channel, start_index=0):
+        """
+        Show the latest messages of a channel, read from the channel log
+        index (see `world/channel_log.py`).
+
+        Args:
+            channel (Channel): The channel.
+            start_index (int, optional): How many of the latest messages to skip.
+
+        """
+        log_file = channel.get_log_filename()
+        if not log_file:
+            self.msg(f"Channel {channel.key} keeps no history.")
+            return
+        channel_log.tail(log_file, self.history_size, offset=start_index).addCallback(
+            self._show_history
+        )
+
+    def _show_history(self, messages):
+        if not messages:
+            self.msg("No messages found.")
+            return
+        self.msg("\n".join(text.split("[-] ", 1)[-1] for _, text in messages))
+
 # -------------------------------------------------------------
 #
 # The default commands inherit from
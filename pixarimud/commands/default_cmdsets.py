@@ -15,7 +15,24 @@ own cmdsets by inheriting from them or directly from `evennia.CmdSet`.
 """
 
 from evennia import default_cmds
-from .command import CmdHit, CmdJump, CmdStats, CmdSetRespawn, CmdHeal, CmdSuicide
+from .command import CmdHit, CmdJump, CmdStats, CmdSetRespawn, CmdHeal, CmdSuicide, CmdTravel
+from .command import (
+    CmdChannel,
+    CmdHelp,
+    CmdUnconnectedConnect,
+    CmdUnconnectedCreate,
+    CmdUnconnectedLook,
+)
+from .staff import (
+    CmdBulkSpawn,
+    CmdCacheStats,
+    CmdDbProfile,
+    CmdLoginStats,
+    CmdProtoSync,
+    CmdScriptStats,
+    CmdSnapshot,
+    CmdWorldImport,
+)
 
 
 class CharacterCmdSet(default_cmds.CharacterCmdSet):
@@ -41,6 +58,15 @@ class CharacterCmdSet(default_cmds.CharacterCmdSet):
         self.add(CmdSetRespawn())
         self.add(CmdHeal())
         self.add(CmdSuicide())
+        self.add(CmdTravel())
+        self.add(CmdDbProfile())
+        self.add(CmdCacheStats())
+        self.add(CmdLoginStats())
+        self.add(CmdScriptStats())
+        self.add(CmdWorldImport())
+        self.add(CmdBulkSpawn())
+        self.add(CmdProtoSync())
+        self.add(CmdSnapshot())
 
 
 class AccountCmdSet(default_cmds.AccountCmdSet):
@@ -61,6 +87,8 @@ class AccountCmdSet(default_cmds.AccountCmdSet):
         #
         # any commands you add below will overload the default ones.
         #
+        self.add(CmdHelp())
+        self.add(CmdChannel())
 
 
 class UnloggedinCmdSet(default_cmds.UnloggedinCmdSet):
@@ -79,6 +107,9 @@ class UnloggedinCmdSet(default_cmds.UnloggedinCmdSet):
         #
         # any commands you add below will overload the default ones.
         #
+        self.add(CmdUnconnectedLook())
+        self.add(CmdUnconnectedConnect())
+        self.add(CmdUnconnectedCreate())
 
 
 class SessionCmdSet(default_cmds.SessionCmdSet):
@@ -0,0 +1,22 @@
+"""
+Default command class
+
+The parent of all of Evennia's default commands (`look`, `say`, ...), set
+as `settings.COMMAND_DEFAULT_CLASS`, so they get query budgets in dev mode
+(see `world/query_budget.py`) like the game's own commands.
+
+This is its own module since `commands/command.py` imports default commands,
+which need this class when they are first imported.
+
+"""
+
+from evennia.commands.default.muxcommand import MuxCommand as BaseMuxCommand
+
+from world.query_budget import QueryBudgetCommandMixin
+
+
+class MuxCommand(QueryBudgetCommandMixin, BaseMuxCommand):
+    """
+    This sets up the basis for an Evennia MUX command.
+
+    """
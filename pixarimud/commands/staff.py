@@ -0,0 +1,582 @@
+"""
+Staff commands
+
+Commands for builders and developers to build, inspect and tune the running game.
+They are added to the `CharacterCmdSet` in `commands/default_cmdsets.py`.
+
+"""
+
+import os
+import time
+
+from django.conf import settings
+
+from evennia import default_cmds
+from evennia.utils import search
+
+from world import (
+    appearance_cache,
+    bulk_create,
+    character_profiles,
+    dbprofile,
+    funcparser_cache,
+    guest_pool,
+    help_index,
+    hibernation,
+    idmapper_cache,
+    leaderboard,
+    login_queue,
+    prototype_cache,
+    prototype_sync,
+    room_graph,
+    script_scheduler,
+    snapshot,
+    world_import,
+)
+
+
+class CmdDbProfile(default_cmds.MuxCommand):
+    """
+    Show database tuning and write-batching stats.
+
+    Usage:
+      dbprofile
+      dbprofile/bench [count]
+
+    Switches:
+      bench - time <count> Attribute and Tag writes (default 200) on
+              yourself, once committing every write and once as a single
+              batch, and report commits per second for both.
+
+    The pragmas shown are those set with SQLITE3_PRAGMAS in the settings.
+    """
+
+    key = "dbprofile"
+    switch_options = ("bench",)
+    locks = "cmd:perm(Developer)"
+    help_category = "System"
+
+    def func(self):
+        """Show profile or run the benchmark."""
+        caller = self.caller
+
+        if "bench" in self.switches:
+            count = 200
+            if self.args:
+                try:
+                    count = max(1, int(self.args))
+                except ValueError:
+                    caller.msg("Usage: dbprofile/bench [count]")
+                    return
+            result = dbprofile.benchmark_writes(caller, count=count)
+            table = self.styled_table(
+                "|wmode|n", "|wwrites|n", "|wcommits|n", "|wseconds|n", "|wwrites/s|n", "|wcommits/s|n"
+            )
+            for mode, run in result.items():
+                table.add_row(
+                    mode,
+                    run["writes"],
+                    run["commits"],
+                    f"{run['seconds']:.3f}",
+                    f"{run['writes_per_sec']:.0f}",
+                    f"{run['commits_per_sec']:.0f}",
+                )
+            caller.msg(f"|wDatabase write benchmark|n\n{table}")
+            return
+
+        table = self.styled_table("|wsetting|n", "|wvalue|n")
+        for name, value in dbprofile.get_pragmas().items():
+            table.add_row(f"PRAGMA {name}", value)
+        for name, value in dbprofile.WRITE_BATCHER.stats().items():
+            if isinstance(value, float):
+                value = f"{value:.2f}"
+            table.add_row(f"batcher {name}", value)
+        caller.msg(f"|wDatabase profile|n\n{table}")
+
+
+class CmdCacheStats(default_cmds.MuxCommand):
+    """
+    Show in-memory cache sizes.
+
+    Usage:
+      cachestats
+
+    Lists the idmapper cache size, cap and evictions per database model,
+    then the number of cached instances and estimated memory use per
+    typeclass (Character, CombatDummy, Room etc). Memory use is estimated
+    from a sample of instances and is only a rough guide. The FuncParser
+    template and flattened prototype caches, the help index, the `look`
+    appearance cache, the leaderboards served by the website API, the
+    website's character profiles, the room graph and room hibernation (see
+    world/hibernation.py) are shown last.
+    """
+
+    key = "cachestats"
+    locks = "cmd:perm(Developer)"
+    help_category = "System"
+
+    def func(self):
+        """Show cache stats."""
+        models, typeclasses = idmapper_cache.cache_report()
+
+        model_table = self.styled_table(
+            "|wmodel|n", "|wcached|n", "|wcap|n", "|wpinned|n", "|wevicted|n"
+        )
+        for row in models:
+            model_table.add_row(
+                row["model"], row["size"], row["cap"] or "-", row["pinned"], row["evicted"]
+            )
+
+        typeclass_table = self.styled_table(
+            "|wtypeclass|n", "|wmodel|n", "|wcount|n", "|wavg bytes|n", "|wtotal|n"
+        )
+        for row in typeclasses:
+            typeclass_table.add_row(
+                row["typeclass"],
+                row["model"],
+                row["count"],
+                row["avg_bytes"],
+                f"{row['total_bytes'] / 1024:.1f} KB",
+            )
+
+        parser_stats = funcparser_cache.get_outgoing_parser().stats()
+        prototype_stats = prototype_cache.stats()
+        help_stats = help_index.HELP_INDEX.stats()
+        appearance_stats = appearance_cache.stats()
+        boards = ", ".join(
+            f"{row['board']} {row['entries']} ({row['serializations']} serialized)"
+            for row in leaderboard.stats()
+        )
+        profile_stats = character_profiles.stats()
+        graph_stats = room_graph.stats()
+        sleep_stats = hibernation.stats()
+        self.caller.msg(
+            f"|wIdmapper cache|n\n{model_table}\n"
+            f"|wCached instances per typeclass|n\n{typeclass_table}\n"
+            f"|wFuncParser templates:|n {parser_stats['size']}/{parser_stats['max_size']} "
+            f"(hit rate {parser_stats['hit_rate']:.0%})\n"
+            f"|wFlattened prototypes:|n {prototype_stats['size']} "
+            f"(hit rate {prototype_stats['hit_rate']:.0%})\n"
+            f"|wHelp index:|n {help_stats['entries']} entries, {help_stats['terms']} terms\n"
+            f"|wAppearances:|n {appearance_stats['size']} "
+            f"(hit rate {appearance_stats['hit_rate']:.0%}, "
+            f"{appearance_stats['uncacheable']} rendered uncached)\n"
+            f"|wLeaderboards:|n {boards}\n"
+            f"|wCharacter profiles:|n {profile_stats['size']} "
+            f"(+{profile_stats['unknown']} unknown ids, hit rate {profile_stats['hit_rate']:.0%}, "
+            f"{profile_stats['invalidations']} invalidated)\n"
+            f"|wRoom graph:|n {graph_stats['rooms']} rooms, {graph_stats['exits']} exits, "
+            f"{graph_stats['hubs']} hubs ({graph_stats['queries']} routes, "
+            f"{graph_stats['hub_hits']} from/to hubs, {graph_stats['cache_hits']} cached)\n"
+            f"|wHibernation:|n {sleep_stats['sleeping']} rooms asleep "
+            f"({sleep_stats['hibernated']} times put to sleep, {sleep_stats['woken']} woken; "
+            f"{sleep_stats['scripts_paused']} scripts paused, {sleep_stats['tickers_held']} "
+            f"tickers held, {sleep_stats['evicted']} objects uncached)"
+        )
+
+
+class CmdLoginStats(default_cmds.MuxCommand):
+    """
+    Show login queue stats.
+
+    Usage:
+      loginstats
+
+    Passwords are hashed for logins and account creation in a small
+    thread pool (see world/login_queue.py). Shows the jobs running and
+    waiting for a thread, those turned away because the queue was full,
+    and how long jobs waited for a thread and took to hash since the
+    server started. Also shows how many pooled guests are free (see
+    world/guest_pool.py).
+    """
+
+    key = "loginstats"
+    locks = "cmd:perm(Developer)"
+    help_category = "System"
+
+    def func(self):
+        """Show login queue stats."""
+        stats = login_queue.stats()
+        table = self.styled_table("|wtime|n", "|wcount|n", "|wmean|n", "|wp95|n", "|wmax|n")
+        for name in ("wait", "hash"):
+            row = stats[name]
+            table.add_row(
+                name,
+                row["count"],
+                f"{row['mean'] * 1000:.1f} ms",
+                f"{row['p95'] * 1000:.1f} ms",
+                f"{row['max'] * 1000:.1f} ms",
+            )
+        guests = guest_pool.stats()
+        self.caller.msg(
+            f"|wLogin queue|n: {stats['running']}/{stats['threads']} hashing, "
+            f"{stats['queued']} waiting, {stats['rejected']} turned away\n{table}\n"
+            f"|wGuest pool|n: {guests['free']}/{guests['size']} free"
+        )
+
+
+class CmdScriptStats(default_cmds.MuxCommand):
+    """
+    Show shared script timer stats.
+
+    Usage:
+      scriptstats
+
+    Timed scripts with the same interval are stepped by shared timers, a
+    few per interval at different offsets (see world/script_scheduler.py).
+    Lists each timer in use with its scripts, ticks, mean and max tick
+    time, overruns (ticks taking longer than the interval) and ticks
+    missed because the server was busy.
+    """
+
+    key = "scriptstats"
+    locks = "cmd:perm(Developer)"
+    help_category = "System"
+
+    def func(self):
+        """Show scheduler stats."""
+        rows = script_scheduler.stats()
+        if not rows:
+            self.caller.msg("No scripts on shared timers.")
+            return
+        table = self.styled_table(
+            "|winterval|n",
+            "|woffset|n",
+            "|wscripts|n",
+            "|wticks|n",
+            "|wmean|n",
+            "|wmax|n",
+            "|woverruns|n",
+            "|wmissed|n",
+        )
+        for row in rows:
+            table.add_row(
+                f"{row['interval']}s",
+                f"{row['offset']:.2f}s",
+                row["scripts"],
+                row["ticks"],
+                f"{row['mean'] * 1000:.1f} ms",
+                f"{row['max'] * 1000:.1f} ms",
+                row["overruns"],
+                row["missed"],
+            )
+        self.caller.msg(f"|wShared script timers|n\n{table}")
+
+
+class CmdWorldImport(default_cmds.MuxCommand):
+    """
+    Import a world module.
+
+    Usage:
+      worldimport[/switches] <python.path.to.module>
+
+    Switches:
+      dry   - do the whole import, then roll it back and only report
+      prune - delete objects imported earlier whose entry is no longer
+              in the module
+
+    Builds the rooms, exits and objects defined in a world module (see
+    `world/world_import.py`) in one transaction. Running it again for the
+    same module updates the objects imported before instead of creating
+    new ones.
+
+    Example:
+      worldimport world.demo_world
+    """
+
+    key = "worldimport"
+    switch_options = ("dry", "prune")
+    locks = "cmd:perm(Developer)"
+    help_category = "System"
+
+    def func(self):
+        """Run the import."""
+        caller = self.caller
+        if not self.args:
+            caller.msg("Usage: worldimport[/dry][/prune] <python.path.to.module>")
+            return
+
+        dry_run = "dry" in self.switches
+        try:
+            report = world_import.import_world(
+                self.args.strip(), prune="prune" in self.switches, dry_run=dry_run
+            )
+        except world_import.WorldImportError as err:
+            caller.msg(f"|rWorld import failed:|n {err}")
+            return
+
+        orphans = report["orphans"]
+        text = (
+            f"World '{report['world']}'{' (dry run, nothing saved)' if dry_run else ''}: "
+            f"{report['created']} created, {report['updated']} updated "
+            f"in {report['seconds']:.2f}s."
+        )
+        if orphans:
+            state = "deleted" if report["pruned"] else "no longer in the module"
+            text += f"\n{len(orphans)} objects {state}: {', '.join(orphans)}"
+        caller.msg(text)
+
+
+class CmdBulkSpawn(default_cmds.MuxCommand):
+    """
+    Spawn many objects from a prototype at once.
+
+    Usage:
+      bulkspawn <prototype_key> <count> [= <location>[, <location>, ...]]
+      bulkspawn/tagged <prototype_key> <count> = <tag>[:<category>]
+
+    Switches:
+      tagged - spread the objects over all rooms with the given tag
+
+    Creates <count> objects from a prototype (see `spawn/list`), spread
+    evenly over the given locations (default is your current location).
+    Everything is written in one database transaction, so thousands of
+    objects only take a moment.
+
+    Examples:
+      bulkspawn COMBAT_DUMMY 20
+      bulkspawn WORN_DUMMY 100 = arena, #12
+      bulkspawn/tagged COMBAT_DUMMY 5000 = training:zone
+    """
+
+    key = "bulkspawn"
+    switch_options = ("tagged",)
+    locks = "cmd:perm(spawn) or perm(Builder)"
+    help_category = "Building"
+
+    def func(self):
+        """Spawn the objects."""
+        caller = self.caller
+        usage = "Usage: bulkspawn[/tagged] <prototype_key> <count> [= <location>, ...]"
+        try:
+            prototype_key, count = self.lhs.rsplit(None, 1)
+            count = int(count)
+        except ValueError:
+            caller.msg(usage)
+            return
+        if count < 1:
+            caller.msg("Count must be at least 1.")
+            return
+
+        if "tagged" in self.switches:
+            if not self.rhs:
+                caller.msg(usage)
+                return
+            tag, _, category = self.rhs.partition(":")
+            locations = list(search.search_tag(tag.strip(), category=category.strip() or None))
+            if not locations:
+                caller.msg(f"No locations are tagged '{self.rhs}'.")
+                return
+        elif self.rhslist:
+            locations = []
+            for name in self.rhslist:
+                location = caller.search(name, global_search=True)
+                if not location:
+                    return
+                locations.append(location)
+        elif caller.location:
+            locations = [caller.location]
+        else:
+            caller.msg("You have no location to spawn in - give one after '='.")
+            return
+
+        t0 = time.perf_counter()
+        try:
+            objs = bulk_create.bulk_spawn(prototype_key, count, locations=locations, caller=caller)
+        except (KeyError, RuntimeError) as err:
+            caller.msg(f"|rCould not spawn:|n {err}")
+            return
+        caller.msg(
+            f"Spawned {len(objs)} x {objs[0].get_display_name(caller)} in "
+            f"{len(locations)} location(s) in {time.perf_counter() - t0:.2f}s."
+        )
+
+
+class CmdProtoSync(default_cmds.MuxCommand):
+    """
+    Update all objects spawned from a prototype after it was changed.
+
+    Usage:
+      protosync[/dry] <prototype_key> [= <reference object>]
+
+    Switches:
+      dry - only report what would change, and for how many objects
+
+    Compares the prototype with one object spawned from it (by default the
+    oldest one) and applies the differences - key, typeclass, locks, new
+    or changed Attributes and new Tags/aliases/permissions - to all objects
+    spawned from it, in the background and a chunk at a time. Nothing is
+    removed from the objects. Objects created by `worldimport` are skipped;
+    import their world module again instead.
+
+    Examples:
+      protosync/dry WORN_DUMMY
+      protosync COMBAT_DUMMY = #123
+    """
+
+    key = "protosync"
+    switch_options = ("dry",)
+    locks = "cmd:perm(spawn) or perm(Builder)"
+    help_category = "Building"
+
+    def func(self):
+        """Start the sync."""
+        caller = self.caller
+        if not self.lhs:
+            caller.msg("Usage: protosync[/dry] <prototype_key> [= <reference object>]")
+            return
+
+        reference = None
+        if self.rhs:
+            reference = caller.search(self.rhs, global_search=True)
+            if not reference:
+                return
+        dry_run = "dry" in self.switches
+        try:
+            sync = prototype_sync.PrototypeSync(self.lhs, reference=reference, caller=caller)
+        except (KeyError, RuntimeError) as err:
+            caller.msg(f"|rCould not sync:|n {err}")
+            return
+        if not sync.object_ids:
+            caller.msg(f"No objects are spawned from '{sync.prototype_key}'.")
+            return
+        if not sync.has_changes:
+            caller.msg(
+                f"{sync.reference.get_display_name(caller)} already matches "
+                f"'{sync.prototype_key}'; nothing to sync."
+            )
+            return
+
+        changes = "\n  ".join(sync.describe())
+        caller.msg(
+            f"Syncing {len(sync.object_ids)} objects with '{sync.prototype_key}'"
+            f"{' (dry run)' if dry_run else ''}, compared with "
+            f"{sync.reference.get_display_name(caller)}:\n  {changes}"
+        )
+
+        # report progress about every 10%
+        step = max(sync.chunk_size, len(sync.object_ids) // 10)
+        last = [0]
+
+        def _progress(sync):
+            if sync.done - last[0] >= step and sync.done < len(sync.object_ids):
+                last[0] = sync.done
+                caller.msg(f"protosync: {sync.done}/{len(sync.object_ids)} objects ...")
+
+        def _done(report):
+            parts = ", ".join(f"{part} {num}" for part, num in report["parts"].items() if num)
+            caller.msg(
+                f"protosync {report['prototype']}: {report['changed']}/{report['objects']} "
+                f"objects {'would change' if dry_run else 'changed'}"
+                f"{f' ({parts})' if parts else ''} in {report['seconds']:.2f}s."
+            )
+
+        def _failed(failure):
+            caller.msg(f"|rprotosync {sync.prototype_key} failed:|n {failure.getErrorMessage()}")
+
+        prototype_sync.run_sync(sync, dry_run=dry_run, progress=_progress).addCallbacks(
+            _done, _failed
+        )
+
+
+
+class CmdSnapshot(default_cmds.MuxCommand):
+    """
+    Save or restore a snapshot of a zone or of the whole world.
+
+    Usage:
+      snapshot
+      snapshot/export <name> [= <tag>[:<category>]]
+      snapshot/restore <name>
+
+    Switches:
+      export  - write the rooms with the given tag, everything in them and
+                their exits (or, with no tag, the whole world) to a snapshot
+      restore - replace the zone or world the snapshot was taken from with
+                the snapshot
+
+    Without switches, lists the saved snapshots. Snapshots hold objects,
+    their Attributes, Tags, aliases and Scripts, but never player
+    characters or what they carry. A restore keeps the original #dbrefs
+    and is done in one transaction. Use it to reset test servers to a
+    known world.
+
+    Examples:
+      snapshot/export arena = arena:zone
+      snapshot/export fullworld
+      snapshot/restore arena
+    """
+
+    key = "snapshot"
+    switch_options = ("export", "restore")
+    locks = "cmd:perm(Developer)"
+    help_category = "System"
+
+    def get_path(self, name):
+        """Get the file of a named snapshot in `settings.SNAPSHOT_DIR`."""
+        name = os.path.basename(name.strip())
+        if not name.endswith(".snap"):
+            name += ".snap"
+        return os.path.join(settings.SNAPSHOT_DIR, name)
+
+    def func(self):
+        """Export, restore or list snapshots."""
+        caller = self.caller
+
+        if not self.switches:
+            names = []
+            if os.path.isdir(settings.SNAPSHOT_DIR):
+                names = sorted(
+                    name for name in os.listdir(settings.SNAPSHOT_DIR) if name.endswith(".snap")
+                )
+            if not names:
+                caller.msg("No snapshots saved.")
+                return
+            table = self.styled_table("|wsnapshot|n", "|wsize|n", "|wsaved|n")
+            for name in names:
+                stat = os.stat(os.path.join(settings.SNAPSHOT_DIR, name))
+                table.add_row(
+                    name[: -len(".snap")],
+                    f"{stat.st_size / 1024:.1f} KB",
+                    time.strftime("%Y-%m-%d %H:%M", time.localtime(stat.st_mtime)),
+                )
+            caller.msg(f"|wSnapshots|n\n{table}")
+            return
+
+        if not self.lhs:
+            caller.msg("Usage: snapshot/export <name> [= <tag>[:<category>]]")
+            return
+        path = self.get_path(self.lhs)
+
+        if "export" in self.switches:
+            tag = category = None
+            if self.rhs:
+                tag, _, category = self.rhs.partition(":")
+                tag, category = tag.strip(), category.strip() or None
+            os.makedirs(settings.SNAPSHOT_DIR, exist_ok=True)
+            report = snapshot.export_snapshot(path, tag=tag, category=category)
+            if not report["objects"]:
+                caller.msg(f"|yNo objects are tagged '{self.rhs}'; the snapshot is empty.|n")
+            caller.msg(
+                f"Saved {report['objects']} objects, {report['scripts']} scripts, "
+                f"{report['attributes']} Attributes and {report['tags']} tags to "
+                f"{os.path.basename(path)} ({report['bytes'] / 1024:.1f} KB) "
+                f"in {report['seconds']:.2f}s."
+            )
+            return
+
+        if not os.path.exists(path):
+            caller.msg(f"No snapshot named '{self.lhs}'.")
+            return
+        try:
+            report = snapshot.restore_snapshot(path)
+        except snapshot.SnapshotError as err:
+            caller.msg(f"|rRestore failed:|n {err}")
+            return
+        scope = report["scope"]
+        scope = f"zone '{':'.join(part for part in scope if part)}'" if scope else "the world"
+        caller.msg(
+            f"Restored {scope} from {os.path.basename(path)}: {report['deleted']} objects "
+            f"removed, {report['objects']} objects and {report['scripts']} scripts restored "
+            f"in {report['seconds']:.2f}s."
+        )
@@ -22,7 +22,10 @@ def at_server_init():
     """
     This is called first as the server is starting up, regardless of how.
     """
-    pass
+    from world import funcparser_cache
+
+    # parse outgoing $funcs from compiled templates instead of re-parsing each send
+    funcparser_cache.install_outgoing_parser()
 
 
 def at_server_start():
@@ -30,7 +33,27 @@ def at_server_start():
     This is called every time the server starts up, regardless of
     how it was shut down.
     """
-    pass
+    from world import (
+        appearance_cache,
+        character_profiles,
+        connection_screen_cache,
+        dbprofile,
+        help_index,
+        hibernation,
+        idmapper_cache,
+        leaderboard,
+        room_graph,
+    )
+
+    dbprofile.install()
+    idmapper_cache.install()
+    connection_screen_cache.build()
+    help_index.build()
+    room_graph.install()
+    appearance_cache.install()
+    hibernation.install()
+    leaderboard.build()
+    character_profiles.install()
 
 
 def at_server_stop():
@@ -38,14 +61,23 @@ def at_server_stop():
     This is called just before the server is shut down, regardless
     of it is for a reload, reset or shutdown.
     """
-    pass
+    from world import channel_log, help_index, leaderboard
+    from world.dbprofile import WRITE_BATCHER
+
+    # commit any writes still waiting for the end of the tick
+    WRITE_BATCHER.flush()
+    help_index.save()
+    channel_log.flush_all()
+    leaderboard.save()
 
 
 def at_server_reload_start():
     """
     This is called only when server starts back up after a reload.
     """
-    pass
+    from world import guest_pool
+
+    guest_pool.provision()
 
 
 def at_server_reload_stop():
@@ -60,7 +92,9 @@ def at_server_cold_start():
     This is called only when the server starts "cold", i.e. after a
     shutdown or a reset.
     """
-    pass
+    from world import guest_pool
+
+    guest_pool.provision(reset=True)
 
 
 def at_server_cold_stop():
@@ -29,6 +29,10 @@ the following call signature:
     def funcname(*args, **kwargs)
         ...
 
+Outgoing strings are compiled once per distinct template and cached (see
+`world/funcparser_cache.py`), so an inlinefunc is called on every send but
+the string around it is not re-parsed.
+
 """
 
 # def capitalize(*args, **kwargs):
@@ -24,6 +24,8 @@ put secret game- or server-specific settings in secret_settings.py.
 
 """
 
+import os
+
 # Use the defaults from Evennia unless explicitly overridden
 from evennia.settings_default import *
 
@@ -34,6 +36,206 @@ from evennia.settings_default import *
 # This is the name of your game. Make it catchy!
 SERVERNAME = "pixarimud"
 
+# Max number of compiled FuncParser templates to keep for outgoing messages
+# (only used if FUNCPARSER_PARSE_OUTGOING_MESSAGES_ENABLED is set). See
+# world/funcparser_cache.py.
+FUNCPARSER_TEMPLATE_CACHE_SIZE = 2048
+
+######################################################################
+# Database (production profile)
+######################################################################
+
+# Keep database connections open instead of reconnecting for every web
+# request. The game's own connection is always kept open.
+DATABASES["default"]["CONN_MAX_AGE"] = None
+DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+# Wait for locks instead of failing with "database is locked".
+DATABASES["default"]["OPTIONS"] = {"timeout": 20}
+
+# Applied to every new SQLite connection (see world/dbprofile.py). WAL lets
+# readers (like the website) work while the game is writing; with WAL,
+# synchronous=NORMAL is crash-safe and much faster than FULL.
+SQLITE3_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=20000",
+    "PRAGMA wal_autocheckpoint=1000",
+)
+
+# Group Attribute and Tag writes from one reactor tick into a single commit.
+DB_WRITE_BATCHING = True
+
+######################################################################
+# Idmapper cache
+######################################################################
+
+# Max number of cached typeclass instances per database model. Above the
+# cap, the least recently used instances are dropped from the cache (online
+# puppets, their locations and objects with active scripts or tickers are
+# never dropped). See world/idmapper_cache.py.
+IDMAPPER_CACHE_MAX_INSTANCES = {"ObjectDB": 20000}
+# When over the cap, evict down to this fraction of it.
+IDMAPPER_CACHE_EVICT_TO = 0.9
+# Rendered appearances kept for `look`, per object and permission level.
+# See world/appearance_cache.py.
+APPEARANCE_CACHE_SIZE = 5000
+
+
+######################################################################
+# Room hibernation
+######################################################################
+
+# Zones (rooms tagged category "zone") and single rooms with no players in
+# them for this many seconds have their scripts and tickers paused and
+# their contents dropped from the cache, until a player comes in. 0 to
+# never. See world/hibernation.py.
+ROOM_HIBERNATE_AFTER = 30 * 60
+# Seconds between checks for idle areas.
+ROOM_HIBERNATE_CHECK = 60
+
+
+######################################################################
+# Channel logs
+######################################################################
+
+# Channel messages are logged in the background (see world/channel_log.py).
+# Buffered messages are written when there are this many bytes of them ...
+CHANNEL_LOG_BUFFER_SIZE = 64 * 1024
+# ... or this many seconds after the first one.
+CHANNEL_LOG_FLUSH_INTERVAL = 2.0
+# Old log files kept when a log is rotated (at CHANNEL_LOG_ROTATE_SIZE bytes).
+CHANNEL_LOG_BACKUPS = 5
+
+
+######################################################################
+# Movement
+######################################################################
+
+# Seconds per exit when walking a route with `travel`. See
+# world/room_graph.py.
+TRAVEL_STEP_DELAY = 1.0
+
+
+######################################################################
+# Scripts
+######################################################################
+
+# Timers per script interval. Timed scripts with the same interval share
+# these instead of having one timer each; see world/script_scheduler.py.
+SCRIPT_PHASES = 10
+
+
+######################################################################
+# Logins
+######################################################################
+
+# Threads hashing passwords for logins and account creation, so the game
+# keeps running during login storms. See world/login_queue.py.
+LOGIN_HASH_THREADS = 4
+# Logins waiting for a hashing thread; more are turned away as "busy" ...
+LOGIN_QUEUE_SIZE = 500
+# ... and so are more than this many from one IP, waiting or being hashed.
+LOGIN_QUEUE_PER_IP = 5
+# Guest accounts and characters kept ready and reused when GUEST_ENABLED
+# is set, one per name. See world/guest_pool.py.
+GUEST_LIST = [f"Guest{num}" for num in range(1, 51)]
+
+
+######################################################################
+# Webclient
+######################################################################
+
+# Batches outgoing messages to webclients that ask for it into one binary
+# frame per window, and accepts permessage-deflate. See
+# world/webclient_protocol.py.
+WEBSOCKET_PROTOCOL_CLASS = "world.webclient_protocol.BatchedWebSocketClient"
+# Off to send every webclient the usual JSON frame per message.
+WEBCLIENT_BATCHING = True
+# Seconds messages to a webclient are collected before they are sent ...
+WEBCLIENT_BATCH_WINDOW = 0.05
+# ... unless this many bytes of them come in first.
+WEBCLIENT_BATCH_MAX_SIZE = 64 * 1024
+# Compress websocket frames for browsers offering permessage-deflate.
+WEBCLIENT_DEFLATE = True
+
+
+######################################################################
+# Static files
+######################################################################
+
+# collectstatic (run on every start/reload) also stores static files under
+# content-hashed names and writes gzip/brotli copies of them, which the web
+# server serves with long-lived cache headers. See world/static_assets.py.
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "world.static_assets.PrecompressedManifestStorage"},
+}
+
+
+######################################################################
+# Leaderboards
+######################################################################
+
+# Entries per board served by the leaderboard API (/api/leaderboard/).
+# See world/leaderboard.py.
+LEADERBOARD_SIZE = 100
+# Where the boards are saved between restarts.
+LEADERBOARD_FILE = os.path.join(GAME_DIR, "server", "leaderboard.json")
+# Seconds clients and proxies may reuse a board before asking again.
+LEADERBOARD_MAX_AGE = 30
+
+
+######################################################################
+# Character profiles
+######################################################################
+
+# Rendered public character profiles (/characters/profile/<id>/) kept until
+# the character's stats change. See world/character_profiles.py.
+CHARACTER_PROFILE_CACHE_SIZE = 10000
+
+
+######################################################################
+# Help
+######################################################################
+
+# Where the help search index is saved between reloads. See
+# world/help_index.py.
+HELP_INDEX_FILE = os.path.join(GAME_DIR, "server", "help_index.json")
+
+
+######################################################################
+# World snapshots
+######################################################################
+
+# Where `snapshot/export` saves snapshots. See world/snapshot.py.
+SNAPSHOT_DIR = os.path.join(GAME_DIR, "server", "snapshots")
+
+
+######################################################################
+# Query budgets
+######################################################################
+
+# Evennia's default commands are built on this, for query budgets.
+COMMAND_DEFAULT_CLASS = "commands.muxcommand.MuxCommand"
+# The most database queries per call of a command (by key) or hook, not
+# counting savepoints; checked by the tests, and by the running server in
+# dev mode. Measured with benchmarks/test_query_budgets.py, warm caches.
+# See world/query_budget.py.
+QUERY_BUDGETS = {
+    "hit": 6,
+    "stats": 0,
+    "look": 0,
+    "Character.die": 5,
+}
+# Count queries of budgeted calls in the running server, logging those over
+# budget with where their queries came from. Slow, for development only.
+QUERY_BUDGET_DEV_MODE = False
+# Game code frames shown per query.
+QUERY_BUDGET_STACK_DEPTH = 8
+
 
 ######################################################################
 # Settings given in secret_settings.py override those in this file.
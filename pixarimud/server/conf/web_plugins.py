@@ -25,6 +25,11 @@ def at_webserver_root_creation(web_root):
         web_root.putChild("mypage", my_page)
 
     """
+    # static files with compressed copies and cache headers (see
+    # world/static_assets.py)
+    from world import static_assets
+
+    web_root.putChild(b"static", static_assets.create_static_root())
     return web_root
 
 
@@ -22,10 +22,51 @@ several more options for customizing the Guest account system.
 
 """
 
-from evennia.accounts.accounts import DefaultAccount, DefaultGuest
+from random import getrandbits
 
+from django.conf import settings
+from django.contrib.auth import hashers
+from twisted.internet import defer
 
-class Account(DefaultAccount):
+from evennia.accounts.accounts import (
+    CREATION_THROTTLE,
+    LOGIN_THROTTLE,
+    DefaultAccount,
+    DefaultGuest,
+)
+from evennia.accounts.models import AccountDB
+from evennia.utils import logger
+
+from world import guest_pool, login_queue
+
+# {password: hash} made ahead for the account being created; see
+# Account.create_deferred and Guest.create_pooled
+_PREHASHED = {}
+
+
+class AccountParent:
+    """
+    A mixin for both Accounts and Guests.
+
+    """
+
+    def set_password(self, password, **kwargs):
+        """
+        Set the password, using the hash made ahead when created through
+        `Account.create_deferred` or `Guest.create_pooled`.
+
+        """
+        hashed = _PREHASHED.pop(password, None) if password else None
+        if hashed is None:
+            super().set_password(password, **kwargs)
+            return
+        # an unusable password is set without hashing anything
+        super().set_password(None, **kwargs)
+        self.password = hashed
+        self._password = password
+
+
+class Account(AccountParent, DefaultAccount):
     """
     An Account is the actual OOC player entity. It doesn't exist in the game,
     but puppets characters.
@@ -136,13 +177,185 @@ class Account(DefaultAccount):
 
     """
 
-    pass
+    @classmethod
+    def authenticate_deferred(cls, username, password, ip="", **kwargs):
+        """
+        Like `authenticate`, but the password is checked in the login queue
+        (see `world/login_queue.py`) instead of being hashed in the reactor.
+
+        Args:
+            username (str): Username of the account.
+            password (str): Password given.
+            ip (str, optional): IP address of the client.
+
+        Keyword Args:
+            session (Session, optional): The session logging in.
+
+        Returns:
+            Deferred: Fires with `(account, errors)` like `authenticate`
+            returns.
+
+        """
+        ip = str(ip) if ip else ""
+        if ip and LOGIN_THROTTLE.check(ip):
+            return defer.succeed(
+                (None, ["Too many login failures; please try again in a few minutes."])
+            )
+        if cls.is_banned(username=username, ip=ip):
+            logger.log_sec(f"Authentication Denied (Banned): {username} (IP: {ip}).")
+            LOGIN_THROTTLE.update(ip, "Too many sightings of banned artifact.")
+            return defer.succeed(
+                (
+                    None,
+                    [
+                        "|rYou have been banned and cannot continue from here."
+                        "\nIf you feel this ban is in error, please email an admin.|x"
+                    ],
+                )
+            )
+
+        account = AccountDB.objects.get_account_from_name(username)
+        # inactive accounts fail like unknown ones, taking as long
+        encoded = account.password if account and account.is_active else None
+        return login_queue.check_password(ip, password, encoded).addCallbacks(
+            cls._at_password_checked,
+            _queue_full,
+            callbackArgs=(account, username, ip, kwargs.get("session")),
+        )
+
+    @classmethod
+    def _at_password_checked(cls, result, account, username, ip, session):
+        valid, new_hash = result
+        if not valid:
+            logger.log_sec(f"Authentication Failure: {username} (IP: {ip}).")
+            if ip:
+                LOGIN_THROTTLE.update(ip, "Too many authentication failures.")
+            if session and account:
+                account.at_failed_login(session)
+            return None, ["Username and/or password is incorrect."]
+        if new_hash:
+            # the hasher settings changed since the password was set
+            account.password = new_hash
+            account.save(update_fields=["password"])
+        logger.log_sec(f"Authentication Success: {account} (IP: {ip}).")
+        return account, []
+
+    @classmethod
+    def create_deferred(cls, **kwargs):
+        """
+        Like `create`, but the password is hashed in the login queue (see
+        `world/login_queue.py`) before the account is created.
 
+        Keyword Args:
+            Same as for `create`.
 
-class Guest(DefaultGuest):
+        Returns:
+            Deferred: Fires with `(account, errors)` like `create` returns.
+
+        """
+        username = kwargs.get("username", "")
+        password = kwargs.get("password", "")
+        ip = str(kwargs.get("ip") or "")
+        if (
+            not password
+            or (ip and CREATION_THROTTLE.check(ip))
+            or not cls.validate_username(username)[0]
+            or not cls.validate_password(password)[0]
+        ):
+            # create() fails before setting a password
+            return defer.succeed(cls.create(**kwargs))
+
+        def _create(hashed):
+            _PREHASHED[password] = hashed
+            try:
+                return cls.create(**kwargs)
+            finally:
+                _PREHASHED.pop(password, None)
+
+        return login_queue.make_password(ip, password).addCallbacks(_create, _queue_full)
+
+
+class Guest(AccountParent, DefaultGuest):
     """
-    This class is used for guest logins. Unlike Accounts, Guests and their
-    characters are deleted after disconnection.
+    This class is used for guest logins. Guests and their characters are
+    kept in a pool (see `world/guest_pool.py`) and reset after
+    disconnection, instead of being created and deleted every time.
     """
 
-    pass
+    @classmethod
+    def create_pooled(cls, username):
+        """
+        Create a guest account and character for the guest pool.
+
+        Args:
+            username (str): The guest name, from `settings.GUEST_LIST`.
+
+        Returns:
+            tuple: `(guest, errors)` like `create` returns.
+
+        """
+        password = "%016x" % getrandbits(64)
+        # nobody logs in to a pooled guest with a password, so skip hashing it
+        _PREHASHED[password] = hashers.make_password(None)
+        try:
+            guest, errors = super(DefaultGuest, cls).create(
+                guest=True,
+                username=username,
+                password=password,
+                permissions=settings.PERMISSION_GUEST_DEFAULT,
+                typeclass=settings.BASE_GUEST_TYPECLASS,
+                home=settings.GUEST_HOME,
+            )
+        finally:
+            _PREHASHED.pop(password, None)
+        if not guest:
+            return None, errors
+        if not guest.characters.all():
+            # as for stock guests, whatever the multisession mode
+            character, errs = guest.create_character()
+            errors.extend(errs)
+            if character:
+                guest.db._last_puppet = character
+        return guest, errors
+
+    @classmethod
+    def authenticate(cls, **kwargs):
+        """
+        Hand out a free guest from the pool.
+
+        Keyword Args:
+            ip (str, optional): IP address of the client.
+
+        Returns:
+            tuple: `(guest, errors)`.
+
+        """
+        if not settings.GUEST_ENABLED:
+            return None, ["Guest accounts are not enabled on this server."]
+        guest = guest_pool.take()
+        if not guest:
+            ip = str(kwargs.get("ip") or "")
+            if ip:
+                LOGIN_THROTTLE.update(ip, "Too many requests for Guest access.")
+            return None, ["All guest accounts are in use. Please try again later."]
+        return guest, []
+
+    def at_post_disconnect(self, **kwargs):
+        """
+        Put the guest back in the pool instead of deleting it.
+
+        """
+        DefaultAccount.at_post_disconnect(self, **kwargs)
+        guest_pool.recycle(self)
+
+    def at_server_shutdown(self):
+        """
+        Keep the guest's characters; the pool resets them at next start.
+
+        """
+        DefaultAccount.at_server_shutdown(self)
+
+
+def _queue_full(failure):
+    failure.trap(login_queue.LoginQueueFull)
+    return None, [failure.getErrorMessage()]
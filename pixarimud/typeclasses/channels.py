@@ -13,6 +13,9 @@ to be modified.
 """
 
 from evennia.comms.comms import DefaultChannel
+from evennia.utils.utils import make_iter
+
+from world import channel_fanout, channel_log
 
 
 class Channel(DefaultChannel):
@@ -115,4 +118,51 @@ class Channel(DefaultChannel):
 
     """
 
-    pass
+    def msg(self, message, senders=None, bypass_mute=False, **kwargs):
+        """
+        Send a message to all non-muted subscribers of the channel. Works as
+        `DefaultChannel.msg`, but the message is rendered once per distinct
+        text and client capability instead of once per subscriber session
+        (see `world/channel_fanout.py`).
+
+        Args:
+            message (str): The message to send.
+            senders (Object, Account or list, optional): Who sends it.
+            bypass_mute (bool, optional): Also send to those who muted the channel.
+            **kwargs: Passed on to all hooks.
+
+        """
+        senders = make_iter(senders) if senders else []
+        if self.send_to_online_only:
+            receivers = self.subscriptions.online()
+        else:
+            receivers = self.subscriptions.all()
+        if not bypass_mute:
+            muted = set(self.mutelist)
+            receivers = [receiver for receiver in receivers if receiver not in muted]
+
+        send_kwargs = {"senders": senders, "bypass_mute": bypass_mute, **kwargs}
+
+        message = self.at_pre_msg(message, **send_kwargs)
+        if message in (None, False):
+            return
+
+        channel_fanout.deliver(self, message, receivers, **send_kwargs)
+
+        self.at_post_msg(message, **send_kwargs)
+
+    def at_post_msg(self, message, **kwargs):
+        """
+        Called after the message was sent. Adds it to the channel's log,
+        which is written in the background (see `world/channel_log.py`).
+
+        Args:
+            message (str): The message sent.
+            **kwargs: As passed to `msg`.
+
+        """
+        log_file = self.get_log_filename()
+        if log_file:
+            senders = ",".join(sender.key for sender in kwargs.get("senders", []))
+            senders = f"{senders}: " if senders else ""
+            channel_log.log(log_file, f"{senders}{message}")
@@ -10,6 +10,9 @@ creation commands.
 
 from evennia.objects.objects import DefaultCharacter
 
+from world import character_profiles, leaderboard
+from world.query_budget import budgeted
+
 from .objects import ObjectParent
 
 
@@ -35,9 +38,10 @@ class Character(ObjectParent, DefaultCharacter):
         self.db.max_health = 100
         self.db.experience = 0
         self.db.level = 1
+        self.db.deaths = 0
         
         # Set respawn location to current location initially
-        self.db.respawn_location = self.location
+        self.db.respawn_location = self.default_respawn_location()
 
     def ensure_stats_initialized(self):
         """
@@ -50,13 +54,44 @@ class Character(ObjectParent, DefaultCharacter):
         if self.db.experience is None:
             self.db.experience = 0
         if self.db.respawn_location is None:
-            self.db.respawn_location = self.location
+            self.db.respawn_location = self.default_respawn_location()
+
+    def default_respawn_location(self):
+        """
+        Get where to respawn without a respawn location of one's own: the
+        current room's `respawn_location`, if it has one (like the arena of
+        the demo world), else the room itself.
+        """
+        location = self.location
+        if location is None:
+            return None
+        return location.db.respawn_location or location
+
+    def reset_stats(self):
+        """
+        Put stats back to those of a new character, as when a pooled guest
+        character is handed to the next guest.
+        """
+        self.db.health = 100
+        self.db.max_health = 100
+        self.db.experience = 0
+        self.db.level = 1
+        self.db.deaths = 0
+        self.db.respawn_location = self.home
+        self.db.respawn_chosen = False
+        leaderboard.record("characters", self, 0, level=1)
+        character_profiles.invalidate(self)
 
     @property
     def level(self):
         """Calculate level based on experience (every 100 XP = 1 level)"""
         self.ensure_stats_initialized()
-        return max(1, (self.db.experience // 100) + 1)
+        return self.level_for(self.db.experience)
+
+    @staticmethod
+    def level_for(experience):
+        """Get the level for an amount of experience."""
+        return max(1, (experience // 100) + 1)
 
     def gain_experience(self, amount):
         """
@@ -66,6 +101,8 @@ class Character(ObjectParent, DefaultCharacter):
         old_level = self.level
         self.db.experience += amount
         new_level = self.level
+        leaderboard.record("characters", self, self.db.experience, level=new_level)
+        character_profiles.invalidate(self)
         
         self.msg(f"You gain {amount} experience! (Total: {self.db.experience})")
         
@@ -113,6 +150,7 @@ class Character(ObjectParent, DefaultCharacter):
         if actual_heal > 0:
             self.msg(f"|gYou heal for {actual_heal} health! ({self.db.health}/{self.db.max_health})|n")
 
+    @budgeted("Character.die")
     def die(self):
         """
         Handle character death and respawn.
@@ -121,13 +159,18 @@ class Character(ObjectParent, DefaultCharacter):
         self.msg("|rYou have died!|n")
         self.location.msg_contents(f"|r{self.key} has died!|n", exclude=self)
         
-        # Move to respawn location
+        # Move to respawn location: the room's, unless one was chosen
+        # with setrespawn
         respawn_loc = self.db.respawn_location
+        if not self.db.respawn_chosen:
+            respawn_loc = self.location.db.respawn_location or respawn_loc
         if respawn_loc:
             self.move_to(respawn_loc, quiet=True)
         
         # Restore to full health
         self.db.health = self.db.max_health
+        self.db.deaths = (self.db.deaths or 0) + 1
+        character_profiles.invalidate(self)
         
         self.msg("|gYou have respawned with full health!|n")
         self.location.msg_contents(f"|g{self.key} has respawned!|n", exclude=self)
@@ -137,6 +180,8 @@ class Character(ObjectParent, DefaultCharacter):
         Set the respawn location for this character.
         """
         self.db.respawn_location = location
+        self.db.respawn_chosen = True
+        character_profiles.invalidate(self)
         self.msg(f"Respawn location set to {location.key}.")
 
     def return_appearance(self, looker, **kwargs):
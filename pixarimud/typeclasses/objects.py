@@ -8,9 +8,17 @@ with a location in the game world (like Characters, Rooms, Exits).
 
 """
 
+from django.conf import settings
+from twisted.internet import reactor
+
 from evennia.objects.objects import DefaultObject
+from evennia.typeclasses.attributes import ModelAttributeBackend
+from evennia.utils.utils import lazy_property
 from evennia import TICKER_HANDLER
 
+from world import appearance_cache, idmapper_cache, leaderboard, room_graph
+from world.dbprofile import BatchedAttributeHandler, BatchedTagHandler
+
 
 class ObjectParent:
     """
@@ -23,6 +31,108 @@ class ObjectParent:
 
     """
 
+    # reuse what return_appearance rendered until something shown changes
+    # (see world/appearance_cache.py); set False on classes whose
+    # get_display_* hooks show state that changes without a save
+    appearance_cacheable = True
+
+    @lazy_property
+    def attributes(self):
+        # Attribute writes in the same reactor tick share one commit
+        return BatchedAttributeHandler(self, ModelAttributeBackend)
+
+    @lazy_property
+    def tags(self):
+        # Tag writes in the same reactor tick share one commit
+        return BatchedTagHandler(self)
+
+    @lazy_property
+    def contents_cache(self):
+        # content moves bump the appearance version
+        return appearance_cache.VersionedContentsHandler(self)
+
+    def at_idmapper_flush(self):
+        """
+        Keep online puppets, their locations and objects with active scripts
+        or tickers in the cache (see `world/idmapper_cache.py`).
+
+        """
+        if idmapper_cache.is_pinned(self):
+            return False
+        return super().at_idmapper_flush()
+
+    def return_appearance(self, looker, **kwargs):
+        """
+        Describe the object, reusing what was rendered for an earlier look
+        by someone of the same permission level if nothing shown has
+        changed since (see `world/appearance_cache.py`).
+
+        """
+        if looker and self.appearance_cacheable and not kwargs:
+            appearance = appearance_cache.render(self, looker)
+            if appearance is not None:
+                return appearance
+        return super().return_appearance(looker, **kwargs)
+
+    def walk_to(self, destination, step_delay=None):
+        """
+        Walk to a room by the shortest route (see `world/room_graph.py`),
+        passing one exit every `step_delay` seconds. Stops if moved off the
+        route some other way, or if an exit can't be passed.
+
+        Args:
+            destination (Room): Where to go.
+            step_delay (float, optional): Seconds per exit. Defaults to
+                `settings.TRAVEL_STEP_DELAY`.
+
+        Returns:
+            tuple or None: The route as `(exit_id, room_id)` steps (empty if
+            already there), or `None` if there is no way.
+
+        """
+        self.stop_walking()
+        route = room_graph.find_path(self.location, destination)
+        if route:
+            step_delay = settings.TRAVEL_STEP_DELAY if step_delay is None else step_delay
+            self.ndb._walk_call = reactor.callLater(
+                step_delay, self._walk_step, list(route), step_delay
+            )
+        return route
+
+    def stop_walking(self):
+        """
+        Stop a walk started with `walk_to`.
+
+        Returns:
+            bool: If walking was stopped.
+
+        """
+        call = self.ndb._walk_call
+        self.ndb._walk_call = None
+        if call and call.active():
+            call.cancel()
+            return True
+        return False
+
+    def _walk_step(self, route, step_delay):
+        self.ndb._walk_call = None
+        exit_id, room_id = route.pop(0)
+        exit_obj = room_graph.get_exit(exit_id)
+        if not exit_obj or not self.location or exit_obj.location != self.location:
+            self.msg("You lose your way and stop.")
+            return
+        if not exit_obj.access(self, "traverse"):
+            exit_obj.at_failed_traverse(self)
+            return
+        exit_obj.at_traverse(self, exit_obj.destination)
+        if not self.location or self.location.id != room_id:
+            # the exit did not take us where it should have
+            return
+        if route:
+            self.ndb._walk_call = reactor.callLater(step_delay, self._walk_step, route, step_delay)
+        else:
+            self.msg("You have arrived.")
+
 
 class Object(ObjectParent, DefaultObject):
     """
@@ -240,6 +350,7 @@ class CombatDummy(Object):
             return
             
         self.db.hits_taken += 1
+        leaderboard.record("dummies", self, self.db.hits_taken)
         
         # Award experience
         attacker.gain_experience(1)
@@ -286,6 +397,7 @@ class BottomlessPit(Object):
         This kills the player, triggering respawn.
         """
         self.db.victims += 1
+        leaderboard.record("pits", self, self.db.victims)
         
         # Dramatic death sequence
         jumper.msg("|rYou leap into the bottomless pit!|n")
@@ -7,6 +7,8 @@ Rooms are simple containers that has no location of their own.
 
 from evennia.objects.objects import DefaultRoom
 
+from world import hibernation
+
 from .objects import ObjectParent
 
 
@@ -21,4 +23,11 @@ class Room(ObjectParent, DefaultRoom):
     properties and methods available on all Objects.
     """
 
-    pass
+    def at_object_receive(self, moved_obj, source_location, move_type="move", **kwargs):
+        """
+        Wake the room's area if it is asleep and a player comes in (see
+        `world/hibernation.py`).
+
+        """
+        super().at_object_receive(moved_obj, source_location, move_type=move_type, **kwargs)
+        hibernation.at_enter(self, moved_obj)
@@ -14,6 +14,8 @@ just overloads its hooks to have it perform its function.
 
 from evennia.scripts.scripts import DefaultScript
 
+from world.script_scheduler import SharedTask
+
 
 class Script(DefaultScript):
     """
@@ -100,4 +102,39 @@ class Script(DefaultScript):
 
     """
 
-    pass
+    # step on a timer shared with other scripts of the same interval (see
+    # world/script_scheduler.py) instead of one of our own
+    shared_timer = True
+    # join the least busy phase of the interval rather than the first due
+    spread_phase = False
+
+    def _use_shared_task(self, interval=None):
+        interval = self.db_interval if interval is None else interval
+        if self.shared_timer and interval and interval > 0 and not self.ndb._task:
+            self.ndb._task = SharedTask(self, spread_phase=self.spread_phase)
+
+    def _start_task(
+        self, interval=None, start_delay=None, repeats=None, force_restart=False, **kwargs
+    ):
+        task = self.ndb._task
+        if (
+            self.shared_timer
+            and task
+            and task.running
+            and (force_restart or (interval, start_delay, repeats) != (None, None, None))
+        ):
+            # restart here, so the new task is shared too
+            self._stop_task()
+        self._use_shared_task(interval)
+        super()._start_task(
+            interval=interval,
+            start_delay=start_delay,
+            repeats=repeats,
+            force_restart=force_restart,
+            **kwargs,
+        )
+
+    def _unpause_task(self, *args, **kwargs):
+        if self.db._paused_time:
+            self._use_shared_task()
+        super()._unpause_task(*args, **kwargs)
@@ -10,10 +10,14 @@ from django.urls import path
 
 from evennia.web.admin.urls import urlpatterns as evennia_admin_urlpatterns
 
+from . import views
+
 # add patterns here
 urlpatterns = [
-    # path("url-pattern", imported_python_view),
-    # path("url-pattern", imported_python_view),
+    # lists for browsing the big tables (see views.py)
+    path("browse/objects/", views.object_list, name="admin-browse-objects"),
+    path("browse/attributes/", views.attribute_list, name="admin-browse-attributes"),
+    path("browse/scripts/", views.script_list, name="admin-browse-scripts"),
 ]
 
 # read by Django
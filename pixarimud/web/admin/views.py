@@ -0,0 +1,377 @@
+"""
+Admin browse views.
+
+Django's admin change lists page with `OFFSET` and count every matching row
+for each page, so with millions of Objects or Attributes every page load
+scans the table (and on SQLite holds up the game while doing it). These
+lists are for browsing the big tables instead:
+
+- Pages are found by primary key (`?after=<id>` / `?before=<id>`), so any
+  page costs the same as the first, however deep.
+- The total is an estimate from the database's statistics (or the highest
+  id), kept for a minute. Filtered lists show no total at all.
+- Filters only use indexed lookups: exact typeclass, key, category, tag or
+  owner id, no substring search.
+- Rows are read as plain values, never as typeclassed entities, so web
+  threads don't load anything into the game's caches.
+
+Each row links to its page in the regular admin for editing.
+
+"""
+
+import time
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import DatabaseError, connection
+from django.db.models import Max
+from django.shortcuts import render
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from evennia.objects.models import ObjectDB
+from evennia.scripts.models import ScriptDB
+from evennia.typeclasses.attributes import Attribute
+
+PAGE_SIZE = 50
+# seconds to keep estimated counts and typeclass lists
+_CACHE_TIME = 60
+# {key: (time, value)}
+_CACHE = {}
+
+
+def _cached(key, func):
+    entry = _CACHE.get(key)
+    if entry and time.time() - entry[0] < _CACHE_TIME:
+        return entry[1]
+    value = func()
+    _CACHE[key] = (time.time(), value)
+    return value
+
+
+def _estimate_count(model):
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+                row = cursor.fetchone()
+                if row and row[0] >= 0:
+                    return row[0]
+            elif connection.vendor == "sqlite":
+                # only there once ANALYZE (or PRAGMA optimize) has run
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+                row = cursor.fetchone()
+                if row:
+                    return int(row[0].split()[0])
+    except DatabaseError:
+        pass
+    # an index lookup; counts deleted rows too
+    return model.objects.aggregate(Max("id"))["id__max"] or 0
+
+
+def approximate_count(model):
+    """
+    Estimate the rows in a table, without counting them.
+
+    Args:
+        model (Model): The table's model.
+
+    Returns:
+        int: The estimate.
+
+    """
+    return _cached(("count", model._meta.db_table), lambda: _estimate_count(model))
+
+
+def get_typeclass_paths(model):
+    """
+    Get the typeclass paths in use in a table, for the typeclass filter.
+
+    """
+    return _cached(
+        ("typeclasses", model._meta.db_table),
+        lambda: sorted(
+            path
+            for path in model.objects.order_by()
+            .values_list("db_typeclass_path", flat=True)
+            .distinct()
+            if path
+        ),
+    )
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def keyset_page(queryset, request, page_size=PAGE_SIZE):
+    """
+    Get one page of rows, newest (highest id) first.
+
+    Args:
+        queryset (QuerySet): A `.values()` queryset including `id`.
+        request (HttpRequest): With `after` (get rows older than this id)
+            or `before` (newer than this id) in its GET, or neither for the
+            first page.
+        page_size (int, optional): Rows per page.
+
+    Returns:
+        tuple: `(rows, newer, older)`, with `newer`/`older` the values for
+        `before`/`after` to get the next pages, or `None` if there are
+        none.
+
+    """
+    before = _int(request.GET.get("before"))
+    after = _int(request.GET.get("after"))
+    if before is not None:
+        rows = list(queryset.filter(id__gt=before).order_by("id")[: page_size + 1])
+        has_newer = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_older = True
+    else:
+        if after is not None:
+            queryset = queryset.filter(id__lt=after)
+        rows = list(queryset.order_by("-id")[: page_size + 1])
+        has_older = len(rows) > page_size
+        rows = rows[:page_size]
+        has_newer = after is not None
+    newer = rows[0]["id"] if rows and has_newer else None
+    older = rows[-1]["id"] if rows and has_older else None
+    return rows, newer, older
+
+
+def _render_list(request, title, model, queryset, filters, columns, get_cells):
+    """
+    Render a browse page.
+
+    Args:
+        title (str): Page title.
+        model (Model): For the total.
+        queryset (QuerySet): The filtered `.values()` rows.
+        filters (list): `(name, label, value, options)` for the filter
+            form; `options` is a list of suggestions or `None`.
+        columns (list): Column headers.
+        get_cells (callable): Called with the page's rows, returns a list
+            of cells per row, each `(text, url or None)`.
+
+    """
+    rows, newer, older = keyset_page(queryset, request)
+    filtered = {name: value for name, _, value, _ in filters if value}
+    context = {
+        "page_title": title,
+        "filters": filters,
+        "columns": columns,
+        "rows": get_cells(rows),
+        "total": None if filtered else approximate_count(model),
+        "newer_url": f"?{urlencode({**filtered, 'before': newer})}" if newer else None,
+        "older_url": f"?{urlencode({**filtered, 'after': older})}" if older else None,
+        "first_url": f"?{urlencode(filtered)}",
+    }
+    return render(request, "admin/browse_list.html", context)
+
+
+def _change_url(model_name, obj_id):
+    return reverse(f"admin:{model_name}_change", args=[obj_id]) if obj_id else None
+
+
+def _filter_tag(queryset, tag, category):
+    """
+    Filter by a tag the way `TagHandler` stores them (lowercase, and a
+    missing category as NULL). Only plain tags match, not aliases or
+    permissions of the same key, so an object is never listed twice.
+
+    """
+    if not tag:
+        return queryset
+    tags = {"db_tags__db_key": tag.lower(), "db_tags__db_tagtype__isnull": True}
+    if category:
+        tags["db_tags__db_category"] = category.lower()
+    else:
+        tags["db_tags__db_category__isnull"] = True
+    return queryset.filter(**tags)
+
+
+@staff_member_required
+def object_list(request):
+    """
+    Browse Objects.
+
+    """
+    get = request.GET
+    typeclass, key = get.get("typeclass", ""), get.get("key", "")
+    location, tag, category = get.get("location", ""), get.get("tag", ""), get.get("category", "")
+
+    queryset = ObjectDB.objects.all()
+    if typeclass:
+        queryset = queryset.filter(db_typeclass_path=typeclass)
+    if key:
+        queryset = queryset.filter(db_key=key)
+    if _int(location) is not None:
+        queryset = queryset.filter(db_location_id=_int(location))
+    queryset = _filter_tag(queryset, tag, category)
+    queryset = queryset.values(
+        "id", "db_key", "db_typeclass_path", "db_location_id", "db_account_id", "db_date_created"
+    )
+
+    def get_cells(rows):
+        return [
+            [
+                (f"#{row['id']}", _change_url("objects_objectdb", row["id"])),
+                (row["db_key"], _change_url("objects_objectdb", row["id"])),
+                (row["db_typeclass_path"], None),
+                (
+                    f"#{row['db_location_id']}" if row["db_location_id"] else "",
+                    _change_url("objects_objectdb", row["db_location_id"]),
+                ),
+                (
+                    f"#{row['db_account_id']}" if row["db_account_id"] else "",
+                    _change_url("accounts_accountdb", row["db_account_id"]),
+                ),
+                (row["db_date_created"].strftime("%Y-%m-%d %H:%M"), None),
+            ]
+            for row in rows
+        ]
+
+    return _render_list(
+        request,
+        "Objects",
+        ObjectDB,
+        queryset,
+        [
+            ("typeclass", "Typeclass", typeclass, get_typeclass_paths(ObjectDB)),
+            ("key", "Key", key, None),
+            ("location", "Location id", location, None),
+            ("tag", "Tag", tag, None),
+            ("category", "Tag category", category, None),
+        ],
+        ["Id", "Key", "Typeclass", "Location", "Account", "Created"],
+        get_cells,
+    )
+
+
+@staff_member_required
+def attribute_list(request):
+    """
+    Browse Attributes. Values are not shown (they are unpickled, and may
+    hold references to entities); see them on their owner's page.
+
+    """
+    get = request.GET
+    key, category, obj, script = (
+        get.get("key", ""),
+        get.get("category", ""),
+        get.get("obj", ""),
+        get.get("script", ""),
+    )
+
+    queryset = Attribute.objects.all()
+    if key:
+        queryset = queryset.filter(db_key=key)
+    if category:
+        queryset = queryset.filter(db_category=category)
+    if _int(obj) is not None:
+        queryset = queryset.filter(objectdb__id=_int(obj))
+    if _int(script) is not None:
+        queryset = queryset.filter(scriptdb__id=_int(script))
+    queryset = queryset.values(
+        "id", "db_key", "db_category", "db_attrtype", "db_model", "db_date_created"
+    )
+
+    def get_cells(rows):
+        # owners of the page's rows, with one query per owner table
+        ids = [row["id"] for row in rows]
+        owners = {}
+        for model, field, admin_name in (
+            (ObjectDB, "objectdb_id", "objects_objectdb"),
+            (ScriptDB, "scriptdb_id", "scripts_scriptdb"),
+        ):
+            through = model.db_attributes.through.objects.filter(attribute_id__in=ids)
+            for attr_id, owner_id in through.values_list("attribute_id", field):
+                owners[attr_id] = (f"#{owner_id}", _change_url(admin_name, owner_id))
+        return [
+            [
+                (f"#{row['id']}", None),
+                (row["db_key"], None),
+                (row["db_category"] or "", None),
+                (row["db_attrtype"] or "", None),
+                owners.get(row["id"], (row["db_model"] or "", None)),
+                (row["db_date_created"].strftime("%Y-%m-%d %H:%M"), None),
+            ]
+            for row in rows
+        ]
+
+    return _render_list(
+        request,
+        "Attributes",
+        Attribute,
+        queryset,
+        [
+            ("key", "Key", key, None),
+            ("category", "Category", category, None),
+            ("obj", "Object id", obj, None),
+            ("script", "Script id", script, None),
+        ],
+        ["Id", "Key", "Category", "Type", "Owner", "Created"],
+        get_cells,
+    )
+
+
+@staff_member_required
+def script_list(request):
+    """
+    Browse Scripts.
+
+    """
+    get = request.GET
+    typeclass, key, obj = get.get("typeclass", ""), get.get("key", ""), get.get("obj", "")
+
+    queryset = ScriptDB.objects.all()
+    if typeclass:
+        queryset = queryset.filter(db_typeclass_path=typeclass)
+    if key:
+        queryset = queryset.filter(db_key=key)
+    if _int(obj) is not None:
+        queryset = queryset.filter(db_obj_id=_int(obj))
+    queryset = queryset.values(
+        "id",
+        "db_key",
+        "db_typeclass_path",
+        "db_obj_id",
+        "db_interval",
+        "db_is_active",
+        "db_date_created",
+    )
+
+    def get_cells(rows):
+        return [
+            [
+                (f"#{row['id']}", _change_url("scripts_scriptdb", row["id"])),
+                (row["db_key"], _change_url("scripts_scriptdb", row["id"])),
+                (row["db_typeclass_path"], None),
+                (
+                    f"#{row['db_obj_id']}" if row["db_obj_id"] else "",
+                    _change_url("objects_objectdb", row["db_obj_id"]),
+                ),
+                (str(row["db_interval"]) if row["db_interval"] else "", None),
+                ("yes" if row["db_is_active"] else "no", None),
+                (row["db_date_created"].strftime("%Y-%m-%d %H:%M"), None),
+            ]
+            for row in rows
+        ]
+
+    return _render_list(
+        request,
+        "Scripts",
+        ScriptDB,
+        queryset,
+        [
+            ("typeclass", "Typeclass", typeclass, get_typeclass_paths(ScriptDB)),
+            ("key", "Key", key, None),
+            ("obj", "Object id", obj, None),
+        ],
+        ["Id", "Key", "Typeclass", "Object", "Interval", "Active", "Created"],
+        get_cells,
+    )
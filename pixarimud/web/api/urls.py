@@ -0,0 +1,17 @@
+"""
+This reroutes from an URL to a python view-function/class.
+
+The main web/urls.py includes these routes for all urls starting with `api/`
+(the `api/` part should not be included again here). Urls not matched here
+go on to Evennia's own REST API, if enabled.
+
+"""
+
+from django.urls import path
+
+from . import views
+
+urlpatterns = [
+    path("leaderboard/", views.leaderboard_index, name="leaderboard-index"),
+    path("leaderboard/<str:board>/", views.leaderboard_board, name="leaderboard-board"),
+]
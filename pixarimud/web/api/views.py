@@ -0,0 +1,57 @@
+"""
+Leaderboard API views.
+
+These only hand out the JSON that `world/leaderboard.py` serialized when a
+board last changed, so polling them never touches the game database.
+
+"""
+
+import json
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_safe
+
+from world import leaderboard
+
+
+@require_safe
+def leaderboard_index(request):
+    """
+    List the boards.
+
+    """
+    boards = [
+        {"board": name, "title": board.title, "url": request.build_absolute_uri(f"{name}/")}
+        for name, board in leaderboard.BOARDS.items()
+    ]
+    response = JsonResponse({"boards": boards})
+    patch_cache_control(response, public=True, max_age=settings.LEADERBOARD_MAX_AGE)
+    return response
+
+
+@require_safe
+def leaderboard_board(request, board):
+    """
+    Get one board, highest score first. Answers `304 Not Modified` when the
+    client's `If-None-Match` has the board's current ETag.
+
+    """
+    published = leaderboard.get_published(board)
+    if published is None:
+        return HttpResponse(
+            json.dumps({"error": f"No leaderboard '{board}'."}),
+            status=404,
+            content_type="application/json",
+        )
+    etag, body = published
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in parse_etags(if_none_match)):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = etag
+    patch_cache_control(response, public=True, max_age=settings.LEADERBOARD_MAX_AGE)
+    return response
@@ -6,7 +6,7 @@ callable class that in turn (usually) makes use of a 'template' (a html file
 with slots that can be replaced by dynamic content) in order to render a HTML
 page to show the user.
 
-This file includes the urls in website, webclient and admin. To override you
+This file includes the urls in website, webclient, admin and api. To override you
 should modify urls.py in those sub directories.
 
 Search the Django documentation for "URL dispatcher" for more help.
@@ -26,6 +26,8 @@ urlpatterns = [
     path("webclient/", include("web.webclient.urls")),
     # web admin
     path("admin/", include("web.admin.urls")),
+    # leaderboard API (the rest of api/ is Evennia's)
+    path("api/", include("web.api.urls")),
     # add any extra urls here:
     # path("mypath/", include("path.to.my.urls.file")),
 ]
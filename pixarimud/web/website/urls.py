@@ -10,10 +10,16 @@ from django.urls import path
 
 from evennia.web.website.urls import urlpatterns as evennia_website_urlpatterns
 
+from .views import profiles
+
 # add patterns here
 urlpatterns = [
-    # path("url-pattern", imported_python_view),
-    # path("url-pattern", imported_python_view),
+    # public, cached character profiles
+    path(
+        "characters/profile/<int:pk>/",
+        profiles.character_profile,
+        name="character-profile",
+    ),
 ]
 
 # read by Django
@@ -0,0 +1,26 @@
+"""
+Public character profile views.
+
+The profile itself is a fragment rendered once and cached by
+`world/character_profiles.py` until the character's stats change, so
+requests (crawlers included) don't read Attributes.
+
+"""
+
+from django.http import Http404
+from django.shortcuts import render
+from django.views.decorators.http import require_safe
+
+from world import character_profiles
+
+
+@require_safe
+def character_profile(request, pk):
+    """
+    Show a character's level, experience, deaths and respawn location.
+
+    """
+    fragment = character_profiles.get_fragment(pk)
+    if fragment is None:
+        raise Http404("No such character.")
+    return render(request, "website/character_profile.html", {"fragment": fragment})
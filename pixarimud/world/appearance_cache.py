@@ -0,0 +1,275 @@
+"""
+Appearance render cache
+
+Every `look` builds an object's full appearance again: its name and desc,
+then the exits, characters and things inside it, each filtered through
+their `view`/`search` locks and named for the looker. Moving triggers a
+look too, so a hub room hundreds of players walk through is rendered
+hundreds of times while it hardly changes.
+
+Here the parts of an appearance are kept between looks, per object and
+per *looker class* - the highest level of `settings.PERMISSION_HIERARCHY`
+the looker has, which is all the default rendering depends on (builders
+see dbrefs, and locks like `view:perm(Builder)` hide things from others).
+
+- Each object has a version, bumped when something it shows changes:
+  contents moving in or out (through its `contents_cache`, see
+  `VersionedContentsHandler`), and saves of the object or of anything in
+  it (renames, lock changes). Its desc is compared as well.
+- Characters come and go much more often than anything else, so they have
+  their own version, and the list of characters is kept apart from the
+  rest: a player walking through a hub only has the character list
+  re-rendered, not the room.
+- Anything inside with `view`/`search` locks that depend on more than
+  permissions (like `view:id(12)` or `view:tag(...)`) makes the object
+  render as usual for as long as that is so. So do `return_appearance`
+  calls with extra keyword arguments, and classes setting
+  `appearance_cacheable = False` (for `get_display_*` hooks showing state
+  that changes without a save, like health).
+
+`typeclasses.objects.ObjectParent.return_appearance` uses this, so class
+overrides calling `super().return_appearance()` (like `CombatDummy`) get
+the cached base appearance and add their own lines to it.
+
+"""
+
+import re
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.db.models.signals import post_save
+
+from evennia.objects.models import ContentsHandler, ObjectDB
+from evennia.utils.utils import iter_to_str
+
+# lock functions whose result only depends on the looker's permission level
+_LEVEL_LOCKFUNCS = ("perm", "perm_above")
+_CONSTANT_LOCKFUNCS = ("all", "none", "true", "false")
+_RE_LOCKFUNC = re.compile(r"(\w+)\s*\(([^)]*)\)")
+_HIERARCHY = [perm.lower() for perm in settings.PERMISSION_HIERARCHY]
+# the checks for each level, from the lowest
+_LEVEL_LOCKSTRINGS = [f"perm({perm})" for perm in settings.PERMISSION_HIERARCHY]
+
+# {obj_id: version}, for all but the characters inside
+_VERSIONS = defaultdict(int)
+# {obj_id: version}, for the characters inside
+_CHARACTER_VERSIONS = defaultdict(int)
+# {(obj_id, looker_class): (version, desc, sections or None)}
+_SECTIONS = OrderedDict()
+# {(obj_id, looker_class): (version, [(character_id, name), ...])}
+_CHARACTERS = OrderedDict()
+_STATS = {"hits": 0, "misses": 0, "uncacheable": 0}
+
+
+def bump(obj_id, characters=False):
+    """
+    Mark what an object shows as changed.
+
+    Args:
+        obj_id (int): The object's id.
+        characters (bool, optional): Only the characters inside changed.
+
+    """
+    if obj_id:
+        _CHARACTER_VERSIONS[obj_id] += 1
+        if not characters:
+            _VERSIONS[obj_id] += 1
+
+
+def _is_character(obj):
+    return "character" in getattr(obj, "_content_types", ())
+
+
+class VersionedContentsHandler(ContentsHandler):
+    """
+    A contents cache that bumps its object's appearance version when
+    contents move in or out.
+
+    """
+
+    def init(self):
+        super().init()
+        bump(self.obj.id)
+
+    def add(self, obj):
+        super().add(obj)
+        bump(self.obj.id, characters=_is_character(obj))
+
+    def remove(self, obj):
+        super().remove(obj)
+        bump(self.obj.id, characters=_is_character(obj))
+
+
+def get_looker_class(looker):
+    """
+    Get the permission level that decides what a looker sees.
+
+    Args:
+        looker (Object): The one looking.
+
+    Returns:
+        int: Index of the highest level of `settings.PERMISSION_HIERARCHY`
+        the looker has, or -1 for none.
+
+    """
+    check = looker.locks.check_lockstring
+    level = -1
+    for lockstring in _LEVEL_LOCKSTRINGS:
+        if not check(looker, lockstring):
+            break
+        level += 1
+    return level
+
+
+def _level_locked(obj):
+    """
+    Check if an object's visibility only depends on the looker's
+    permission level.
+
+    """
+    for access_type in ("view", "search"):
+        lockstring = obj.locks.get(access_type)
+        for funcname, args in _RE_LOCKFUNC.findall(lockstring.split(":", 1)[-1]):
+            if funcname in _CONSTANT_LOCKFUNCS:
+                continue
+            if funcname in _LEVEL_LOCKFUNCS and args.strip().strip("'\"").lower() in _HIERARCHY:
+                continue
+            return False
+    return True
+
+
+def _store(cache, key, entry):
+    cache[key] = entry
+    cache.move_to_end(key)
+    if len(cache) > settings.APPEARANCE_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def _get_sections(obj, looker, looker_class):
+    """
+    Get the parts of the appearance other than the characters, or `None`
+    if something inside is visible only to some lookers of the class.
+
+    """
+    key = (obj.id, looker_class)
+    version = _VERSIONS[obj.id]
+    desc = obj.db.desc
+    entry = _SECTIONS.get(key)
+    if entry and entry[0] == version and entry[1] == desc:
+        _STATS["hits"] += 1
+        _SECTIONS.move_to_end(key)
+        return entry[2]
+
+    _STATS["misses"] += 1
+    sections = None
+    if all(_level_locked(content) for content in obj.contents):
+        sections = {
+            "name": obj.get_display_name(looker),
+            "extra_name_info": obj.get_extra_display_name_info(looker),
+            "desc": obj.get_display_desc(looker),
+            "header": obj.get_display_header(looker),
+            "footer": obj.get_display_footer(looker),
+            "exits": obj.get_display_exits(looker),
+            "things": obj.get_display_things(looker),
+        }
+    _store(_SECTIONS, key, (version, desc, sections))
+    return sections
+
+
+def _get_characters(obj, looker, looker_class):
+    """
+    Get the `(id, name)` of the characters inside visible to a looker's
+    class, or `None` if some are visible only to some lookers of it.
+
+    """
+    key = (obj.id, looker_class)
+    version = _CHARACTER_VERSIONS[obj.id]
+    entry = _CHARACTERS.get(key)
+    if entry and entry[0] == version:
+        _CHARACTERS.move_to_end(key)
+        return entry[1]
+
+    characters = obj.contents_get(content_type="character")
+    if not all(_level_locked(char) for char in characters):
+        return None
+    visible = obj.filter_visible(characters, looker)
+    if (
+        looker in characters
+        and looker.access(looker, "view")
+        and looker.access(looker, "search", default=True)
+    ):
+        # filter_visible leaves out the looker, but others of its class see it
+        visible.append(looker)
+    visible = set(visible)
+    names = [(char.id, char.get_display_name(looker)) for char in characters if char in visible]
+    _store(_CHARACTERS, key, (version, names))
+    return names
+
+
+def render(obj, looker):
+    """
+    Get an object's appearance, from the cache where possible.
+
+    Args:
+        obj (Object): The object looked at.
+        looker (Object): The one looking.
+
+    Returns:
+        str or None: The appearance, as `return_appearance` gives it, or
+        `None` if it can't be cached right now and must be rendered as
+        usual.
+
+    """
+    if looker.location == obj and not _is_character(looker):
+        # it would be left out of the things, but others see it there
+        _STATS["uncacheable"] += 1
+        return None
+    looker_class = get_looker_class(looker)
+    sections = _get_sections(obj, looker, looker_class)
+    characters = _get_characters(obj, looker, looker_class) if sections else None
+    if characters is None:
+        _STATS["uncacheable"] += 1
+        return None
+    names = iter_to_str(name for char_id, name in characters if char_id != looker.id)
+    characters = f"|wCharacters:|n {names}" if names else ""
+    return obj.format_appearance(
+        obj.appearance_template.format(characters=characters, **sections), looker
+    )
+
+
+def _at_object_saved(sender, instance, update_fields=None, **kwargs):
+    if not isinstance(instance, ObjectDB):
+        return
+    if update_fields and set(update_fields) <= {"db_location"}:
+        # moves are picked up by the contents caches
+        return
+    bump(instance.id)
+    bump(instance.db_location_id, characters=_is_character(instance))
+
+
+def install():
+    """
+    Bump versions as objects are saved. Called at server start.
+
+    """
+    # objects are saved as their typeclass, so listen to all senders
+    post_save.connect(_at_object_saved, dispatch_uid="pixarimud_appearance_cache")
+
+
+def stats():
+    """
+    Get cache stats.
+
+    Returns:
+        dict: With keys `size` (cached appearances), `hits`, `misses`,
+        `uncacheable` (looks rendered as usual) and `hit_rate`.
+
+    """
+    lookups = _STATS["hits"] + _STATS["misses"]
+    return {
+        "size": len(_SECTIONS),
+        "hits": _STATS["hits"],
+        "misses": _STATS["misses"],
+        "uncacheable": _STATS["uncacheable"],
+        "hit_rate": _STATS["hits"] / lookups if lookups else 0.0,
+    }
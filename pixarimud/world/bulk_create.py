@@ -0,0 +1,629 @@
+"""
+Bulk object creation
+
+Evennia creates objects one at a time: each new object is saved on its own
+and its creation hooks (`basetype_setup`, `at_object_creation` etc) then
+write locks, cmdsets, Attributes and Tags with a query or two each. That is
+fine for a single `@spawn`, but far too slow for building thousands of rooms
+or filling a zone with dummies.
+
+`bulk_create_objects()` is a bulk version of Evennia's
+`evennia.prototypes.spawner.batch_create_object` and takes the same object
+parameters (as returned by `spawn(..., only_validate=True)`).
+`bulk_spawn()` uses it to create many objects from one prototype, spread
+over a list of locations (`bulkspawn` in-game). All objects are written in
+one transaction with a handful of bulk INSERTs:
+
+1. For each typeclass, one *sample* object is created the normal way inside
+   a savepoint so all creation hooks run as usual. What the hooks wrote
+   (lock string, cmdset storage, Attributes, Tags) is recorded as a
+   `CreationTemplate` and the savepoint is rolled back again.
+2. All objects are inserted with `bulk_create`, then all their Attributes,
+   Tags, aliases and permissions (from the template and from the object
+   parameters) and the links between them.
+
+Creation hooks must therefore give the same result for every object of a
+typeclass. The one exception is the object's location: any Attribute the
+hooks set to the sample's location (like `self.db.respawn_location =
+self.location` in `CombatDummy` and `Character`) is set to each object's
+own location, and an Exit's default destination is its own location.
+Typeclasses whose hooks do anything else per object can set
+`bulk_creatable = False`; those objects are then created one by one (in the
+same transaction). The same fallback is used automatically if the sample
+starts Scripts or tickers, or refers to itself.
+
+"""
+
+from collections import defaultdict
+
+from django.db import connection, transaction
+
+from evennia.objects.models import ObjectDB
+from evennia.prototypes import spawner
+from evennia.scripts.models import ScriptDB
+from evennia.typeclasses.attributes import Attribute
+from evennia.typeclasses.tags import Tag
+from evennia.utils import logger
+from evennia.utils.dbserialize import to_pickle
+from evennia.utils.utils import class_from_module, make_iter
+
+from world import prototype_cache, room_graph
+
+# rows per INSERT statement
+BATCH_SIZE = 500
+
+_MODEL = "objectdb"
+_AttributeLink = ObjectDB.db_attributes.through
+_TagLink = ObjectDB.db_tags.through
+
+
+class CreationTemplate:
+    """
+    What a typeclass' creation hooks write to a new object.
+
+    """
+
+    __slots__ = ("lock_storage", "cmdset_storage", "destination_is_location", "attributes", "tags")
+
+    def __init__(self, lock_storage, cmdset_storage, destination_is_location, attributes, tags):
+        """
+        Args:
+            lock_storage (str): The lock string set by the hooks.
+            cmdset_storage (str): The cmdset storage set by the hooks.
+            destination_is_location (bool): If the hooks set the destination
+                to the location (as Exits do when no destination is given).
+            attributes (list): Tuples `(key, category, db_value, db_strvalue,
+                lock_storage, is_location)`, where `is_location` marks values
+                that should be the new object's location.
+            tags (list): Tuples `(key, category, tagtype, data)`.
+
+        """
+        self.lock_storage = lock_storage
+        self.cmdset_storage = cmdset_storage
+        self.destination_is_location = destination_is_location
+        self.attributes = attributes
+        self.tags = tags
+
+
+def merge_locks(*lockstrings):
+    """
+    Combine lock strings, later locks replacing earlier ones with the same
+    access type (the same result as calling `locks.add()` for each).
+
+    Args:
+        *lockstrings (str): Lock strings like `"get:false();call:true()"`.
+
+    Returns:
+        str: The combined lock string.
+
+    """
+    locks = {}
+    for lockstring in lockstrings:
+        for lockdef in (lockstring or "").split(";"):
+            if ":" in lockdef:
+                access_type = lockdef.split(":", 1)[0].strip()
+                locks[access_type] = lockdef.strip()
+    return ";".join(locks.values())
+
+
+def capture_template(typeclass, create_kwargs):
+    """
+    Run the creation hooks of a typeclass on a sample object and record what
+    they wrote. The sample is rolled back and never shows up in the game.
+
+    Args:
+        typeclass (class): The typeclass.
+        create_kwargs (dict): Database fields (`db_key`, `db_location` etc) to
+            create the sample with, normally those of the first object to create.
+
+    Returns:
+        CreationTemplate or None: The template, or `None` if the hooks did
+        something that can't be replayed in bulk.
+
+    """
+    from evennia import TICKER_HANDLER
+
+    location = create_kwargs.get("db_location")
+    tickers = set(TICKER_HANDLER.ticker_storage)
+    template = None
+    sample = None
+    sample_attrs = []
+    savepoint = transaction.savepoint()
+    try:
+        sample = typeclass(**{**create_kwargs, "db_typeclass_path": typeclass.path})
+        sample.save()
+
+        packed_self = to_pickle(sample)
+        packed_location = to_pickle(location) if location else None
+        attributes = []
+        self_referencing = f"#{sample.id}" in (sample.db_lock_storage or "")
+        sample_attrs = list(sample.db_attributes.all())
+        sample_tags = list(sample.db_tags.all())
+        for attr in sample_attrs:
+            if attr.db_value == packed_self:
+                self_referencing = True
+            attributes.append(
+                (
+                    attr.db_key,
+                    attr.db_category,
+                    attr.db_value,
+                    attr.db_strvalue,
+                    attr.db_lock_storage,
+                    packed_location is not None and attr.db_value == packed_location,
+                )
+            )
+        tags = [
+            (tag.db_key, tag.db_category, tag.db_tagtype, tag.db_data)
+            for tag in sample_tags
+        ]
+        has_scripts = ScriptDB.objects.filter(db_obj=sample).exists()
+        has_tickers = set(TICKER_HANDLER.ticker_storage) != tickers
+
+        if has_scripts or has_tickers or self_referencing:
+            # delete properly so scripts are stopped, then drop any new tickers
+            sample.delete()
+            for store_key in set(TICKER_HANDLER.ticker_storage) - tickers:
+                TICKER_HANDLER.remove(store_key=store_key)
+        else:
+            template = CreationTemplate(
+                sample.db_lock_storage,
+                sample.db_cmdset_storage,
+                bool(location) and sample.db_destination_id == location.id,
+                attributes,
+                tags,
+            )
+    finally:
+        transaction.savepoint_rollback(savepoint)
+        if sample is not None:
+            # forget the rolled-back sample and its Attributes
+            for attr in sample_attrs:
+                Attribute.flush_cached_instance(attr, force=True)
+            if location and "contents_cache" in location.__dict__:
+                location.contents_cache.remove(sample)
+            ObjectDB.flush_cached_instance(sample, force=True)
+    return template
+
+
+def _get_or_create_tags(tagdefs, model=_MODEL):
+    """
+    Get Tag objects, creating those that don't exist yet.
+
+    Args:
+        tagdefs (dict): `{(key, category, tagtype): data}`.
+        model (str, optional): The model the tags are for, like `"scriptdb"`.
+
+    Returns:
+        dict: `{(key, category, tagtype): Tag}`.
+
+    """
+    tags = {}
+    keys = list({key for key, _, _ in tagdefs})
+    for istart in range(0, len(keys), BATCH_SIZE):
+        for tag in Tag.objects.filter(db_model=model, db_key__in=keys[istart : istart + BATCH_SIZE]):
+            tagdef = (tag.db_key, tag.db_category, tag.db_tagtype)
+            if tagdef in tagdefs:
+                tags[tagdef] = tag
+
+    # as for create_tag, given data replaces the data of existing tags
+    changed = []
+    for tagdef, tag in tags.items():
+        data = tagdefs[tagdef]
+        if data is not None and tag.db_data != data:
+            tag.db_data = data
+            changed.append(tag)
+    if changed:
+        Tag.objects.bulk_update(changed, ["db_data"], batch_size=BATCH_SIZE)
+
+    new_tags = [
+        Tag(db_key=key, db_category=category, db_tagtype=tagtype, db_data=data, db_model=model)
+        for (key, category, tagtype), data in tagdefs.items()
+        if (key, category, tagtype) not in tags
+    ]
+    for tag in Tag.objects.bulk_create(new_tags, batch_size=BATCH_SIZE):
+        tags[(tag.db_key, tag.db_category, tag.db_tagtype)] = tag
+    return tags
+
+
+def _normalize(key, category=None):
+    key = str(key).strip().lower()
+    category = str(category).strip().lower() if category else None
+    return key, category
+
+
+def get_tagdefs(permissions=(), aliases=(), tags=(), template=None):
+    """
+    Get the normalized tag definitions for one object.
+
+    Args:
+        permissions (str or list, optional): Permission strings.
+        aliases (str or list, optional): Aliases.
+        tags (list, optional): Tags as `key`, `(key,)`, `(key, category)` or
+            `(key, category, data)`, as in prototypes.
+        template (CreationTemplate, optional): Template whose tags come first.
+
+    Returns:
+        dict: `{(key, category, tagtype): data}`, as used by `bulk_set_tags`.
+
+    """
+    tagdefs = {}
+    if template:
+        for key, category, tagtype, data in template.tags:
+            tagdefs[(key, category, tagtype)] = data
+    for perm in make_iter(permissions):
+        if perm:
+            tagdefs[(*_normalize(perm), "permission")] = None
+    for alias in make_iter(aliases):
+        if alias:
+            tagdefs[(*_normalize(alias), "alias")] = None
+    for tag in make_iter(tags):
+        if isinstance(tag, str):
+            tag = (tag,)
+        key, category, data = (tuple(tag) + (None, None))[:3]
+        if key:
+            tagdefs[(*_normalize(key, category), None)] = str(data) if data is not None else None
+    return tagdefs
+
+
+def _object_attributes(template, obj, attributes):
+    """
+    Get the Attributes for one object: those from the template, then those
+    given for the object.
+
+    Returns:
+        list: Unsaved `Attribute` instances.
+
+    """
+    attrs = {}
+    for key, category, db_value, db_strvalue, lock_storage, is_location in template.attributes:
+        if is_location:
+            db_value = to_pickle(obj.db_location) if obj.db_location else None
+        attrs[(key, category)] = (db_value, db_strvalue, lock_storage)
+    for attrname, value, *rest in attributes:
+        category = rest[0] if rest else None
+        locks = rest[1] if len(rest) > 1 else None
+        attrs[_normalize(attrname, category)] = (to_pickle(value), None, locks or "")
+    return [
+        Attribute(
+            db_key=key,
+            db_category=category,
+            db_value=db_value,
+            db_strvalue=db_strvalue,
+            db_lock_storage=lock_storage,
+            db_model=_MODEL,
+        )
+        for (key, category), (db_value, db_strvalue, lock_storage) in attrs.items()
+    ]
+
+
+def _bulk_create_group(typeclass, template, objparams):
+    """
+    Bulk-create objects of one typeclass from a template.
+
+    """
+    objs = []
+    for create_kwargs, _, lock_string, *_ in objparams:
+        kwargs = dict(create_kwargs)
+        kwargs["db_typeclass_path"] = typeclass.path
+        kwargs["db_lock_storage"] = merge_locks(template.lock_storage, lock_string)
+        kwargs["db_cmdset_storage"] = template.cmdset_storage
+        if template.destination_is_location and not kwargs.get("db_destination"):
+            kwargs["db_destination"] = kwargs.get("db_location")
+        objs.append(typeclass(**kwargs))
+    ObjectDB.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+
+    attr_objs = []
+    tagdefs = {}
+    obj_tags = []
+    for obj, (_, permissions, _, aliases, _, attributes, tags, _) in zip(objs, objparams):
+        new_attrs = _object_attributes(template, obj, attributes)
+        attr_objs.append(new_attrs)
+        object_tagdefs = get_tagdefs(permissions, aliases, tags, template=template)
+        tagdefs.update(object_tagdefs)
+        obj_tags.append(object_tagdefs)
+
+    Attribute.objects.bulk_create(
+        [attr for new_attrs in attr_objs for attr in new_attrs], batch_size=BATCH_SIZE
+    )
+    _AttributeLink.objects.bulk_create(
+        [
+            _AttributeLink(objectdb_id=obj.id, attribute_id=attr.id)
+            for obj, new_attrs in zip(objs, attr_objs)
+            for attr in new_attrs
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+    tag_objs = _get_or_create_tags(tagdefs)
+    _TagLink.objects.bulk_create(
+        [
+            _TagLink(objectdb_id=obj.id, tag_id=tag_objs[tagdef].id)
+            for obj, object_tagdefs in zip(objs, obj_tags)
+            for tagdef in object_tagdefs
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    return objs
+
+
+def _id(obj):
+    return obj if isinstance(obj, int) else obj.id
+
+
+def _reset_caches(objs, *handlers):
+    """
+    Make cached instances re-read the given handlers from the database.
+
+    """
+    for obj in objs:
+        cached = ObjectDB.get_cached_instance(_id(obj))
+        if cached is None or (not isinstance(obj, int) and cached is not obj):
+            continue
+        for handler in handlers:
+            if handler in cached.__dict__:
+                cached.__dict__[handler].reset_cache()
+
+
+def bulk_set_attributes(items, dry_run=False):
+    """
+    Add or replace Attributes on many objects, with bulk queries.
+
+    Args:
+        items (list): Tuples `(obj, attributes)`, where `obj` is an object or
+            object id and `attributes` is a list of `(attrname, value)`,
+            `(attrname, value, category)` or `(attrname, value, category,
+            locks)`, as for `attributes.batch_add`.
+        dry_run (bool, optional): Only find out which objects would change.
+
+    Returns:
+        set: Ids of the objects whose Attributes changed.
+
+    """
+    wanted = {}
+    for obj, attributes in items:
+        for attrname, value, *rest in attributes:
+            key, category = _normalize(attrname, rest[0] if rest else None)
+            locks = rest[1] if len(rest) > 1 else ""
+            wanted[(_id(obj), key, category)] = (to_pickle(value), locks or "")
+    if not wanted:
+        return set()
+
+    ids = list({obj_id for obj_id, _, _ in wanted})
+    existing = {}
+    attr_owner = {}
+    for istart in range(0, len(ids), BATCH_SIZE):
+        # two simple indexed lookups; a join filtering on the key is much slower in SQLite
+        attr_owner.update(
+            (attr_id, obj_id)
+            for obj_id, attr_id in _AttributeLink.objects.filter(
+                objectdb_id__in=ids[istart : istart + BATCH_SIZE]
+            ).values_list("objectdb_id", "attribute_id")
+        )
+    attr_ids = list(attr_owner)
+    keys = list({key for _, key, _ in wanted})
+    for istart in range(0, len(attr_ids), BATCH_SIZE):
+        for attr in Attribute.objects.filter(
+            id__in=attr_ids[istart : istart + BATCH_SIZE], db_key__in=keys
+        ):
+            existing[(attr_owner[attr.id], attr.db_key, attr.db_category)] = attr
+
+    changed = []
+    new_attrs = []
+    for (obj_id, key, category), (db_value, locks) in wanted.items():
+        attr = existing.get((obj_id, key, category))
+        if attr is None:
+            new_attrs.append(
+                (
+                    obj_id,
+                    Attribute(
+                        db_key=key,
+                        db_category=category,
+                        db_value=db_value,
+                        db_lock_storage=locks,
+                        db_model=_MODEL,
+                    ),
+                )
+            )
+        elif attr.db_value != db_value or attr.db_strvalue is not None or (
+            locks and attr.db_lock_storage != locks
+        ):
+            changed.append((attr, db_value, locks))
+
+    changed_ids = {obj_id for obj_id, _ in new_attrs}
+    changed_ids.update(attr_owner[attr.id] for attr, _, _ in changed)
+    if dry_run:
+        return changed_ids
+
+    # Attributes getting the same value are updated together, which is much
+    # faster than bulk_update's per-row CASE expressions
+    groups = defaultdict(list)
+    for attr, db_value, locks in changed:
+        attr.db_value = db_value
+        attr.db_strvalue = None
+        attr.db_lock_storage = locks or attr.db_lock_storage
+        group = (type(db_value), db_value, attr.db_lock_storage)
+        try:
+            hash(group)
+        except TypeError:
+            # unhashable values are only grouped with the very same object
+            group = (id(db_value), attr.db_lock_storage)
+        groups[group].append(attr)
+    single = []
+    for attrs in groups.values():
+        if len(attrs) == 1:
+            single.extend(attrs)
+            continue
+        for istart in range(0, len(attrs), BATCH_SIZE):
+            Attribute.objects.filter(
+                id__in=[attr.id for attr in attrs[istart : istart + BATCH_SIZE]]
+            ).update(
+                db_value=attrs[0].db_value,
+                db_strvalue=None,
+                db_lock_storage=attrs[0].db_lock_storage,
+            )
+    Attribute.objects.bulk_update(
+        single, ["db_value", "db_strvalue", "db_lock_storage"], batch_size=BATCH_SIZE
+    )
+    Attribute.objects.bulk_create([attr for _, attr in new_attrs], batch_size=BATCH_SIZE)
+    _AttributeLink.objects.bulk_create(
+        [_AttributeLink(objectdb_id=obj_id, attribute_id=attr.id) for obj_id, attr in new_attrs],
+        batch_size=BATCH_SIZE,
+    )
+    _reset_caches([obj for obj, _ in items], "attributes")
+    return changed_ids
+
+
+def bulk_set_tags(items, replace_tagtypes=(), dry_run=False):
+    """
+    Add Tags, aliases and permissions to many objects, with bulk queries.
+
+    Args:
+        items (list): Tuples `(obj, tagdefs)`, where `obj` is an object or
+            object id and `tagdefs` is a dict `{(key, category, tagtype):
+            data}`; `tagtype` is `None` for normal Tags, `"alias"` for
+            aliases and `"permission"` for permissions.
+        replace_tagtypes (tuple, optional): Tag types (like `("alias",)`) for
+            which the objects should end up with *only* the given tags;
+            others of those types are removed.
+        dry_run (bool, optional): Only find out which objects would change.
+
+    Returns:
+        set: Ids of the objects whose tags changed.
+
+    """
+    ids = list({_id(obj) for obj, _ in items})
+    current = defaultdict(dict)
+    for istart in range(0, len(ids), BATCH_SIZE):
+        links = _TagLink.objects.filter(
+            objectdb_id__in=ids[istart : istart + BATCH_SIZE]
+        ).values_list("id", "objectdb_id", "tag__db_key", "tag__db_category", "tag__db_tagtype")
+        for link_id, obj_id, *tagdef in links:
+            current[obj_id][tuple(tagdef)] = link_id
+
+    new_links = []
+    stale_links = []
+    changed_ids = set()
+    for obj, object_tagdefs in items:
+        obj_id = _id(obj)
+        obj_current = current[obj_id]
+        for tagdef in object_tagdefs:
+            if tagdef not in obj_current:
+                new_links.append((obj_id, tagdef))
+                obj_current[tagdef] = None
+                changed_ids.add(obj_id)
+        for tagdef, link_id in obj_current.items():
+            if link_id and tagdef[2] in replace_tagtypes and tagdef not in object_tagdefs:
+                stale_links.append(link_id)
+                changed_ids.add(obj_id)
+    if dry_run:
+        return changed_ids
+
+    tagdefs = {}
+    for _, object_tagdefs in items:
+        tagdefs.update(object_tagdefs)
+    tag_objs = _get_or_create_tags(tagdefs)
+    _TagLink.objects.bulk_create(
+        [_TagLink(objectdb_id=obj_id, tag_id=tag_objs[tagdef].id) for obj_id, tagdef in new_links],
+        batch_size=BATCH_SIZE,
+    )
+    for istart in range(0, len(stale_links), BATCH_SIZE):
+        _TagLink.objects.filter(id__in=stale_links[istart : istart + BATCH_SIZE]).delete()
+    _reset_caches([obj for obj, _ in items], "tags", "aliases", "permissions")
+    return changed_ids
+
+
+def bulk_create_objects(*objparams):
+    """
+    Create many objects in one transaction, using bulk inserts where possible.
+    This takes the same input as `evennia.prototypes.spawner.batch_create_object`.
+
+    Args:
+        *objparams (tuple): Each a tuple `(create_kwargs, permissions, locks,
+            aliases, nattributes, attributes, tags, execs)`, as returned by
+            `spawn(..., only_validate=True)`.
+
+    Returns:
+        list: The new objects, in the same order as `objparams`.
+
+    Notes:
+        The `exec` entries run arbitrary python code, so don't let
+        unprivileged users provide them!
+
+    """
+    import evennia
+
+    if not connection.features.can_return_rows_from_bulk_insert:
+        # we need the ids of the inserted objects
+        with transaction.atomic():
+            return spawner.batch_create_object(*objparams)
+
+    groups = defaultdict(list)
+    for inum, objparam in enumerate(objparams):
+        groups[objparam[0]["db_typeclass_path"]].append(inum)
+
+    results = [None] * len(objparams)
+    with transaction.atomic():
+        for typeclass_path, indices in groups.items():
+            typeclass = class_from_module(typeclass_path)
+            group = [objparams[inum] for inum in indices]
+            template = None
+            if getattr(typeclass, "bulk_creatable", True):
+                template = capture_template(typeclass, group[0][0])
+            if template is None:
+                logger.log_info(
+                    f"bulk_create_objects: creating {len(group)} {typeclass_path} one by one."
+                )
+                objs = spawner.batch_create_object(*group)
+            else:
+                objs = _bulk_create_group(typeclass, template, group)
+                for obj, objparam in zip(objs, group):
+                    ObjectDB.cache_instance(obj, new=True)
+                    location = obj.db_location
+                    if location and "contents_cache" in location.__dict__:
+                        location.contents_cache.add(obj)
+                    for key, value in objparam[4].items():
+                        obj.nattributes.add(key, value)
+                    for code in objparam[7]:
+                        if code:
+                            exec(code, {}, {"evennia": evennia, "obj": obj})
+                    if spawn_hook := getattr(obj, "at_object_post_spawn", None):
+                        spawn_hook()
+            for inum, obj in zip(indices, objs):
+                results[inum] = obj
+    if any(objparam[0].get("db_destination") for objparam in objparams):
+        # the bulk inserts sent no signals
+        room_graph.invalidate()
+    return results
+
+
+def bulk_spawn(prototype, count, locations=None, caller=None):
+    """
+    Spawn many objects from one prototype in one transaction.
+
+    Args:
+        prototype (str or dict): A prototype key, like `"COMBAT_DUMMY"`, or a
+            prototype dict.
+        count (int): How many objects to spawn.
+        locations (list, optional): Locations to put the objects in, in
+            turn, so they are spread evenly. If not given, the prototype's own
+            `location` is used, if any.
+        caller (Object or Account, optional): Passed on to protfuncs for
+            access checks, as for `spawn`.
+
+    Returns:
+        list: The new objects.
+
+    Raises:
+        KeyError: If the prototype key is not found.
+        RuntimeError: If the prototype is invalid.
+
+    """
+    if isinstance(prototype, str):
+        prototype = prototype_cache.get_flattened(prototype)
+    locations = list(locations or [])
+    objparams = spawner.spawn(
+        *(prototype for _ in range(count)), caller=caller, only_validate=True
+    )
+    if locations:
+        for inum, objparam in enumerate(objparams):
+            objparam[0]["db_location"] = locations[inum % len(locations)]
+    return bulk_create_objects(*objparams)
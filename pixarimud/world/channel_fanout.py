@@ -0,0 +1,133 @@
+"""
+Channel fan-out
+
+Evennia delivers a channel message by calling `channel_msg` on every
+subscriber, which goes through `Account.msg` to each of its sessions; the
+Portal then renders the markup again for every single session. On a busy
+public channel that is one full render per listener.
+
+`deliver()` (used by `typeclasses.channels.Channel.msg`) still runs each
+subscriber's `at_pre_channel_msg` and `at_post_channel_msg` hooks, but
+groups the sessions of all subscribers by the text they are to get and by
+client capability (see `world/text_variants.py`). Each distinct text is
+rendered once per capability and sent pre-rendered to all sessions of its
+group, so a channel with thousands of listeners costs a handful of renders.
+
+Subscribers get the normal `channel_msg` instead if their typeclass changes
+how messages reach them (overrides `msg`, `channel_msg` or
+`at_msg_receive`), and so does everyone if a sender overrides
+`at_msg_send`. Sessions no variant fits, and messages with `$funcs` for
+the outgoing FuncParser, are also sent the normal way.
+
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+
+from evennia.accounts.accounts import DefaultAccount
+from evennia.objects.objects import DefaultObject
+from evennia.utils import logger
+
+from world.text_variants import RAW_OPTIONS, render_variant, session_variant
+
+# methods whose stock versions the fast path replaces
+_RECEIVER_METHODS = ("msg", "channel_msg", "at_msg_receive")
+# {class: bool}
+_FAST_CLASSES = {}
+
+
+def _is_fast(cls):
+    """
+    Check if a subscriber class delivers channel messages the stock way.
+
+    """
+    fast = _FAST_CLASSES.get(cls)
+    if fast is None:
+        fast = issubclass(cls, DefaultAccount) and all(
+            getattr(cls, name) is getattr(DefaultAccount, name) for name in _RECEIVER_METHODS
+        )
+        _FAST_CLASSES[cls] = fast
+    return fast
+
+
+def _stock_senders(senders):
+    for sender in senders:
+        stock = DefaultAccount if isinstance(sender, DefaultAccount) else DefaultObject
+        if getattr(type(sender), "at_msg_send", None) is not getattr(stock, "at_msg_send"):
+            return False
+    return True
+
+
+def deliver(channel, message, receivers, **send_kwargs):
+    """
+    Send a channel message to subscribers, rendering it once per distinct
+    text and client capability.
+
+    Args:
+        channel (Channel): The channel sending.
+        message (str): The message, after the channel's `at_pre_msg`.
+        receivers (list): The subscribers to send to.
+        **send_kwargs: Passed to the subscribers' channel hooks, as for
+            `DefaultChannel.msg` (`senders`, `bypass_mute` etc).
+
+    Returns:
+        dict: Stats with keys `receivers`, `sessions` (sent pre-rendered),
+        `renders` and `fallbacks` (subscribers or sessions sent to the normal
+        way).
+
+    """
+    fast_senders = _stock_senders(send_kwargs.get("senders") or ())
+    skip_funcparser = not (
+        settings.FUNCPARSER_PARSE_OUTGOING_MESSAGES_ENABLED and "$" in message
+    )
+    channel_kwargs = {"from_channel": channel.id}
+    options = {**RAW_OPTIONS, **channel_kwargs}
+    fallback_options = dict(channel_kwargs)
+
+    # {(text, variant): [session, ...]}
+    groups = defaultdict(list)
+    delivered = []
+    stats = {"receivers": 0, "sessions": 0, "renders": 0, "fallbacks": 0}
+    for receiver in receivers:
+        try:
+            recv_message = receiver.at_pre_channel_msg(message, channel, **send_kwargs)
+            if recv_message in (None, False):
+                continue
+            stats["receivers"] += 1
+            if not (fast_senders and skip_funcparser and _is_fast(type(receiver))):
+                receiver.channel_msg(recv_message, channel, **send_kwargs)
+                receiver.at_post_channel_msg(recv_message, channel, **send_kwargs)
+                stats["fallbacks"] += 1
+                continue
+            if not receiver.at_msg_receive(text=recv_message, from_obj=send_kwargs.get("senders")):
+                continue
+            for session in receiver.sessions.all():
+                variant = session_variant(session)
+                if variant:
+                    groups[(recv_message, variant)].append(session)
+                else:
+                    session.data_out(
+                        text=(recv_message, channel_kwargs), options=fallback_options
+                    )
+                    stats["fallbacks"] += 1
+            delivered.append((receiver, recv_message))
+        except Exception:
+            logger.log_trace(f"Error sending channel message to {receiver}.")
+
+    for (text, variant), sessions in groups.items():
+        rendered = render_variant(text, variant)
+        stats["renders"] += 1
+        for session in sessions:
+            try:
+                session.data_out(text=(rendered, channel_kwargs), options=options)
+            except Exception:
+                logger.log_trace(f"Error sending channel message to {session}.")
+        stats["sessions"] += len(sessions)
+
+    for receiver, recv_message in delivered:
+        try:
+            receiver.at_post_channel_msg(recv_message, channel, **send_kwargs)
+        except Exception:
+            logger.log_trace(f"Error in at_post_channel_msg of {receiver}.")
+    return stats
@@ -0,0 +1,446 @@
+"""
+Channel logs
+
+Evennia appends every channel message to the channel's log file as it is
+sent, and `channel/history` reads the log file to find the last lines. This
+module replaces both:
+
+- `log()` buffers messages per log file. The buffer is written by a
+  background thread when it reaches `settings.CHANNEL_LOG_BUFFER_SIZE`
+  bytes, or `settings.CHANNEL_LOG_FLUSH_INTERVAL` seconds after the first
+  buffered message. A log file going over `settings.CHANNEL_LOG_ROTATE_SIZE`
+  is rotated to `<file>.1`, `<file>.2` ... keeping
+  `settings.CHANNEL_LOG_BACKUPS` old files.
+- Next to each log file, `<file>.idx` holds a fixed-size entry (timestamp,
+  byte offset) per message, so `tail()` ("the last N messages") and
+  `since()` ("all messages since T") seek straight to the messages they
+  need instead of reading the whole log.
+
+The log lines keep Evennia's `<time> [-] <message>` format. A log without an
+index (like one written before this module was used) is indexed once, the
+first time it is written to or read. All file access, including reads, runs
+in one background thread in order, so a read always sees the messages
+logged before it:
+
+    from world import channel_log
+
+    channel_log.log("channel_public.log", "Griatch: Hello!")
+    channel_log.tail("channel_public.log", 20).addCallback(show)
+
+`typeclasses.channels.Channel` logs through this module and
+`commands.command.CmdChannel` reads the history from it. Buffered messages
+are written at server stop.
+
+"""
+
+import os
+import re
+import struct
+import threading
+import time
+
+from django.conf import settings
+from twisted.internet import reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+from evennia.utils import logger
+
+# index entry: timestamp, byte offset of the message in the log
+_ENTRY = struct.Struct(">dQ")
+_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+_RE_RECORD_START = re.compile(rb"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})")
+
+# {path: ChannelLog}
+_LOGS = {}
+_POOL = None
+
+
+def _get_pool():
+    """
+    Get the single-thread pool doing all channel log file access.
+
+    """
+    global _POOL
+    if _POOL is None:
+        _POOL = ThreadPool(minthreads=1, maxthreads=1, name="channel_log")
+        _POOL.start()
+        reactor.addSystemEventTrigger("during", "shutdown", _POOL.stop)
+    return _POOL
+
+
+def _in_thread(func, *args, **kwargs):
+    """
+    Run a function in the log thread.
+
+    Returns:
+        Deferred: Fires with the function's return value.
+
+    """
+    return threads.deferToThreadPool(reactor, _get_pool(), func, *args, **kwargs)
+
+
+def _record_time(line):
+    """
+    Get the time of a log line starting a message, or `None` for lines
+    continuing a multi-line message.
+
+    """
+    match = _RE_RECORD_START.match(line)
+    if not match:
+        return None
+    try:
+        return time.mktime(time.strptime(match.group(1).decode("ascii"), _TIME_FORMAT))
+    except ValueError:
+        return None
+
+
+class ChannelLog:
+    """
+    A buffered, indexed channel log file.
+
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Full path to the log file.
+
+        """
+        self.path = path
+        # (timestamp, encoded line) of messages not yet written
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._buffer_lock = threading.Lock()
+        # held while writing, so flushes write in order
+        self._write_lock = threading.Lock()
+        self._flush_call = None
+        self._flush_queued = False
+        self._index_checked = False
+
+    # paths
+
+    def _paths(self):
+        """
+        The log file and its backups, newest first.
+
+        """
+        return [self.path] + [
+            f"{self.path}.{num}" for num in range(1, settings.CHANNEL_LOG_BACKUPS + 1)
+        ]
+
+    @staticmethod
+    def _index_path(path):
+        return f"{path}.idx"
+
+    # writing
+
+    def log(self, message, timestamp=None):
+        """
+        Add a message to the log. Call from the reactor thread.
+
+        Args:
+            message (str): The message.
+            timestamp (float, optional): When it was sent. Defaults to now.
+
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        stamp = time.strftime(_TIME_FORMAT, time.localtime(timestamp))
+        line = f"{stamp} [-] {message.strip()}\n".encode("utf-8")
+        with self._buffer_lock:
+            self._buffer.append((timestamp, line))
+            self._buffered_bytes += len(line)
+            full = self._buffered_bytes >= settings.CHANNEL_LOG_BUFFER_SIZE
+
+        if not reactor.running:
+            # like in `evennia shell`; nothing would ever flush
+            self.flush()
+        elif full:
+            self._queue_flush()
+        elif not self._flush_call and not self._flush_queued:
+            self._flush_call = reactor.callLater(
+                settings.CHANNEL_LOG_FLUSH_INTERVAL, self._queue_flush
+            )
+
+    def _queue_flush(self):
+        if self._flush_call and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+        if self._flush_queued:
+            return
+        self._flush_queued = True
+        _in_thread(self.flush).addErrback(
+            lambda failure: logger.log_err(
+                f"Could not write channel log {self.path}: {failure.getErrorMessage()}"
+            )
+        )
+
+    def flush(self):
+        """
+        Write all buffered messages now. Runs in the log thread, or in the
+        reactor thread at shutdown.
+
+        """
+        with self._write_lock:
+            with self._buffer_lock:
+                records = self._buffer
+                self._buffer = []
+                self._buffered_bytes = 0
+                self._flush_queued = False
+            if records:
+                self._write(records)
+
+    def _write(self, records):
+        self._check_index()
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        data = b"".join(line for _, line in records)
+        if size and size + len(data) > settings.CHANNEL_LOG_ROTATE_SIZE:
+            self._rotate()
+            size = 0
+        entries = []
+        offset = size
+        for timestamp, line in records:
+            entries.append(_ENTRY.pack(timestamp, offset))
+            offset += len(line)
+        with open(self.path, "ab") as fil:
+            fil.write(data)
+        with open(self._index_path(self.path), "ab") as fil:
+            fil.write(b"".join(entries))
+
+    def _rotate(self):
+        paths = self._paths()
+        for older, newer in reversed(list(zip(paths[1:], paths[:-1]))):
+            for suffix in ("", ".idx"):
+                if os.path.exists(newer + suffix):
+                    os.replace(newer + suffix, older + suffix)
+        if len(paths) == 1:
+            for path in (self.path, self._index_path(self.path)):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _check_index(self):
+        """
+        Index any messages of the current log file missing from its index,
+        (re)building the index if needed. Done once per server run.
+
+        """
+        if self._index_checked:
+            return
+        self._index_checked = True
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        index_path = self._index_path(self.path)
+        count, last = self._count(self.path), None
+        if count:
+            last = self._entry(self.path, count - 1)
+        if last and last[1] >= size:
+            # the log was truncated or replaced; start over
+            count, last = 0, None
+            os.remove(index_path)
+
+        entries = []
+        with open(self.path, "rb") as fil:
+            offset = last[1] if last else 0
+            fil.seek(offset)
+            first = True
+            for line in fil:
+                timestamp = _record_time(line)
+                # the first line is the already indexed message
+                if timestamp is not None and not (first and last):
+                    entries.append(_ENTRY.pack(timestamp, offset))
+                first = False
+                offset += len(line)
+        if entries:
+            with open(index_path, "ab") as fil:
+                fil.write(b"".join(entries))
+
+    # reading
+
+    def _count(self, path):
+        index_path = self._index_path(path)
+        if not os.path.exists(index_path):
+            return 0
+        return os.path.getsize(index_path) // _ENTRY.size
+
+    def _entry(self, path, inum):
+        with open(self._index_path(path), "rb") as fil:
+            fil.seek(inum * _ENTRY.size)
+            return _ENTRY.unpack(fil.read(_ENTRY.size))
+
+    def _read(self, path, start, stop):
+        """
+        Read messages number `start` to `stop` (not included) of a log file.
+
+        Returns:
+            list: `(timestamp, text)` tuples, oldest first.
+
+        """
+        count = self._count(path)
+        stop = min(stop, count)
+        if start >= stop:
+            return []
+        with open(self._index_path(path), "rb") as fil:
+            fil.seek(start * _ENTRY.size)
+            raw = fil.read((stop - start + (stop < count)) * _ENTRY.size)
+        entries = [_ENTRY.unpack_from(raw, pos) for pos in range(0, len(raw), _ENTRY.size)]
+        with open(path, "rb") as fil:
+            fil.seek(entries[0][1])
+            if stop < count:
+                data = fil.read(entries[-1][1] - entries[0][1])
+                entries = entries[:-1]
+            else:
+                data = fil.read()
+        base = entries[0][1]
+        ends = [offset - base for _, offset in entries[1:]] + [len(data)]
+        return [
+            (timestamp, data[offset - base : end].decode("utf-8", errors="replace").rstrip("\n"))
+            for (timestamp, offset), end in zip(entries, ends)
+        ]
+
+    def _find(self, path, timestamp):
+        """
+        Binary search for the first message at or after a time.
+
+        """
+        low, high = 0, self._count(path)
+        if not high:
+            return 0
+        with open(self._index_path(path), "rb") as fil:
+            while low < high:
+                mid = (low + high) // 2
+                fil.seek(mid * _ENTRY.size)
+                if _ENTRY.unpack(fil.read(_ENTRY.size))[0] < timestamp:
+                    low = mid + 1
+                else:
+                    high = mid
+        return low
+
+    def read_tail(self, nmessages, offset=0):
+        """
+        Get the last messages. Runs in the log thread.
+
+        Args:
+            nmessages (int): How many messages to get.
+            offset (int, optional): How many of the latest messages to skip.
+
+        Returns:
+            list: `(timestamp, text)` tuples, oldest first.
+
+        """
+        self.flush()
+        with self._write_lock:
+            self._check_index()
+            messages = []
+            for path in self._paths():
+                count = self._count(path)
+                if offset >= count:
+                    offset -= count
+                    continue
+                stop = count - offset
+                start = max(0, stop - (nmessages - len(messages)))
+                messages = self._read(path, start, stop) + messages
+                offset = 0
+                if len(messages) >= nmessages:
+                    break
+            return messages
+
+    def read_since(self, timestamp, limit=None):
+        """
+        Get all messages sent at or after a time. Runs in the log thread.
+
+        Args:
+            timestamp (float): The time.
+            limit (int, optional): Only get the last this many of them.
+
+        Returns:
+            list: `(timestamp, text)` tuples, oldest first.
+
+        """
+        self.flush()
+        with self._write_lock:
+            self._check_index()
+            messages = []
+            for path in self._paths():
+                count = self._count(path)
+                start = self._find(path, timestamp)
+                if limit is not None:
+                    start = max(start, count - (limit - len(messages)))
+                messages = self._read(path, start, count) + messages
+                if start > 0 or (limit is not None and len(messages) >= limit):
+                    break
+            return messages
+
+
+def get_log(filename):
+    """
+    Get the log of a channel log file.
+
+    Args:
+        filename (str): The log file name, relative to `settings.LOG_DIR`,
+            like `"channel_public.log"`.
+
+    Returns:
+        ChannelLog: The log.
+
+    """
+    path = os.path.join(settings.LOG_DIR, filename)
+    if path not in _LOGS:
+        _LOGS[path] = ChannelLog(path)
+    return _LOGS[path]
+
+
+def log(filename, message):
+    """
+    Log a channel message. It is written in the background.
+
+    Args:
+        filename (str): The log file name, relative to `settings.LOG_DIR`.
+        message (str): The message.
+
+    """
+    get_log(filename).log(message)
+
+
+def tail(filename, nmessages=20, offset=0):
+    """
+    Get the last messages of a channel log.
+
+    Args:
+        filename (str): The log file name, relative to `settings.LOG_DIR`.
+        nmessages (int, optional): How many messages to get.
+        offset (int, optional): How many of the latest messages to skip.
+
+    Returns:
+        Deferred: Fires with a list of `(timestamp, text)`, oldest first.
+
+    """
+    return _in_thread(get_log(filename).read_tail, nmessages, offset=offset)
+
+
+def since(filename, timestamp, limit=None):
+    """
+    Get the messages of a channel log sent at or after a time.
+
+    Args:
+        filename (str): The log file name, relative to `settings.LOG_DIR`.
+        timestamp (float): The time.
+        limit (int, optional): Only get the last this many of them.
+
+    Returns:
+        Deferred: Fires with a list of `(timestamp, text)`, oldest first.
+
+    """
+    return _in_thread(get_log(filename).read_since, timestamp, limit=limit)
+
+
+def flush_all():
+    """
+    Write all buffered messages of all logs now, in the calling thread.
+    Called at server stop.
+
+    """
+    for channel_log in list(_LOGS.values()):
+        try:
+            channel_log.flush()
+        except OSError as err:
+            logger.log_err(f"Could not write channel log {channel_log.path}: {err}")
@@ -0,0 +1,220 @@
+"""
+Character profiles
+
+The public character pages of the website (`web/website/views`) show a
+character's level, experience, deaths and respawn location. Crawlers walk
+through all of them again and again, so a profile is rendered once and the
+html fragment kept here until something it shows changes:
+
+- The game calls `invalidate()` when a shown stat changes
+  (`Character.gain_experience`, `die`, `set_respawn_location` and
+  `reset_stats`). Renames and deletions of characters, and renames of the
+  rooms they respawn in, are picked up from the `post_save`/`post_delete`
+  signals.
+- Attribute writes are committed at the end of the tick (see
+  `world/dbprofile.py`), so the fragment is dropped again then, in case a
+  page was rendered from the database in between.
+- A missing fragment is rendered from two `.values()` queries, without
+  loading the character as a typeclass, so web threads stay out of the
+  game's caches. Unknown ids are remembered too, apart from the fragments
+  so they can't push real profiles out, until an object with that id is
+  saved.
+
+At most `settings.CHARACTER_PROFILE_CACHE_SIZE` fragments (and
+`UNKNOWN_CACHE_SIZE` unknown ids) are kept, least recently shown dropped
+first.
+
+"""
+
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.template.loader import render_to_string
+from twisted.internet import reactor
+
+from evennia.objects.models import ObjectDB
+from evennia.typeclasses.attributes import Attribute
+from evennia.utils.utils import class_from_module
+
+PROFILE_TEMPLATE = "website/character_profile_fragment.html"
+UNKNOWN_CACHE_SIZE = 1000
+_ATTRIBUTES = ("experience", "deaths", "respawn_location")
+
+# {character_id: html}
+_FRAGMENTS = OrderedDict()
+# {character_id: None}, ids of no character
+_UNKNOWN = OrderedDict()
+# {character_id: version}, bumped on each invalidation
+_VERSIONS = {}
+# {room_id: {character_id, ...}}, rooms shown as respawn locations
+_RESPAWN_ROOMS = {}
+_PENDING = set()
+_LOCK = threading.Lock()
+_STATS = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def _drop(character_id):
+    with _LOCK:
+        _VERSIONS[character_id] = _VERSIONS.get(character_id, 0) + 1
+        _FRAGMENTS.pop(character_id, None)
+        _UNKNOWN.pop(character_id, None)
+
+
+def _drop_pending():
+    ids = list(_PENDING)
+    _PENDING.clear()
+    for character_id in ids:
+        _drop(character_id)
+
+
+def invalidate(character):
+    """
+    Drop a character's profile after a shown stat changed.
+
+    Args:
+        character (Character or int): The character or its id.
+
+    """
+    character_id = character if isinstance(character, int) else character.id
+    _STATS["invalidations"] += 1
+    _drop(character_id)
+    # again once the tick's writes are committed
+    if reactor.running:
+        if not _PENDING:
+            reactor.callLater(0, _drop_pending)
+        _PENDING.add(character_id)
+
+
+def _unpack_id(value):
+    # database objects are stored packed, as ("__packed_dbobj__", key, date, id)
+    if isinstance(value, tuple) and len(value) == 4 and value[0] == "__packed_dbobj__":
+        return value[3]
+    return None
+
+
+def _load(character_id):
+    """
+    Get what a profile shows from the database.
+
+    Returns:
+        dict or None: The fields, or `None` for no such character.
+
+    """
+    typeclass = class_from_module(settings.BASE_CHARACTER_TYPECLASS)
+    key = (
+        typeclass.objects.all_family()
+        .filter(id=character_id)
+        .values_list("db_key", flat=True)
+        .first()
+    )
+    if key is None:
+        return None
+    values = dict(
+        Attribute.objects.filter(
+            objectdb__id=character_id, db_key__in=_ATTRIBUTES, db_category__isnull=True
+        ).values_list("db_key", "db_value")
+    )
+    experience = values.get("experience") or 0
+    respawn_id = _unpack_id(values.get("respawn_location"))
+    respawn = None
+    if respawn_id:
+        respawn = ObjectDB.objects.filter(id=respawn_id).values_list("db_key", flat=True).first()
+    return {
+        "id": character_id,
+        "name": key,
+        "level": typeclass.level_for(experience),
+        "experience": experience,
+        "deaths": values.get("deaths") or 0,
+        "respawn_location": respawn,
+        "respawn_id": respawn_id if respawn else None,
+    }
+
+
+def get_fragment(character_id):
+    """
+    Get a character's rendered profile. Safe to call from web threads.
+
+    Args:
+        character_id (int): The character's id.
+
+    Returns:
+        str or None: The html fragment, or `None` for no such character.
+
+    """
+    with _LOCK:
+        if character_id in _FRAGMENTS:
+            _FRAGMENTS.move_to_end(character_id)
+            _STATS["hits"] += 1
+            return _FRAGMENTS[character_id]
+        if character_id in _UNKNOWN:
+            _UNKNOWN.move_to_end(character_id)
+            _STATS["hits"] += 1
+            return None
+        version = _VERSIONS.get(character_id, 0)
+    _STATS["misses"] += 1
+    profile = _load(character_id)
+    fragment = render_to_string(PROFILE_TEMPLATE, {"profile": profile}) if profile else None
+    with _LOCK:
+        # unless invalidated while we were rendering
+        if _VERSIONS.get(character_id, 0) == version:
+            if fragment is None:
+                _UNKNOWN[character_id] = None
+                if len(_UNKNOWN) > UNKNOWN_CACHE_SIZE:
+                    _UNKNOWN.popitem(last=False)
+            else:
+                _FRAGMENTS[character_id] = fragment
+                if len(_FRAGMENTS) > settings.CHARACTER_PROFILE_CACHE_SIZE:
+                    _FRAGMENTS.popitem(last=False)
+                if profile["respawn_id"]:
+                    _RESPAWN_ROOMS.setdefault(profile["respawn_id"], set()).add(character_id)
+    return fragment
+
+
+def _at_object_saved(sender, instance, update_fields=None, **kwargs):
+    if not isinstance(instance, ObjectDB):
+        return
+    if update_fields and set(update_fields) <= {"db_location"}:
+        # moves are not shown
+        return
+    if instance.id in _FRAGMENTS or instance.id in _UNKNOWN:
+        invalidate(instance.id)
+    with _LOCK:
+        character_ids = _RESPAWN_ROOMS.pop(instance.id, ())
+    for character_id in character_ids:
+        invalidate(character_id)
+
+
+def _at_object_deleted(sender, instance, **kwargs):
+    _at_object_saved(sender, instance)
+
+
+def install():
+    """
+    Follow renames and deletions. Called at server start.
+
+    """
+    # objects are saved as their typeclass, so listen to all senders
+    post_save.connect(_at_object_saved, dispatch_uid="pixarimud_character_profiles")
+    post_delete.connect(_at_object_deleted, dispatch_uid="pixarimud_character_profiles")
+
+
+def stats():
+    """
+    Get cache stats.
+
+    Returns:
+        dict: With keys `size`, `unknown`, `hits`, `misses`,
+        `invalidations` and `hit_rate`.
+
+    """
+    lookups = _STATS["hits"] + _STATS["misses"]
+    return {
+        "size": len(_FRAGMENTS),
+        "unknown": len(_UNKNOWN),
+        "hits": _STATS["hits"],
+        "misses": _STATS["misses"],
+        "invalidations": _STATS["invalidations"],
+        "hit_rate": _STATS["hits"] / lookups if lookups else 0.0,
+    }
@@ -0,0 +1,73 @@
+"""
+Connection screen cache
+
+The connection screen is shown to every new connection and on every unlogged
+`look`. Normally the unlogged `look` command re-imports
+`settings.CONNECTION_SCREEN_MODULE` to pick a screen, and the Portal then runs
+ANSI/markup parsing on it for each session. During reconnect storms after a
+restart this adds up.
+
+This module pre-renders each screen string once per client capability (see
+`world/text_variants.py`), to be sent with the `raw` option so the Portal
+passes them through untouched. The whole variant table is built by `build()` at
+server start and replaced in one assignment, so a rebuild never exposes a
+half-built table.
+
+If the module defines a dynamic `connection_screen()` callable there is
+nothing to pre-render and sessions get the screen the normal way. The same
+goes for sessions whose settings are not covered by a variant (like
+screenreader or MXP clients).
+
+"""
+
+import random
+
+from django.conf import settings
+
+from evennia.utils import utils
+
+from world.text_variants import RAW_OPTIONS, VARIANTS, render_variants, session_variant
+
+# {variant: [rendered_screen, ...]}, empty if screens can't be pre-rendered
+_VARIANTS = {}
+
+
+def build():
+    """
+    (Re)build the pre-rendered screens from `settings.CONNECTION_SCREEN_MODULE`.
+    Called at server start; safe to call at any time.
+
+    """
+    global _VARIANTS
+    module = settings.CONNECTION_SCREEN_MODULE
+    if "connection_screen" in utils.callables_from_module(module):
+        # dynamic screen, must be generated per request
+        _VARIANTS = {}
+        return
+
+    variants = {variant: [] for variant in VARIANTS}
+    for screen in utils.string_from_module(module):
+        for variant, rendered in render_variants(screen).items():
+            variants[variant].append(rendered)
+    _VARIANTS = variants if any(variants.values()) else {}
+
+
+def get_screen(session):
+    """
+    Get a pre-rendered connection screen for a session.
+
+    Args:
+        session (Session): The session to send to.
+
+    Returns:
+        tuple or None: `(text, options)` to send, or `None` if the screen
+        must be rendered the normal way.
+
+    """
+    variants = _VARIANTS
+    if not variants:
+        return None
+    variant = session_variant(session)
+    if not variant:
+        return None
+    return random.choice(variants[variant]), RAW_OPTIONS
@@ -0,0 +1,281 @@
+"""
+Database profile
+
+Production tuning for the default SQLite database:
+
+- `settings.SQLITE3_PRAGMAS` are applied to *every* new database connection
+  (Evennia itself only applies them once, to the server's main connection at
+  startup). Our pragmas turn on WAL so web threads can read while the game
+  writes.
+- Attribute and Tag writes done in the same reactor tick are grouped into a
+  single commit by the `WriteBatcher`. The first write in a tick turns off
+  autocommit on the reactor thread's connection, and a `callLater(0)` commits
+  once the tick is done. Any other writes in that tick (like an object moving)
+  go into the same commit.
+
+Batching is done by `BatchedAttributeHandler` and `BatchedTagHandler`, which
+`typeclasses.objects.ObjectParent` uses for all in-game entities. It is only
+active while the reactor is running and only on the reactor thread, so
+`evennia shell`, migrations and web requests behave as normal. It is turned
+off with `settings.DB_WRITE_BATCHING = False`.
+
+Use `benchmark_writes()` (or `dbprofile/bench` in-game) to compare commits
+per second with and without batching.
+
+"""
+
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.backends.signals import connection_created
+from twisted.internet import reactor
+from twisted.python.threadable import isInIOThread
+
+from evennia.typeclasses.attributes import AttributeHandler
+from evennia.typeclasses.tags import TagHandler
+from evennia.utils import logger
+
+
+def apply_sqlite_pragmas(conn):
+    """
+    Apply `settings.SQLITE3_PRAGMAS` to a database connection.
+
+    Args:
+        conn (DatabaseWrapper): A Django database connection. Non-SQLite
+            connections are ignored.
+
+    """
+    if conn.vendor != "sqlite":
+        return
+    with conn.cursor() as cursor:
+        for pragma in settings.SQLITE3_PRAGMAS:
+            cursor.execute(pragma)
+
+
+def _at_connection_created(sender, connection=None, **kwargs):
+    apply_sqlite_pragmas(connection)
+
+
+def install():
+    """
+    Make sure all new database connections get our pragmas. Called at server
+    start.
+
+    """
+    connection_created.connect(_at_connection_created, dispatch_uid="pixarimud_sqlite_pragmas")
+    if connection.connection is not None:
+        # the main connection is already open at this point
+        apply_sqlite_pragmas(connection)
+
+
+def get_pragmas():
+    """
+    Read back the current value of the pragmas we set.
+
+    Returns:
+        dict: `{pragma_name: value}` for the main connection.
+
+    """
+    if connection.vendor != "sqlite":
+        return {}
+    values = {}
+    with connection.cursor() as cursor:
+        for pragma in settings.SQLITE3_PRAGMAS:
+            name = pragma.split()[1].split("=")[0]
+            cursor.execute(f"PRAGMA {name}")
+            row = cursor.fetchone()
+            values[name] = row[0] if row else None
+    return values
+
+
+class WriteBatcher:
+    """
+    Groups all database writes in one reactor tick into one transaction.
+
+    """
+
+    def __init__(self):
+        self.active = False
+        self.enabled = True
+        self.writes = 0
+        self.batched_writes = 0
+        self.commits = 0
+        self.rollbacks = 0
+
+    def can_batch(self):
+        """
+        Check if a batch may be started right now.
+
+        Returns:
+            bool: If batching is possible.
+
+        """
+        return (
+            self.enabled
+            and getattr(settings, "DB_WRITE_BATCHING", False)
+            and reactor.running
+            and isInIOThread()
+            and not connection.in_atomic_block
+            and connection.get_autocommit()
+        )
+
+    def begin(self):
+        """
+        Called before each Attribute/Tag write. Opens a batch (if one is not
+        already open) that is committed at the end of the current tick.
+
+        """
+        self.writes += 1
+        if self.active:
+            self.batched_writes += 1
+            return
+        if not self.can_batch():
+            return
+        transaction.set_autocommit(False)
+        self.active = True
+        self.batched_writes += 1
+        reactor.callLater(0, self.flush)
+
+    def flush(self):
+        """
+        Commit the open batch, if any, and go back to autocommit.
+
+        """
+        if not self.active:
+            return
+        self.active = False
+        try:
+            transaction.commit()
+            self.commits += 1
+        except Exception:
+            logger.log_trace("Batched database commit failed - rolling back.")
+            transaction.rollback()
+            self.rollbacks += 1
+        finally:
+            transaction.set_autocommit(True)
+
+    def stats(self):
+        """
+        Get batching statistics.
+
+        Returns:
+            dict: Counters, including `writes_per_commit`.
+
+        """
+        return {
+            "active": self.active,
+            "writes": self.writes,
+            "batched_writes": self.batched_writes,
+            "commits": self.commits,
+            "rollbacks": self.rollbacks,
+            "writes_per_commit": self.batched_writes / self.commits if self.commits else 0.0,
+        }
+
+
+WRITE_BATCHER = WriteBatcher()
+
+
+class BatchedAttributeHandler(AttributeHandler):
+    """
+    AttributeHandler whose writes go through the `WRITE_BATCHER`.
+
+    """
+
+    def add(self, *args, **kwargs):
+        WRITE_BATCHER.begin()
+        return super().add(*args, **kwargs)
+
+    def batch_add(self, *args, **kwargs):
+        WRITE_BATCHER.begin()
+        return super().batch_add(*args, **kwargs)
+
+    def remove(self, *args, **kwargs):
+        WRITE_BATCHER.begin()
+        return super().remove(*args, **kwargs)
+
+    def clear(self, *args, **kwargs):
+        WRITE_BATCHER.begin()
+        return super().clear(*args, **kwargs)
+
+
+class BatchedTagHandler(TagHandler):
+    """
+    TagHandler whose writes go through the `WRITE_BATCHER`.
+
+    """
+
+    def add(self, *args, **kwargs):
+        WRITE_BATCHER.begin()
+        return super().add(*args, **kwargs)
+
+    def batch_add(self, *args):
+        WRITE_BATCHER.begin()
+        return super().batch_add(*args)
+
+    def remove(self, *args, **kwargs):
+        WRITE_BATCHER.begin()
+        return super().remove(*args, **kwargs)
+
+    def batch_remove(self, *args):
+        WRITE_BATCHER.begin()
+        return super().batch_remove(*args)
+
+    def clear(self, *args, **kwargs):
+        WRITE_BATCHER.begin()
+        return super().clear(*args, **kwargs)
+
+
+def benchmark_writes(obj, count=200):
+    """
+    Compare Attribute/Tag write throughput with one commit per write
+    (Evennia's default) against one commit for the whole batch.
+
+    Args:
+        obj (Object): Object to write temporary Attributes and Tags on.
+        count (int, optional): Number of Attribute writes per run. As many Tag
+            writes are done as well.
+
+    Returns:
+        dict: `{"autocommit": result, "batched": result}`, where each result is
+        a dict with `writes`, `commits`, `seconds`, `writes_per_sec` and
+        `commits_per_sec`.
+
+    """
+
+    def _writes():
+        for inum in range(count):
+            obj.attributes.add(f"bench_{inum}", inum, category="_dbbench")
+            obj.tags.add(f"bench_{inum}", category="_dbbench")
+        obj.attributes.clear(category="_dbbench")
+        obj.tags.clear(category="_dbbench")
+
+    def _result(writes, commits, seconds):
+        return {
+            "writes": writes,
+            "commits": commits,
+            "seconds": seconds,
+            "writes_per_sec": writes / seconds if seconds else 0.0,
+            "commits_per_sec": commits / seconds if seconds else 0.0,
+        }
+
+    # make sure nothing is pending before we start
+    WRITE_BATCHER.flush()
+    writes = count * 2 + 2
+
+    # before: every write commits on its own
+    WRITE_BATCHER.enabled = False
+    try:
+        t0 = time.perf_counter()
+        _writes()
+        autocommit = _result(writes, writes, time.perf_counter() - t0)
+    finally:
+        WRITE_BATCHER.enabled = True
+
+    # after: all writes in one transaction, as the batcher does within a tick
+    t0 = time.perf_counter()
+    with transaction.atomic():
+        _writes()
+    batched = _result(writes, 1, time.perf_counter() - t0)
+
+    return {"autocommit": autocommit, "batched": batched}
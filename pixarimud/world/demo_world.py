@@ -0,0 +1,70 @@
+"""
+Demo world
+
+The combat training arena, its respawn chamber and the demo objects, as a
+world module for `world/world_import.py`. Import it in-game with
+
+    worldimport world.demo_world
+
+Importing again updates the existing rooms and objects instead of creating
+new ones.
+
+"""
+
+from world.world_import import ref
+
+WORLD_KEY = "demo"
+
+ROOMS = [
+    {
+        "id": "arena",
+        "prototype": "DEMO_ROOM",
+        "desc": (
+            "A spacious training arena with high ceilings and reinforced walls. Various combat "
+            "training equipment is scattered around the room. This is where warriors come to "
+            "hone their skills and test new techniques. You can see a combat dummy for basic "
+            "training, a bottomless pit for testing courage, and a worn-out dummy that might "
+            "break if hit too much."
+        ),
+        # default respawn location for those training here
+        "respawn_location": ref("respawn_chamber"),
+    },
+    {
+        "id": "respawn_chamber",
+        "prototype": "RESPAWN_ROOM",
+    },
+]
+
+EXITS = [
+    # to and from Limbo
+    {
+        "id": "limbo_to_arena",
+        "key": "arena",
+        "location": "#2",
+        "destination": "arena",
+    },
+    {
+        "id": "arena_to_limbo",
+        "key": "training ground",
+        "location": "arena",
+        "destination": "#2",
+    },
+    {
+        "id": "arena_to_chamber",
+        "key": "respawn",
+        "location": "arena",
+        "destination": "respawn_chamber",
+    },
+    {
+        "id": "chamber_to_arena",
+        "key": "arena",
+        "location": "respawn_chamber",
+        "destination": "arena",
+    },
+]
+
+OBJECTS = [
+    {"id": "combat_dummy", "prototype": "COMBAT_DUMMY", "location": "arena"},
+    {"id": "bottomless_pit", "prototype": "BOTTOMLESS_PIT", "location": "arena"},
+    {"id": "worn_dummy", "prototype": "WORN_DUMMY", "location": "arena"},
+]
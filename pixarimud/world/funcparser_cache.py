@@ -0,0 +1,290 @@
+"""
+Compiled FuncParser templates
+
+With `FUNCPARSER_PARSE_OUTGOING_MESSAGES_ENABLED` set, Evennia runs every
+outgoing string through a `FuncParser`, which re-tokenizes the whole string
+character by character on every send. This module provides a drop-in
+`CachedFuncParser` that tokenizes each distinct message template only once,
+compiling it into a sequence of literal text and pre-parsed `$funcname(...)`
+calls. Compiled templates are kept in an LRU cache; rendering a cached
+template only executes the callables, it never re-parses the text.
+
+Strings without any `$` or escape characters (the bulk of the game's output,
+like the combat lines in `typeclasses/objects.py`) are returned as-is without
+touching the parser or the cache at all.
+
+The parser is installed for outgoing messages by `at_server_init()` in
+`server/conf/at_server_startstop.py`. Cache size is controlled with
+`settings.FUNCPARSER_TEMPLATE_CACHE_SIZE`.
+
+"""
+
+import re
+from collections import OrderedDict
+
+from django.conf import settings
+
+from evennia.utils.funcparser import FuncParser
+
+# a private-use codepoint; must not count as whitespace since the parser strips args
+_SLOT_MARKER = "\ue000"
+_RE_SLOT = re.compile("\ue000(\\d+)\ue000")
+
+
+class _Slot(str):
+    """
+    Placeholder returned for a callable while compiling. It is a `str`
+    subclass so we can tell if the parser stored it raw (as the full value of
+    an arg/kwarg) or merged it into a surrounding string.
+
+    """
+
+    pass
+
+
+class _TemplateRecorder(FuncParser):
+    """
+    A FuncParser that records each parsed function instead of executing it.
+    Used to compile a template with the exact same tokenizing rules as the
+    real parser.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.recorded = []
+
+    def execute(self, parsedfunc, raise_errors=False, **reserved_kwargs):
+        self.recorded.append(parsedfunc)
+        return _Slot(f"{_SLOT_MARKER}{len(self.recorded) - 1}{_SLOT_MARKER}")
+
+    def record(self, string, raise_errors=False):
+        """
+        Compile a string into parts and parsed functions.
+
+        Args:
+            string (str): The template to compile.
+            raise_errors (bool, optional): Raise `ParsingError` on malformed input.
+
+        Returns:
+            tuple: `(parts, funcs)`, where `parts` is a tuple of literal strings
+            and int indices into the list `funcs` of parsed functions.
+
+        """
+        self.recorded = []
+        try:
+            fullstr = self.parse(string, raise_errors=raise_errors)
+            funcs = self.recorded
+        finally:
+            self.recorded = []
+        parts = []
+        for inum, part in enumerate(_RE_SLOT.split(fullstr)):
+            if inum % 2:
+                parts.append(int(part))
+            elif part:
+                parts.append(part)
+        return tuple(parts), funcs
+
+
+class CompiledTemplate:
+    """
+    A message template split into literal strings and pre-parsed callables.
+
+    """
+
+    __slots__ = ("parts", "funcs")
+
+    def __init__(self, parts, funcs):
+        self.parts = parts
+        self.funcs = funcs
+
+    def render(self, parser, raise_errors=False, **reserved_kwargs):
+        """
+        Execute the template's callables and join the result.
+
+        Args:
+            parser (FuncParser): The parser whose callables to execute.
+            raise_errors (bool, optional): Passed on to `parser.execute`.
+            **reserved_kwargs: Passed into every callable, as for `FuncParser.parse`.
+
+        Returns:
+            str: The rendered string.
+
+        """
+        funcs = self.funcs
+
+        def _substitute(value):
+            # resolve nested function calls inside an arg/kwarg value
+            if isinstance(value, _Slot):
+                return _resolve(int(value[1:-1]))
+            if isinstance(value, str) and _SLOT_MARKER in value:
+                return _RE_SLOT.sub(lambda match: str(_resolve(int(match.group(1)))), value)
+            return value
+
+        def _resolve(index):
+            parsedfunc = funcs[index]
+            args = []
+            for arg in parsedfunc.args:
+                value = _substitute(arg)
+                if isinstance(arg, _Slot) and value == "":
+                    # the parser drops empty nested returns from the arglist
+                    continue
+                args.append(value)
+            kwargs = {key: _substitute(value) for key, value in parsedfunc.kwargs.items()}
+            call = type(parsedfunc)(
+                prefix=parsedfunc.prefix,
+                funcname=parsedfunc.funcname,
+                args=args,
+                kwargs=kwargs,
+                fullstr=parsedfunc.fullstr,
+                rawstr=parsedfunc.rawstr,
+                infuncstr=parsedfunc.infuncstr,
+            )
+            return parser.execute(call, raise_errors=raise_errors, **reserved_kwargs)
+
+        return "".join(
+            part if isinstance(part, str) else str(_resolve(part)) for part in self.parts
+        )
+
+
+class CachedFuncParser(FuncParser):
+    """
+    A FuncParser keeping an LRU cache of compiled templates.
+
+    Only the plain string-returning parse is cached; `escape`, `strip` and
+    `return_str=False` fall back to the normal parser.
+
+    """
+
+    def __init__(self, callables, cache_size=None, **kwargs):
+        """
+        Args:
+            callables (str, module, list or dict): As for `FuncParser`.
+            cache_size (int, optional): Max number of compiled templates to keep.
+                Defaults to `settings.FUNCPARSER_TEMPLATE_CACHE_SIZE`.
+            **kwargs: Passed on to `FuncParser`.
+
+        """
+        super().__init__(callables, **kwargs)
+        if cache_size is None:
+            cache_size = getattr(settings, "FUNCPARSER_TEMPLATE_CACHE_SIZE", 2048)
+        self.cache_size = cache_size
+        self._recorder = _TemplateRecorder(
+            self.callables, start_char=self.start_char, escape_char=self.escape_char
+        )
+        self._templates = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def compile(self, string, raise_errors=False):
+        """
+        Get the compiled template for a string, compiling and caching it if needed.
+
+        Args:
+            string (str): The template.
+            raise_errors (bool, optional): Raise `ParsingError` on malformed input.
+
+        Returns:
+            CompiledTemplate: The compiled template.
+
+        """
+        templates = self._templates
+        template = templates.get(string)
+        if template is not None:
+            self.hits += 1
+            templates.move_to_end(string)
+            return template
+
+        self.misses += 1
+        template = CompiledTemplate(*self._recorder.record(string, raise_errors=raise_errors))
+        if self.cache_size > 0:
+            templates[string] = template
+            if len(templates) > self.cache_size:
+                templates.popitem(last=False)
+                self.evictions += 1
+        return template
+
+    def parse(
+        self,
+        string,
+        raise_errors=False,
+        escape=False,
+        strip=False,
+        return_str=True,
+        **reserved_kwargs,
+    ):
+        if self.start_char not in string and self.escape_char not in string:
+            # nothing to parse
+            return string
+        if escape or strip or not return_str or _SLOT_MARKER in string:
+            return super().parse(
+                string,
+                raise_errors=raise_errors,
+                escape=escape,
+                strip=strip,
+                return_str=return_str,
+                **reserved_kwargs,
+            )
+        template = self.compile(string, raise_errors=raise_errors)
+        return template.render(self, raise_errors=raise_errors, **reserved_kwargs)
+
+    def clear_cache(self):
+        """
+        Empty the template cache and reset the statistics.
+
+        """
+        self._templates.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Get cache statistics.
+
+        Returns:
+            dict: With keys `size`, `max_size`, `hits`, `misses`, `evictions`
+            and `hit_rate` (0.0-1.0).
+
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._templates),
+            "max_size": self.cache_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+_OUTGOING_PARSER = None
+
+
+def get_outgoing_parser():
+    """
+    Get the shared parser for outgoing messages, creating it on first use.
+
+    Returns:
+        CachedFuncParser: Parser using `settings.FUNCPARSER_OUTGOING_MESSAGES_MODULES`.
+
+    """
+    global _OUTGOING_PARSER
+    if not _OUTGOING_PARSER:
+        # same setup as evennia.server.sessionhandler uses
+        _OUTGOING_PARSER = CachedFuncParser(
+            settings.FUNCPARSER_OUTGOING_MESSAGES_MODULES, raise_errors=True
+        )
+    return _OUTGOING_PARSER
+
+
+def install_outgoing_parser():
+    """
+    Make the session handler use the cached parser for outgoing messages. Does
+    nothing unless `settings.FUNCPARSER_PARSE_OUTGOING_MESSAGES_ENABLED` is set.
+
+    """
+    if not settings.FUNCPARSER_PARSE_OUTGOING_MESSAGES_ENABLED:
+        return
+    from evennia.server import sessionhandler
+
+    sessionhandler._FUNCPARSER = get_outgoing_parser()
@@ -0,0 +1,189 @@
+"""
+Guest pool
+
+Evennia creates a guest account and character when someone logs in as a
+guest: an account row with a hashed random password, permissions,
+Attributes, a character with its locks and stats, and then deletes all of
+it again when the guest logs out. With the game listed on MUD listing
+sites that is a lot of work for the reactor at exactly the wrong time.
+
+Instead, an account and character is kept for every name in
+`settings.GUEST_LIST`:
+
+- `provision()` (called at server start) creates any that are missing, all
+  in one transaction and without hashing a password (pooled guests get an
+  unusable one, as nobody logs in to them with a password), and queues
+  them as free. After a shutdown it resets them first.
+- `take()` hands out a free guest, used by `typeclasses.accounts.Guest`
+  when logging in as `guest`. It pops from a queue of free guests and does
+  no database work.
+- `recycle()` is called when a guest logs out. It resets the character's
+  stats and description, sends what it carried home, removes the
+  Attributes, nicks and channel subscriptions the guest added (so the next
+  guest doesn't see them) and puts the guest back in the queue.
+
+"""
+
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.translation import gettext as _
+
+from evennia.accounts.models import AccountDB
+from evennia.comms.models import ChannelDB
+from evennia.utils import logger
+from evennia.utils.utils import class_from_module
+
+# free guest accounts, oldest logout first
+_FREE = deque()
+# ids of the accounts in _FREE
+_FREE_IDS = set()
+
+# Attributes kept when recycling, those of a new guest; all others were set
+# by the guest playing
+_ACCOUNT_ATTRIBUTES = ("_playable_characters", "_last_puppet", "first_login")
+_CHARACTER_ATTRIBUTES = (
+    "health",
+    "max_health",
+    "experience",
+    "level",
+    "deaths",
+    "respawn_location",
+    "respawn_chosen",
+    "creator_id",
+    "prelogout_location",
+    "desc",
+)
+
+
+def _release(guest):
+    if guest.id not in _FREE_IDS:
+        _FREE_IDS.add(guest.id)
+        _FREE.append(guest)
+
+
+def provision(reset=False):
+    """
+    Create the guest accounts and characters missing from the pool, and
+    queue all guests as free. Does nothing unless `settings.GUEST_ENABLED`
+    is set.
+
+    Args:
+        reset (bool, optional): Also reset all guests, for after a shutdown
+            (guests logged in at shutdown were never recycled).
+
+    Returns:
+        int: The number of guests created.
+
+    """
+    if not settings.GUEST_ENABLED:
+        return 0
+    Guest = class_from_module(settings.BASE_GUEST_TYPECLASS)
+    existing = {
+        account.username.lower(): account
+        for account in AccountDB.objects.filter(db_typeclass_path=settings.BASE_GUEST_TYPECLASS)
+    }
+    created = []
+    with transaction.atomic():
+        for name in settings.GUEST_LIST:
+            guest = existing.get(name.lower())
+            if guest is None:
+                guest, errors = Guest.create_pooled(name)
+                if errors:
+                    logger.log_err(f"Could not create guest {name}: {' '.join(errors)}")
+                    continue
+                created.append(guest)
+            existing[name.lower()] = guest
+
+    _FREE.clear()
+    _FREE_IDS.clear()
+    for name in settings.GUEST_LIST:
+        guest = existing.get(name.lower())
+        if not guest:
+            continue
+        if reset:
+            recycle(guest)
+        else:
+            # sessions kept over a reload are not synced yet; take() skips
+            # guests that turn out to be logged in
+            _release(guest)
+    if created:
+        logger.log_info(f"Guest pool: created {len(created)} guests.")
+    return len(created)
+
+
+def take():
+    """
+    Get a free guest to log in to.
+
+    Returns:
+        Guest or None: The guest, or `None` if all guests are in use.
+
+    """
+    while _FREE:
+        guest = _FREE.popleft()
+        _FREE_IDS.discard(guest.id)
+        # deleted, or logged in since (like sessions kept over a reload)
+        if guest.id and not guest.sessions.count():
+            return guest
+    return None
+
+
+def _clear_attributes(obj, keep):
+    for attr in obj.attributes.all():
+        if attr.category or attr.key not in keep:
+            obj.attributes.remove(attr.key, category=attr.category)
+
+
+def _reset_channels(subscriber, default_channels=()):
+    """
+    Leave all channels, then join the default ones again (which also gives
+    back their nick aliases).
+
+    """
+    for channel in ChannelDB.objects.get_subscriptions(subscriber):
+        channel.disconnect(subscriber)
+    for chankey in default_channels:
+        channel = ChannelDB.objects.get_channel(chankey)
+        if channel:
+            channel.connect(subscriber)
+
+
+def recycle(guest):
+    """
+    Reset a guest that logged out and make it free again.
+
+    Args:
+        guest (Guest): The guest account.
+
+    """
+    if guest.sessions.count():
+        return
+    for character in guest.characters.all():
+        character.clear_contents()
+        character.nicks.clear()
+        _clear_attributes(character, _CHARACTER_ATTRIBUTES)
+        _reset_channels(character)
+        if hasattr(character, "reset_stats"):
+            character.reset_stats()
+        character.db.desc = _("This is a character.")
+        # the next guest starts out at home
+        character.db.prelogout_location = character.home
+    guest.nicks.clear()
+    _clear_attributes(guest, _ACCOUNT_ATTRIBUTES)
+    _reset_channels(
+        guest, [chan["key"] for chan in settings.DEFAULT_CHANNELS if chan.get("key")]
+    )
+    _release(guest)
+
+
+def stats():
+    """
+    Get guest pool stats.
+
+    Returns:
+        dict: With keys `size` (guest names) and `free`.
+
+    """
+    return {"size": len(settings.GUEST_LIST), "free": len(_FREE)}
@@ -0,0 +1,574 @@
+"""
+Help search index
+
+Evennia's `help <topic>` builds a fresh Lunr search index over every
+command, database and file help entry the caller can read - and does so up
+to three times per lookup (exact, `topic*` and `*topic`). The cost grows
+with the whole help corpus, not with what is found.
+
+This module keeps one inverted index over the `search_index_entry` fields
+(key, aliases, category, tags and text) of all help entries:
+
+- `build()` indexes the commands of the default cmdsets, the file help
+  entries (`world/help_entries.py`), the database help entries and their
+  categories. It is called at server start.
+- The index is saved to `settings.HELP_INDEX_FILE`. At the next start only
+  entries whose fields changed since are re-tokenized, so a reload does not
+  rebuild the index from scratch.
+- Saving or deleting a database help entry (like with `sethelp`, including
+  its line editor) re-indexes just that entry at the end of the tick.
+  Entries that are not yet indexed (like commands on objects) are added the
+  first time they turn up as help candidates.
+
+A lookup only touches the postings of the query's terms. Prefix lookups walk
+a sorted vocabulary and typos (one inserted, deleted, changed or swapped
+letter) are found through an index of single-letter deletions of every
+term, so neither scans the vocabulary:
+
+    from world.help_index import HELP_INDEX
+
+    matches, suggestions = HELP_INDEX.search("hti", candidates, mode=FUZZY)
+
+The search is used by `commands.command.CmdHelp`. Command docstrings and
+file help entries are re-indexed when they change at the next server start
+or reload.
+
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from twisted.internet import reactor
+
+from evennia.commands.command import Command
+from evennia.utils import logger
+from evennia.utils.ansi import strip_ansi
+
+# lookup modes, matching the three queries of Evennia's help command
+EXACT = "exact"
+PREFIX = "prefix"
+FUZZY = "fuzzy"
+
+# bump when the file format or tokenizing changes
+_VERSION = 1
+_FIELDS = ("key", "aliases", "no_prefix", "category", "tags", "text")
+# field boosts used when the caller gives none (as Evennia's help command)
+DEFAULT_BOOSTS = {"key": 10, "aliases": 9, "no_prefix": 8, "category": 7, "tags": 1}
+# boost for the text field, which is only searched for suggestions
+_TEXT_BOOST = 1
+# extra score for an entry whose whole key is the query
+_KEY_BONUS = 20
+# score factor of a term found by prefix or by typo, compared to an exact term
+_PREFIX_FACTOR = 0.5
+_FUZZY_FACTOR = 0.3
+# shortest query term looked up with typo tolerance
+_FUZZY_MIN_LENGTH = 3
+
+_RE_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """
+    Split text into lowercase search terms, without color markup.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        list: The terms, in order.
+
+    """
+    return _RE_TOKEN.findall(strip_ansi(text or "").lower())
+
+
+def _deletions(term):
+    """
+    All variants of a term with one letter removed.
+
+    """
+    return {term[:inum] + term[inum + 1 :] for inum in range(len(term))}
+
+
+def _within_one_edit(term1, term2):
+    """
+    Check if two terms differ by at most one inserted, deleted, changed or
+    swapped (adjacent) letter.
+
+    """
+    len1, len2 = len(term1), len(term2)
+    if abs(len1 - len2) > 1:
+        return False
+    if len1 > len2:
+        term1, term2, len1, len2 = term2, term1, len2, len1
+    start = 0
+    while start < len1 and term1[start] == term2[start]:
+        start += 1
+    if len1 == len2:
+        return (
+            term1[start + 1 :] == term2[start + 1 :]
+            or term1[start : start + 2] == term2[start : start + 2][::-1]
+            and term1[start + 2 :] == term2[start + 2 :]
+        )
+    return term1[start:] == term2[start + 1 :]
+
+
+def doc_id(entry):
+    """
+    Get the index id of a help candidate.
+
+    Args:
+        entry (Command, HelpEntry, FileHelpEntry or HelpCategory): The entry.
+
+    Returns:
+        str: An id unique per entry type and key. Commands also include their
+        class, since different commands can have the same key.
+
+    """
+    if isinstance(entry, Command):
+        cls = type(entry)
+        return f"cmd:{cls.__module__}.{cls.__name__}:{entry.key.lower()}"
+    return f"{type(entry).__name__.lower()}:{entry.key.lower()}"
+
+
+def _index_fields(entry):
+    """
+    Get the searchable fields of a help entry.
+
+    Returns:
+        dict: `{field: str}` for the fields in `_FIELDS` the entry has.
+
+    """
+    index_entry = entry.search_index_entry
+    return {field: str(index_entry[field] or "") for field in _FIELDS if field in index_entry}
+
+
+def _fields_hash(fields):
+    return hashlib.sha1(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class HelpIndex:
+    """
+    An inverted index of help entries, kept up to date one entry at a time.
+
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """
+        Empty the index.
+
+        """
+        # {doc_id: {"key": str, "hash": str, "terms": {field: {term: weight}}}}
+        self.docs = {}
+        # {field: {term: {doc_id: weight}}}
+        self.postings = {field: {} for field in _FIELDS}
+        # {term: number of postings using it}
+        self.vocabulary = {}
+        self.sorted_vocabulary = []
+        # {term with one letter deleted: {term, ...}}
+        self.deletions = {}
+        self.dirty = False
+
+    # building
+
+    def _add_term(self, term):
+        if term in self.vocabulary:
+            self.vocabulary[term] += 1
+            return
+        self.vocabulary[term] = 1
+        vocab = self.sorted_vocabulary
+        vocab.insert(bisect_left(vocab, term), term)
+        for deletion in _deletions(term):
+            self.deletions.setdefault(deletion, set()).add(term)
+
+    def _remove_term(self, term):
+        self.vocabulary[term] -= 1
+        if self.vocabulary[term]:
+            return
+        del self.vocabulary[term]
+        vocab = self.sorted_vocabulary
+        del vocab[bisect_left(vocab, term)]
+        for deletion in _deletions(term):
+            terms = self.deletions[deletion]
+            terms.discard(term)
+            if not terms:
+                del self.deletions[deletion]
+
+    def add(self, entry_id, entry, fields=None):
+        """
+        Index a help entry, replacing any earlier version of it.
+
+        Args:
+            entry_id (str): The entry's id (see `doc_id`).
+            entry (any): The help entry, with a `search_index_entry`.
+            fields (dict, optional): The entry's fields, if already known.
+
+        """
+        fields = fields if fields is not None else _index_fields(entry)
+        self.remove(entry_id)
+        terms = {}
+        for field, value in fields.items():
+            tokens = tokenize(value)
+            if not tokens:
+                continue
+            if field == "text":
+                counts = {}
+                for token in tokens:
+                    if len(token) > 1:
+                        counts[token] = counts.get(token, 0) + 1
+                terms[field] = {token: 1 + math.log(count) for token, count in counts.items()}
+            else:
+                terms[field] = dict.fromkeys(tokens, 1.0)
+        for field, weights in terms.items():
+            postings = self.postings[field]
+            for term, weight in weights.items():
+                if term not in postings:
+                    postings[term] = {}
+                    self._add_term(term)
+                postings[term][entry_id] = weight
+        self.docs[entry_id] = {
+            "key": str(entry.key).lower(),
+            "hash": _fields_hash(fields),
+            "terms": terms,
+        }
+        self.dirty = True
+
+    def remove(self, entry_id):
+        """
+        Remove a help entry from the index, if it is there.
+
+        Args:
+            entry_id (str): The entry's id (see `doc_id`).
+
+        """
+        doc = self.docs.pop(entry_id, None)
+        if not doc:
+            return
+        for field, weights in doc["terms"].items():
+            postings = self.postings[field]
+            for term in weights:
+                docs = postings[term]
+                docs.pop(entry_id, None)
+                if not docs:
+                    del postings[term]
+                    self._remove_term(term)
+        self.dirty = True
+
+    def sync(self, entries):
+        """
+        Make the index hold exactly the given entries, re-indexing only
+        those whose fields changed.
+
+        Args:
+            entries (dict): `{doc_id: entry}`.
+
+        Returns:
+            tuple: `(indexed, removed)` - the number of entries (re-)indexed
+            and removed.
+
+        """
+        indexed = 0
+        for entry_id, entry in entries.items():
+            fields = _index_fields(entry)
+            doc = self.docs.get(entry_id)
+            if not doc or doc["hash"] != _fields_hash(fields):
+                self.add(entry_id, entry, fields=fields)
+                indexed += 1
+        stale = [entry_id for entry_id in self.docs if entry_id not in entries]
+        for entry_id in stale:
+            self.remove(entry_id)
+        return indexed, len(stale)
+
+    # persistence
+
+    def save(self, path):
+        """
+        Write the index to disk.
+
+        Args:
+            path (str): The file to write.
+
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fil:
+            json.dump({"version": _VERSION, "docs": self.docs}, fil, separators=(",", ":"))
+        os.replace(tmp_path, path)
+        self.dirty = False
+
+    def load(self, path):
+        """
+        Read an index saved with `save()`, replacing the current one. The
+        postings are rebuilt from the saved per-entry terms, which needs no
+        tokenizing.
+
+        Args:
+            path (str): The file to read.
+
+        Returns:
+            bool: If the index was loaded. A missing, unreadable or outdated
+            file leaves the index empty.
+
+        """
+        self.clear()
+        try:
+            with open(path, encoding="utf-8") as fil:
+                data = json.load(fil)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as err:
+            logger.log_warn(f"Help index {path} could not be read ({err}); rebuilding it.")
+            return False
+        if data.get("version") != _VERSION:
+            return False
+        for entry_id, doc in data["docs"].items():
+            for field, weights in doc["terms"].items():
+                postings = self.postings[field]
+                for term, weight in weights.items():
+                    if term not in postings:
+                        postings[term] = {}
+                        self._add_term(term)
+                    postings[term][entry_id] = weight
+            self.docs[entry_id] = doc
+        return True
+
+    # lookup
+
+    def expand(self, term, mode=EXACT):
+        """
+        Get the indexed terms a query term matches.
+
+        Args:
+            term (str): A query term.
+            mode (str, optional): `EXACT` only matches the term itself,
+                `PREFIX` also terms starting with it and `FUZZY` also terms one
+                typo away from it.
+
+        Returns:
+            dict: `{indexed_term: factor}`, where `factor` (at most 1) tells
+            how good the match is.
+
+        """
+        expanded = {term: 1.0} if term in self.vocabulary else {}
+        if mode == EXACT:
+            return expanded
+        vocab = self.sorted_vocabulary
+        for inum in range(bisect_left(vocab, term), len(vocab)):
+            if not vocab[inum].startswith(term):
+                break
+            expanded.setdefault(vocab[inum], _PREFIX_FACTOR)
+        if mode == FUZZY and len(term) >= _FUZZY_MIN_LENGTH:
+            # a typo'd term and its correct term share a one-letter deletion,
+            # or one is a one-letter deletion of the other
+            candidates = set(self.deletions.get(term, ()))
+            for deletion in _deletions(term):
+                if deletion in self.vocabulary:
+                    candidates.add(deletion)
+                candidates.update(self.deletions.get(deletion, ()))
+            for candidate in candidates:
+                if candidate not in expanded and _within_one_edit(term, candidate):
+                    expanded[candidate] = _FUZZY_FACTOR
+        return expanded
+
+    def _score(self, terms, boosts, allowed):
+        """
+        Score the allowed entries matching any of the expanded query terms.
+
+        Returns:
+            dict: `{doc_id: (score, number of query terms matched)}`.
+
+        """
+        scores = {}
+        for expanded in terms:
+            term_scores = {}
+            for field, boost in boosts.items():
+                postings = self.postings.get(field)
+                if not postings:
+                    continue
+                field_scores = {}
+                for term, factor in expanded.items():
+                    for entry_id, weight in postings.get(term, {}).items():
+                        if entry_id in allowed:
+                            score = boost * factor * weight
+                            if score > field_scores.get(entry_id, 0):
+                                field_scores[entry_id] = score
+                for entry_id, score in field_scores.items():
+                    term_scores[entry_id] = term_scores.get(entry_id, 0) + score
+            for entry_id, score in term_scores.items():
+                total, matched = scores.get(entry_id, (0, 0))
+                scores[entry_id] = (total + score, matched + 1)
+        return scores
+
+    def search(self, query, allowed, boosts=None, mode=EXACT, maxnum=5):
+        """
+        Search the index.
+
+        Args:
+            query (str): The search query. All its terms must match for an
+                entry to be a match.
+            allowed (dict): `{doc_id: entry}` of the entries the searcher may
+                find. Other indexed entries are ignored.
+            boosts (dict, optional): `{field: boost}` of the fields to match
+                in. Defaults to `DEFAULT_BOOSTS`.
+            mode (str, optional): `EXACT`, `PREFIX` or `FUZZY`, see `expand`.
+            maxnum (int, optional): Max number of matches and suggestions.
+
+        Returns:
+            tuple: `(matches, suggestions)` - the best matching entries, and
+            the keys of other entries for the searcher to try, which may also
+            be found in the entries' text. Both are best first.
+
+        """
+        boosts = boosts or DEFAULT_BOOSTS
+        query_terms = tokenize(query)
+        if not query_terms:
+            return [], []
+        terms = [self.expand(term, mode=mode) for term in query_terms]
+        query_key = " ".join(query_terms)
+
+        def _ranked(scores, need_all):
+            ranked = []
+            for entry_id, (score, matched) in scores.items():
+                if need_all and matched < len(query_terms):
+                    continue
+                doc = self.docs[entry_id]
+                if " ".join(tokenize(doc["key"])) == query_key:
+                    score += _KEY_BONUS
+                ranked.append((-score, doc["key"], entry_id))
+            ranked.sort()
+            return [entry_id for _, _, entry_id in ranked]
+
+        matches = _ranked(self._score(terms, boosts, allowed), True)[:maxnum]
+        text_boosts = {**boosts, "text": _TEXT_BOOST}
+        suggestions = [
+            allowed[entry_id].key
+            for entry_id in _ranked(self._score(terms, text_boosts, allowed), False)
+            if not matches or entry_id != matches[0]
+        ][:maxnum]
+        return [allowed[entry_id] for entry_id in matches], suggestions
+
+    def stats(self):
+        """
+        Get index stats.
+
+        Returns:
+            dict: With keys `entries` and `terms`.
+
+        """
+        return {"entries": len(self.docs), "terms": len(self.vocabulary)}
+
+
+HELP_INDEX = HelpIndex()
+# keys of database help entries to re-index at the end of the tick
+_PENDING_KEYS = set()
+
+
+def collect_entries():
+    """
+    Get all help entries to index at startup: the help-enabled commands of
+    the default cmdsets, the file and database help entries and all their
+    categories.
+
+    Returns:
+        dict: `{doc_id: entry}`.
+
+    """
+    from evennia.commands.cmdsethandler import import_cmdset
+    from evennia.commands.default.help import HelpCategory
+    from evennia.help.filehelp import FILE_HELP_ENTRIES
+    from evennia.help.models import HelpEntry
+
+    topics = []
+    for path in (settings.CMDSET_CHARACTER, settings.CMDSET_ACCOUNT, settings.CMDSET_SESSION):
+        cmdset = import_cmdset(path, None)
+        if cmdset:
+            topics.extend(cmd for cmd in cmdset.commands if cmd.auto_help)
+    topics.extend(FILE_HELP_ENTRIES.all())
+    topics.extend(HelpEntry.objects.all())
+
+    entries = {doc_id(topic): topic for topic in topics}
+    for category in {topic.help_category.lower() for topic in topics}:
+        entry = HelpCategory(category)
+        entries[doc_id(entry)] = entry
+    return entries
+
+
+def build():
+    """
+    Load the saved index and bring it up to date with the current help
+    entries, saving it again if anything changed, and start following
+    changes to database help entries. Called at server start.
+
+    """
+    from evennia.help.models import HelpEntry
+
+    post_save.connect(_at_help_entry_changed, sender=HelpEntry, dispatch_uid="pixarimud_help_index")
+    post_delete.connect(
+        _at_help_entry_changed, sender=HelpEntry, dispatch_uid="pixarimud_help_index"
+    )
+
+    path = settings.HELP_INDEX_FILE
+    loaded = HELP_INDEX.load(path)
+    indexed, removed = HELP_INDEX.sync(collect_entries())
+    if HELP_INDEX.dirty:
+        save()
+    if not loaded or indexed or removed:
+        logger.log_info(
+            f"Help index: {len(HELP_INDEX.docs)} entries, {indexed} (re)indexed, {removed} removed."
+        )
+
+
+def save():
+    """
+    Save the index to `settings.HELP_INDEX_FILE`, if it changed. Called at
+    server stop.
+
+    """
+    if not HELP_INDEX.dirty:
+        return
+    try:
+        HELP_INDEX.save(settings.HELP_INDEX_FILE)
+    except OSError as err:
+        logger.log_err(f"Help index could not be saved: {err}")
+
+
+def update_help_entry(key):
+    """
+    Re-index the database help entry with the given key after it was
+    created, changed or deleted.
+
+    Args:
+        key (str): The help entry's key.
+
+    """
+    from evennia.commands.default.help import HelpCategory
+    from evennia.help.models import HelpEntry
+
+    HELP_INDEX.remove(f"helpentry:{key.lower()}")
+    for entry in HelpEntry.objects.filter(db_key__iexact=key):
+        HELP_INDEX.add(doc_id(entry), entry)
+        category = HelpCategory(entry.help_category.lower())
+        if doc_id(category) not in HELP_INDEX.docs:
+            HELP_INDEX.add(doc_id(category), category)
+
+
+def _reindex_pending():
+    keys = list(_PENDING_KEYS)
+    _PENDING_KEYS.clear()
+    for key in keys:
+        update_help_entry(key)
+
+
+def _at_help_entry_changed(sender, instance=None, **kwargs):
+    # wait for the end of the tick, since aliases and tags are often set
+    # after the entry is saved
+    if not _PENDING_KEYS:
+        reactor.callLater(0, _reindex_pending)
+    _PENDING_KEYS.add(instance.key)
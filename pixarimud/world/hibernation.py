@@ -0,0 +1,414 @@
+"""
+Room hibernation
+
+Rooms nobody has been near for hours still have their scripts stepping,
+their tickers firing and their contents in the idmapper cache. Here idle
+areas are put to sleep instead, so CPU and memory go with the parts of
+the world in use rather than with its size.
+
+- An area is a zone (all rooms tagged with the zone's name, category
+  `zone`, as for `world/snapshot.py`) or a single room without a zone tag.
+- Every `settings.ROOM_HIBERNATE_CHECK` seconds, areas that had no
+  puppeted character in them for `settings.ROOM_HIBERNATE_AFTER` seconds
+  of server runtime go to sleep:
+  - the timed scripts on their rooms and everything in them are paused,
+  - the tickers of those objects, or with one of the rooms as argument
+    (like the respawn of a destroyed dummy), are taken out of the
+    TickerHandler, remembering the time they had left,
+  - and the contents are dropped from the idmapper cache.
+  The paused scripts and tickers are kept in an Attribute on each room, so
+  areas stay asleep over reloads.
+- A puppeted character entering a room wakes its area (see
+  `typeclasses.rooms.Room.at_object_receive`), and so does the periodic
+  check finding one there. Waking fast-forwards the time slept: scripts
+  and tickers that came due fire at once (once, not once per repeat
+  missed), the others go on with the time they had left. Tickers sharing
+  an interval share a timer, so those go on with their interval's timer
+  if it is running.
+
+See `stats()` (or `cachestats` in-game).
+
+"""
+
+from django.conf import settings
+from twisted.internet import task
+
+from evennia import SESSION_HANDLER, TICKER_HANDLER
+from evennia.objects.models import ObjectDB
+from evennia.objects.objects import DefaultRoom
+from evennia.scripts.models import ScriptDB
+from evennia.utils import gametime, logger
+from evennia.utils.utils import variable_from_module
+
+from world import idmapper_cache
+
+ZONE_CATEGORY = "zone"
+# the Attribute keeping what was paused, on each sleeping room
+STATE_KEY = "state"
+STATE_CATEGORY = "hibernation"
+# ids per query
+_CHUNK_SIZE = 500
+# set on fast-forwarded scripts that are already due; 0 reads as not paused
+_DUE_NOW = 0.01
+
+
+def _chunks(ids, size=_CHUNK_SIZE):
+    ids = list(ids)
+    for istart in range(0, len(ids), size):
+        yield ids[istart : istart + size]
+
+
+def _find_room(values, room_ids, depth=2):
+    """
+    Find one of the rooms among ticker arguments, looking into dicts,
+    lists and tuples a few levels down.
+
+    """
+    for value in values:
+        if isinstance(value, ObjectDB):
+            if value.id in room_ids:
+                return value.id
+        elif depth and isinstance(value, dict):
+            found = _find_room(value.values(), room_ids, depth - 1)
+            if found:
+                return found
+        elif depth and isinstance(value, (list, tuple)):
+            found = _find_room(value, room_ids, depth - 1)
+            if found:
+                return found
+    return None
+
+
+class Hibernation:
+    """
+    Puts idle areas to sleep and wakes them again.
+
+    """
+
+    def __init__(self, idle_time=1800, check_interval=60):
+        """
+        Args:
+            idle_time (int, optional): Seconds without players before an
+                area goes to sleep. 0 to never.
+            check_interval (int, optional): Seconds between checks.
+
+        """
+        self.idle_time = idle_time
+        self.check_interval = check_interval
+        self.loop = None
+        # {area: server runtime a player was last seen there}
+        self.last_active = {}
+        # ids of sleeping rooms
+        self.sleeping = set()
+        self.hibernated = 0
+        self.woken = 0
+        self.scripts_paused = 0
+        self.tickers_held = 0
+        self.evicted = 0
+
+    def start(self):
+        """
+        Pick up the rooms left asleep over a reload and start the checks.
+
+        """
+        self.sleeping.update(
+            ObjectDB.objects.get_by_attribute(key=STATE_KEY, category=STATE_CATEGORY).values_list(
+                "id", flat=True
+            )
+        )
+        if self.idle_time and self.loop is None:
+            self.loop = task.LoopingCall(self.check)
+            self.loop.start(self.check_interval, now=False)
+
+    def get_areas(self):
+        """
+        Get all areas.
+
+        Returns:
+            dict: `{area: [room_id, ...]}`, where `area` is `("zone", name)`
+            or `("room", room_id)`.
+
+        """
+        rooms = DefaultRoom.objects.all_family()
+        zones = {}
+        for room_id, zone in (
+            rooms.filter(db_tags__db_category=ZONE_CATEGORY, db_tags__db_tagtype__isnull=True)
+            .order_by("db_tags__db_key")
+            .values_list("id", "db_tags__db_key")
+        ):
+            # rooms in more than one zone go with the first
+            zones.setdefault(room_id, zone)
+        areas = {}
+        for room_id in rooms.values_list("id", flat=True):
+            zone = zones.get(room_id)
+            area = ("zone", zone) if zone else ("room", room_id)
+            areas.setdefault(area, []).append(room_id)
+        return areas
+
+    def get_area_rooms(self, room):
+        """
+        Get the rooms of a room's area.
+
+        Args:
+            room (Room): The room.
+
+        Returns:
+            tuple: `(area, room_ids)`.
+
+        """
+        zones = sorted(room.tags.get(category=ZONE_CATEGORY, return_list=True))
+        if not zones:
+            return ("room", room.id), [room.id]
+        room_ids = ObjectDB.objects.get_by_tag(key=zones[0], category=ZONE_CATEGORY).values_list(
+            "id", flat=True
+        )
+        return ("zone", zones[0]), list(room_ids)
+
+    def check(self):
+        """
+        Put areas idle for long enough to sleep, and wake sleeping areas
+        with players in them.
+
+        """
+        now = gametime.runtime()
+        occupied = set()
+        for session in SESSION_HANDLER.values():
+            puppet = session.puppet
+            if puppet and puppet.db_location_id:
+                occupied.add(puppet.db_location_id)
+
+        areas = self.get_areas()
+        # areas seen for the first time start counting now
+        self.last_active = {area: self.last_active.get(area, now) for area in areas}
+        to_sleep = {}
+        for area, room_ids in areas.items():
+            if not occupied.isdisjoint(room_ids):
+                self.last_active[area] = now
+                self.wake_rooms(room_ids)
+            elif now - self.last_active[area] >= self.idle_time:
+                awake = [room_id for room_id in room_ids if room_id not in self.sleeping]
+                if awake:
+                    to_sleep[area] = awake
+        if to_sleep:
+            try:
+                self.hibernate(to_sleep)
+            except Exception:
+                logger.log_trace("Error putting rooms to sleep.")
+
+    def hibernate(self, areas):
+        """
+        Put areas to sleep.
+
+        Args:
+            areas (dict): `{area: [room_id, ...]}`, the rooms to put to sleep.
+
+        """
+        now = gametime.runtime()
+        # {object_id: the room it is in, however deep}; rooms map to themselves
+        in_room = {room_id: room_id for room_ids in areas.values() for room_id in room_ids}
+        frontier = list(in_room)
+        while frontier:
+            found = []
+            for batch in _chunks(frontier):
+                for obj_id, location_id in ObjectDB.objects.filter(
+                    db_location_id__in=batch
+                ).values_list("id", "db_location_id"):
+                    if obj_id not in in_room:
+                        in_room[obj_id] = in_room[location_id]
+                        found.append(obj_id)
+            frontier = found
+
+        # {room_id: {"scripts": [...], "tickers": [...]}}
+        states = {}
+
+        def _state(room_id):
+            return states.setdefault(room_id, {"since": now, "scripts": [], "tickers": []})
+
+        paused = []
+        for batch in _chunks(in_room):
+            for script in ScriptDB.objects.filter(
+                db_obj_id__in=batch, db_is_active=True, db_interval__gt=0
+            ):
+                if script.db._paused_time:
+                    # paused by someone else; leave it to them
+                    continue
+                script.pause()
+                paused.append(script)
+                _state(in_room[script.db_obj_id])["scripts"].append(script)
+
+        tickers = TICKER_HANDLER.ticker_pool.tickers
+        for store_key, (args, kwargs) in list(TICKER_HANDLER.ticker_storage.items()):
+            packed_obj, methodname, path, interval, idstring, persistent = store_key
+            obj = kwargs.get("_obj")
+            room_id = in_room.get(obj.id) if isinstance(obj, ObjectDB) else None
+            if room_id is None:
+                room_id = _find_room(
+                    list(args) + [value for key, value in kwargs.items() if key[0] != "_"],
+                    in_room,
+                )
+            if room_id is None:
+                continue
+            ticker = tickers.get(interval)
+            left = ticker.task.next_call_time() if ticker else None
+            left = interval if left is None else left
+            kwargs = {key: value for key, value in kwargs.items() if key[0] != "_"}
+            _state(room_id)["tickers"].append(
+                (obj, methodname, path, interval, idstring, persistent, args, kwargs, left)
+            )
+            del TICKER_HANDLER.ticker_storage[store_key]
+            TICKER_HANDLER.ticker_pool.remove(store_key)
+        if any(state["tickers"] for state in states.values()):
+            TICKER_HANDLER.save()
+
+        for room_id, state in states.items():
+            room = ObjectDB.objects.get(id=room_id)
+            room.attributes.add(STATE_KEY, state, category=STATE_CATEGORY)
+            self.scripts_paused += len(state["scripts"])
+            self.tickers_held += len(state["tickers"])
+
+        # the contents, but not the rooms themselves, as exits lead to them
+        idmapper_cache.clear_pinned()
+        for script in paused:
+            script.flush_from_cache()
+        get_cached = ObjectDB.get_cached_instance
+        for obj_id, room_id in in_room.items():
+            obj = get_cached(obj_id) if obj_id != room_id else None
+            if obj:
+                obj.flush_from_cache()
+                if get_cached(obj_id) is None:
+                    self.evicted += 1
+
+        self.sleeping.update(room_id for room_ids in areas.values() for room_id in room_ids)
+        self.hibernated += len(areas)
+
+    def wake(self, room):
+        """
+        Wake the area of a room, if asleep.
+
+        Args:
+            room (Room): The room.
+
+        """
+        if room.id not in self.sleeping:
+            return
+        area, room_ids = self.get_area_rooms(room)
+        self.last_active[area] = gametime.runtime()
+        self.wake_rooms(room_ids)
+
+    def wake_rooms(self, room_ids):
+        """
+        Wake sleeping rooms, fast-forwarding their scripts and tickers.
+
+        Args:
+            room_ids (list): Room ids. Those not asleep are skipped.
+
+        """
+        room_ids = [room_id for room_id in room_ids if room_id in self.sleeping]
+        if not room_ids:
+            return
+        self.sleeping.difference_update(room_ids)
+        self.woken += 1
+        now = gametime.runtime()
+        for room in ObjectDB.objects.get_by_attribute(
+            key=STATE_KEY, category=STATE_CATEGORY
+        ).filter(id__in=room_ids):
+            state = room.attributes.get(STATE_KEY, category=STATE_CATEGORY)
+            room.attributes.remove(STATE_KEY, category=STATE_CATEGORY)
+            if not state:
+                continue
+            slept = max(0.0, now - state["since"])
+            for script in state["scripts"]:
+                try:
+                    _resume_script(script, slept)
+                except Exception:
+                    logger.log_trace(f"Error waking script {script}.")
+            for ticker in state["tickers"]:
+                try:
+                    _resume_ticker(ticker, slept)
+                except Exception:
+                    logger.log_trace(f"Error waking ticker {ticker[:6]}.")
+
+    def stats(self):
+        """
+        Get hibernation stats.
+
+        Returns:
+            dict: With keys `areas` (tracked), `sleeping` (rooms),
+            `hibernated` and `woken` (times areas were put to sleep and
+            woken), `scripts_paused`, `tickers_held` and `evicted` (cached
+            objects dropped).
+
+        """
+        return {
+            "areas": len(self.last_active),
+            "sleeping": len(self.sleeping),
+            "hibernated": self.hibernated,
+            "woken": self.woken,
+            "scripts_paused": self.scripts_paused,
+            "tickers_held": self.tickers_held,
+            "evicted": self.evicted,
+        }
+
+
+def _resume_script(script, slept):
+    if not script or script.db._manually_paused is None:
+        # deleted, or unpaused while asleep
+        return
+    left = (script.db._paused_time or 0) - slept
+    script.db._paused_time = max(left, _DUE_NOW)
+    script.unpause()
+
+
+def _resume_ticker(ticker, slept):
+    obj, methodname, path, interval, idstring, persistent, args, kwargs, left = ticker
+    if methodname:
+        if not obj:
+            # deleted while asleep
+            return
+        callback = getattr(obj, methodname)
+    else:
+        callback = variable_from_module(*path.rsplit(".", 1))
+    left -= slept
+    if left > 0:
+        TICKER_HANDLER.add(
+            interval, callback, idstring, persistent, *args, _start_delay=left, **kwargs
+        )
+        return
+    TICKER_HANDLER.add(interval, callback, idstring, persistent, *args, **kwargs)
+    # due while asleep; the callback may remove its own ticker
+    callback(*args, **kwargs)
+
+
+HIBERNATION = Hibernation(
+    idle_time=settings.ROOM_HIBERNATE_AFTER, check_interval=settings.ROOM_HIBERNATE_CHECK
+)
+
+
+def install():
+    """
+    Start putting idle areas to sleep. Called at server start.
+
+    """
+    HIBERNATION.start()
+
+
+def at_enter(room, obj):
+    """
+    Wake a room's area when a player comes in. Called by
+    `typeclasses.rooms.Room.at_object_receive`.
+
+    Args:
+        room (Room): The room entered.
+        obj (Object): The one entering.
+
+    """
+    if room.id in HIBERNATION.sleeping and obj.has_account:
+        HIBERNATION.wake(room)
+
+
+def stats():
+    """
+    Get the hibernation stats. See `Hibernation.stats`.
+
+    """
+    return HIBERNATION.stats()
@@ -0,0 +1,353 @@
+"""
+Bounded idmapper cache
+
+Evennia's idmapper keeps every typeclass instance it has ever loaded in a
+per-model cache (`ObjectDB.__instance_cache__` etc) until the whole cache is
+flushed for memory reasons. On a long-running server this grows steadily.
+
+This module caps the number of cached instances per database model, set with
+`settings.IDMAPPER_CACHE_MAX_INSTANCES`. Each capped model's cache is
+replaced by an `LRUInstanceCache` that keeps instances in least-recently
+used order; when a model goes over its cap, the least recently used
+instances are dropped until the cache is back down to
+`settings.IDMAPPER_CACHE_EVICT_TO` of the cap.
+
+Some instances are pinned and never evicted:
+
+- puppets of connected sessions, and their locations
+- connected accounts
+- objects with active scripts, and the active scripts themselves (timed
+  scripts only while not paused)
+- anything subscribed to the TickerHandler
+
+Instances are also only evicted if their `at_idmapper_flush()` allows it, as
+for Evennia's own cache flushes (it refuses, for example, for objects with
+NAttributes stored). `typeclasses.objects.ObjectParent.at_idmapper_flush`
+checks the pin list too, so pinned objects also survive Evennia's flushes.
+
+"""
+
+import sys
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.db.models import Model
+from twisted.internet import reactor, task
+
+from evennia.utils.idmapper.models import SharedMemoryModel
+
+# how often to re-check caps and re-install caches replaced by Evennia flushes
+_CHECK_INTERVAL = 60
+# how long a computed pin list is reused
+_PINNED_TTL = 1.0
+
+_LOOPING_CALL = None
+_PINNED = {}
+_PINNED_TIME = 0.0
+# {model_name: evicted_count}
+EVICTIONS = defaultdict(int)
+# ticker store keys use the lowercase model name
+_MODEL_NAMES = {
+    "objectdb": "ObjectDB",
+    "accountdb": "AccountDB",
+    "scriptdb": "ScriptDB",
+    "channeldb": "ChannelDB",
+}
+
+
+class LRUInstanceCache(OrderedDict):
+    """
+    An idmapper instance cache that remembers the order in which instances
+    were last looked up. Going over the cap schedules an eviction pass for
+    the next reactor tick, so cache lookups stay cheap.
+
+    """
+
+    def __init__(self, dbmodel, cap, *args, **kwargs):
+        # set before filling, since filling goes through __setitem__
+        self.dbmodel = dbmodel
+        self.cap = cap
+        self._evict_pending = False
+        super().__init__(*args, **kwargs)
+
+    def get(self, key, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.cap and not self._evict_pending and reactor.running:
+            self._evict_pending = True
+            reactor.callLater(0, evict, self.dbmodel)
+
+
+def get_capped_models():
+    """
+    Get the database models with a cache cap.
+
+    Returns:
+        dict: `{dbmodel: cap}`.
+
+    """
+    caps = {}
+    for model_name, cap in getattr(settings, "IDMAPPER_CACHE_MAX_INSTANCES", {}).items():
+        for dbmodel in get_dbmodels():
+            if dbmodel.__name__ == model_name and cap:
+                caps[dbmodel] = cap
+    return caps
+
+
+def get_dbmodels():
+    """
+    Get all idmapped database models (ObjectDB, ScriptDB etc).
+
+    Returns:
+        list: The concrete models, each with its own instance cache.
+
+    """
+    dbmodels = []
+
+    def _recurse(classes):
+        for cls in classes:
+            dbmodel = cls.__dbclass__ if hasattr(cls, "__dbclass__") else None
+            if dbmodel is not None and not dbmodel._meta.abstract and dbmodel not in dbmodels:
+                dbmodels.append(dbmodel)
+            _recurse(cls.__subclasses__())
+
+    _recurse(SharedMemoryModel.__subclasses__())
+    return dbmodels
+
+
+def install():
+    """
+    Install LRU caches on all capped models and start the periodic check.
+    Safe to call repeatedly; existing cache contents are kept.
+
+    """
+    global _LOOPING_CALL
+    for dbmodel, cap in get_capped_models().items():
+        cache = dbmodel.__instance_cache__
+        if isinstance(cache, LRUInstanceCache):
+            cache.cap = cap
+        else:
+            # Evennia's flushes replace the cache with a plain dict
+            cache = dbmodel.__instance_cache__ = LRUInstanceCache(dbmodel, cap, cache)
+            # contents caches hold on to the instance cache they were created with
+            for instance in cache.values():
+                contents_cache = instance.__dict__.get("contents_cache")
+                if contents_cache is not None:
+                    contents_cache._idcache = cache
+    if _LOOPING_CALL is None:
+        _LOOPING_CALL = task.LoopingCall(_check)
+        _LOOPING_CALL.start(_CHECK_INTERVAL, now=False)
+
+
+def _check():
+    install()
+    for dbmodel in get_capped_models():
+        evict(dbmodel)
+
+
+def get_pinned():
+    """
+    Get the ids of all instances that must stay cached. The result is reused
+    for a short while, since it is checked for every eviction candidate.
+
+    Returns:
+        dict: `{dbmodel_name: set_of_ids}`.
+
+    """
+    global _PINNED, _PINNED_TIME
+    now = time.time()
+    if now - _PINNED_TIME < _PINNED_TTL:
+        return _PINNED
+
+    from evennia import SESSION_HANDLER, TICKER_HANDLER
+    from evennia.scripts.models import ScriptDB
+
+    pinned = defaultdict(set)
+    for session in SESSION_HANDLER.values():
+        if session.account:
+            pinned["AccountDB"].add(session.account.id)
+        puppet = session.puppet
+        if puppet:
+            pinned["ObjectDB"].add(puppet.id)
+            if puppet.db_location_id:
+                pinned["ObjectDB"].add(puppet.db_location_id)
+
+    for script in ScriptDB.get_all_cached_instances():
+        # a paused timed script has no task and needs nothing kept cached
+        if script.db_is_active and (script.ndb._task or not script.db_interval):
+            pinned["ScriptDB"].add(script.id)
+            if script.db_obj_id:
+                pinned["ObjectDB"].add(script.db_obj_id)
+            if script.db_account_id:
+                pinned["AccountDB"].add(script.db_account_id)
+
+    for store_key in TICKER_HANDLER.ticker_storage:
+        packed_obj = store_key[0]
+        if isinstance(packed_obj, tuple) and packed_obj[0] == "__packed_dbobj__":
+            # ("__packed_dbobj__", (app_label, modelname), datestring, id)
+            pinned[_MODEL_NAMES.get(packed_obj[1][1], packed_obj[1][1])].add(packed_obj[3])
+
+    _PINNED, _PINNED_TIME = pinned, now
+    return pinned
+
+
+def clear_pinned():
+    """
+    Have the pin list recomputed when next used, like after pausing scripts.
+
+    """
+    global _PINNED_TIME
+    _PINNED_TIME = 0.0
+
+
+def is_pinned(instance):
+    """
+    Check if an instance must stay in the cache.
+
+    Args:
+        instance (SharedMemoryModel): The instance to check.
+
+    Returns:
+        bool: If the instance is pinned.
+
+    """
+    return instance.id in get_pinned().get(instance.__dbclass__.__name__, ())
+
+
+def evict(dbmodel):
+    """
+    Drop least recently used instances until the model's cache is down to
+    `settings.IDMAPPER_CACHE_EVICT_TO` of its cap.
+
+    Args:
+        dbmodel (Model): The database model, like `ObjectDB`.
+
+    Returns:
+        int: Number of evicted instances.
+
+    """
+    cache = dbmodel.__instance_cache__
+    if not isinstance(cache, LRUInstanceCache):
+        return 0
+    cache._evict_pending = False
+    if len(cache) <= cache.cap:
+        return 0
+
+    target = int(cache.cap * getattr(settings, "IDMAPPER_CACHE_EVICT_TO", 0.9))
+    pinned = get_pinned().get(dbmodel.__name__, ())
+    evicted = 0
+    # oldest first
+    for key, instance in list(cache.items()):
+        if len(cache) <= target:
+            break
+        if key in pinned or not instance.at_idmapper_flush():
+            continue
+        cache.pop(key, None)
+        evicted += 1
+    EVICTIONS[dbmodel.__name__] += evicted
+    return evicted
+
+
+def _sizeof(value, depth=2, seen=None):
+    """
+    Rough shallow-ish size of a value, following containers and plain
+    objects a few levels down but never into other database models.
+
+    """
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value, 0)
+    if depth <= 0 or isinstance(value, (str, bytes, int, float, type)) or callable(value):
+        return size
+    if isinstance(value, dict):
+        for key, val in value.items():
+            size += _sizeof(key, depth - 1, seen) + _sizeof(val, depth - 1, seen)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for val in value:
+            size += _sizeof(val, depth - 1, seen)
+    elif hasattr(value, "__dict__") and not isinstance(value, Model):
+        size += _sizeof(value.__dict__, depth - 1, seen)
+    return size
+
+
+def estimate_instance_bytes(instance):
+    """
+    Estimate the memory used by one cached instance, including its handlers
+    and their caches (but not other instances it references).
+
+    Args:
+        instance (SharedMemoryModel): A cached instance.
+
+    Returns:
+        int: Estimated size in bytes.
+
+    """
+    size = sys.getsizeof(instance, 0)
+    seen = {id(instance)}
+    for value in instance.__dict__.values():
+        if isinstance(value, Model):
+            continue
+        size += _sizeof(value, depth=3, seen=seen)
+    return size
+
+
+def cache_report(sample_size=50):
+    """
+    Report cache sizes per model and per typeclass.
+
+    Args:
+        sample_size (int, optional): Max number of instances per typeclass to
+            measure; the per-instance average is used for the rest.
+
+    Returns:
+        tuple: `(models, typeclasses)`. `models` is a list of dicts with keys
+        `model`, `size`, `cap`, `pinned` and `evicted`; `typeclasses` is a list of
+        dicts with `typeclass`, `model`, `count`, `avg_bytes` and `total_bytes`,
+        biggest first.
+
+    """
+    caps = get_capped_models()
+    pinned = get_pinned()
+    models = []
+    typeclasses = []
+    for dbmodel in get_dbmodels():
+        cache = dbmodel.__instance_cache__
+        name = dbmodel.__name__
+        models.append(
+            {
+                "model": name,
+                "size": len(cache),
+                "cap": caps.get(dbmodel),
+                "pinned": len(pinned.get(name, ())),
+                "evicted": EVICTIONS[name],
+            }
+        )
+        by_typeclass = defaultdict(list)
+        for instance in list(cache.values()):
+            by_typeclass[type(instance).__name__].append(instance)
+        for typeclass_name, instances in by_typeclass.items():
+            sample = instances[:sample_size]
+            avg = sum(estimate_instance_bytes(inst) for inst in sample) / len(sample)
+            typeclasses.append(
+                {
+                    "typeclass": typeclass_name,
+                    "model": name,
+                    "count": len(instances),
+                    "avg_bytes": int(avg),
+                    "total_bytes": int(avg * len(instances)),
+                }
+            )
+    typeclasses.sort(key=lambda row: row["total_bytes"], reverse=True)
+    return models, typeclasses
@@ -0,0 +1,360 @@
+"""
+Leaderboards
+
+Rankings for the website API (`web/api`): characters by experience, combat
+dummies by hits taken and bottomless pits by victims. Working these out
+from the database would mean reading and unpickling the Attribute of every
+character on each request, so instead:
+
+- Each board is kept in memory as a sorted list, updated in place by the
+  game as scores change (`record()`, called from
+  `Character.gain_experience`, `CombatDummy.get_hit` etc).
+- When the top `settings.LEADERBOARD_SIZE` of a board changes, its JSON is
+  serialized again at the end of the tick (once, however many updates came
+  in), along with an ETag from its contents. The web views only hand out
+  these bytes; they never touch the database, and the reactor never waits
+  for them.
+- The boards are saved to `settings.LEADERBOARD_FILE` every minute and at
+  server stop, and loaded at start. Only a board missing from the file is
+  rebuilt from the Attributes, once.
+
+"""
+
+import hashlib
+import json
+import os
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db.models.signals import post_delete
+from twisted.internet import reactor, task
+
+from evennia.objects.models import ObjectDB
+from evennia.utils import logger
+from evennia.utils.utils import class_from_module
+
+# bump when the file format changes
+_VERSION = 1
+_SAVE_INTERVAL = 60
+
+
+class Board:
+    """
+    One ranking, highest score first.
+
+    """
+
+    def __init__(self, name, title, typeclass, attribute, size=100):
+        """
+        Args:
+            name (str): Used in the url.
+            title (str): What is ranked.
+            typeclass (str): Path of the typeclass ranked (and its children).
+            attribute (str): The Attribute holding the score.
+            size (int, optional): Entries published.
+
+        """
+        self.name = name
+        self.title = title
+        self.typeclass = typeclass
+        self.attribute = attribute
+        self.size = size
+        # {obj_id: (score, name, fields)}
+        self.entries = {}
+        # [(-score, obj_id), ...], sorted
+        self.order = []
+        # (etag, json bytes), swapped in whole so web threads read it safely
+        self.published = None
+        self.updates = 0
+        self.serializations = 0
+
+    def _rank(self, obj_id):
+        entry = self.entries.get(obj_id)
+        if entry is None:
+            return None
+        return bisect_left(self.order, (-entry[0], obj_id))
+
+    def update(self, obj_id, score, name, fields=None):
+        """
+        Set an entry's score.
+
+        Args:
+            obj_id (int): The ranked object's id.
+            score (int): Its score.
+            name (str): The name to show.
+            fields (dict, optional): More to show, like `{"level": 3}`.
+
+        Returns:
+            bool: If the published top changed.
+
+        """
+        old_rank = self._rank(obj_id)
+        if old_rank is not None:
+            if self.entries[obj_id] == (score, name, fields):
+                return False
+            del self.order[old_rank]
+        self.entries[obj_id] = (score, name, fields)
+        insort(self.order, (-score, obj_id))
+        self.updates += 1
+        new_rank = self._rank(obj_id)
+        return new_rank < self.size or (old_rank is not None and old_rank < self.size)
+
+    def remove(self, obj_id):
+        """
+        Remove an entry.
+
+        Returns:
+            bool: If the published top changed.
+
+        """
+        rank = self._rank(obj_id)
+        if rank is None:
+            return False
+        del self.order[rank]
+        del self.entries[obj_id]
+        return rank < self.size
+
+    def top(self):
+        """
+        Get the published entries.
+
+        Returns:
+            list: A dict per entry, with `rank`, `id`, `name`, `score` and
+            the entry's other fields.
+
+        """
+        top = []
+        for rank, (_, obj_id) in enumerate(self.order[: self.size], 1):
+            score, name, fields = self.entries[obj_id]
+            top.append({"rank": rank, "id": obj_id, "name": name, "score": score, **(fields or {})})
+        return top
+
+    def publish(self):
+        """
+        Serialize the top entries for the web views.
+
+        """
+        top = self.top()
+        # from the entries only, so it stays the same over restarts
+        etag = hashlib.sha1(json.dumps(top, separators=(",", ":")).encode("utf-8")).hexdigest()
+        body = json.dumps(
+            {"board": self.name, "title": self.title, "updated": int(time.time()), "entries": top},
+            separators=(",", ":"),
+        ).encode("utf-8")
+        self.published = (f'"{etag[:20]}"', body)
+        self.serializations += 1
+
+    def rebuild(self):
+        """
+        Rebuild the board from the database, with one query.
+
+        """
+        self.entries.clear()
+        self.order.clear()
+        typeclass = class_from_module(self.typeclass)
+        rows = (
+            typeclass.objects.all_family()
+            .filter(db_attributes__db_key=self.attribute, db_attributes__db_category__isnull=True)
+            .values_list("id", "db_key", "db_attributes__db_value")
+        )
+        for obj_id, key, score in rows.iterator():
+            if isinstance(score, int):
+                self.entries[obj_id] = (score, key, self.get_fields(typeclass, score))
+                self.order.append((-score, obj_id))
+        self.order.sort()
+
+    def get_fields(self, typeclass, score):
+        """
+        Get the extra fields of an entry rebuilt from the database.
+
+        """
+        if hasattr(typeclass, "level_for"):
+            return {"level": typeclass.level_for(score)}
+        return None
+
+
+BOARDS = {
+    board.name: board
+    for board in (
+        Board(
+            "characters",
+            "Characters by experience",
+            settings.BASE_CHARACTER_TYPECLASS,
+            "experience",
+            size=settings.LEADERBOARD_SIZE,
+        ),
+        Board(
+            "dummies",
+            "Combat dummies by hits taken",
+            "typeclasses.objects.CombatDummy",
+            "hits_taken",
+            size=settings.LEADERBOARD_SIZE,
+        ),
+        Board(
+            "pits",
+            "Bottomless pits by victims",
+            "typeclasses.objects.BottomlessPit",
+            "victims",
+            size=settings.LEADERBOARD_SIZE,
+        ),
+    )
+}
+
+_PENDING = set()
+_DIRTY = False
+_LOOPING_CALL = None
+
+
+def _publish_pending():
+    names = list(_PENDING)
+    _PENDING.clear()
+    for name in names:
+        BOARDS[name].publish()
+
+
+def _changed(board, published):
+    global _DIRTY
+    _DIRTY = True
+    if published:
+        # once at the end of the tick, however many scores changed in it
+        if not _PENDING:
+            reactor.callLater(0, _publish_pending)
+        _PENDING.add(board.name)
+
+
+def record(board_name, obj, score, **fields):
+    """
+    Record a new score.
+
+    Args:
+        board_name (str): The board, like "characters".
+        obj (Object): The one scoring.
+        score (int): The new score.
+        **fields: More to show, like `level=3`.
+
+    """
+    board = BOARDS[board_name]
+    _changed(board, board.update(obj.id, score, obj.key, fields or None))
+
+
+def _at_object_deleted(sender, instance, **kwargs):
+    if isinstance(instance, ObjectDB):
+        for board in BOARDS.values():
+            if instance.id in board.entries:
+                _changed(board, board.remove(instance.id))
+
+
+def get_published(board_name):
+    """
+    Get a board's serialized JSON. Safe to call from web threads.
+
+    Args:
+        board_name (str): The board.
+
+    Returns:
+        tuple or None: `(etag, json_bytes)`, or `None` for no such board.
+
+    """
+    board = BOARDS.get(board_name)
+    return board.published if board else None
+
+
+def load(path):
+    """
+    Load boards saved with `save()`.
+
+    Returns:
+        list: The names of the boards loaded.
+
+    """
+    try:
+        with open(path, encoding="utf-8") as fil:
+            data = json.load(fil)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as err:
+        logger.log_warn(f"Leaderboards {path} could not be read ({err}); rebuilding them.")
+        return []
+    if data.get("version") != _VERSION:
+        return []
+    loaded = []
+    for name, rows in data["boards"].items():
+        board = BOARDS.get(name)
+        if not board:
+            continue
+        board.entries = {obj_id: (score, key, fields) for obj_id, score, key, fields in rows}
+        board.order = sorted((-score, obj_id) for obj_id, score, _, _ in rows)
+        loaded.append(name)
+    return loaded
+
+
+def save():
+    """
+    Save the boards to `settings.LEADERBOARD_FILE`, if they changed. Called
+    every minute and at server stop.
+
+    """
+    global _DIRTY
+    if not _DIRTY:
+        return
+    path = settings.LEADERBOARD_FILE
+    data = {
+        "version": _VERSION,
+        "boards": {
+            name: [
+                [obj_id, score, key, fields] for obj_id, (score, key, fields) in board.entries.items()
+            ]
+            for name, board in BOARDS.items()
+        },
+    }
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as fil:
+            json.dump(data, fil, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except OSError as err:
+        logger.log_err(f"Leaderboards could not be saved: {err}")
+        return
+    _DIRTY = False
+
+
+def build():
+    """
+    Load the saved boards, rebuild any missing from the database, publish
+    them and start following deletions and saving. Called at server start.
+
+    """
+    global _DIRTY, _LOOPING_CALL
+    post_delete.connect(_at_object_deleted, dispatch_uid="pixarimud_leaderboard")
+    loaded = load(settings.LEADERBOARD_FILE)
+    for name, board in BOARDS.items():
+        if name not in loaded:
+            board.rebuild()
+            _DIRTY = True
+            logger.log_info(f"Leaderboard '{name}' rebuilt: {len(board.entries)} entries.")
+        board.publish()
+    save()
+    if _LOOPING_CALL is None:
+        _LOOPING_CALL = task.LoopingCall(save)
+        _LOOPING_CALL.start(_SAVE_INTERVAL, now=False)
+
+
+def stats():
+    """
+    Get leaderboard stats.
+
+    Returns:
+        list: A dict per board with keys `board`, `entries`, `updates` and
+        `serializations`.
+
+    """
+    return [
+        {
+            "board": name,
+            "entries": len(board.entries),
+            "updates": board.updates,
+            "serializations": board.serializations,
+        }
+        for name, board in BOARDS.items()
+    ]
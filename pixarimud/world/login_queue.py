@@ -0,0 +1,257 @@
+"""
+Login queue
+
+Checking or setting a password means hashing it, which is slow on purpose
+(a good part of a second of CPU with Django's default hasher). Evennia does
+it on the reactor thread, so when hundreds of clients reconnect after a
+restart everyone in the game freezes until all their logins are checked.
+
+This module runs the hashing in a small thread pool of
+`settings.LOGIN_HASH_THREADS` threads, behind an admission queue:
+
+- At most `settings.LOGIN_QUEUE_SIZE` hashing jobs wait at a time, and at
+  most `settings.LOGIN_QUEUE_PER_IP` from the same IP. Jobs over the limit
+  fail at once with `LoginQueueFull`.
+- Waiting jobs are started round-robin per IP, so one address firing off
+  many attempts can't hold up everyone else.
+- How long jobs wait and how long the hashing takes is recorded; see
+  `stats()` (or `loginstats` in-game).
+
+The login and account creation of `typeclasses.accounts.Account` use it
+through `check_password()` and `make_password()`:
+
+    from world import login_queue
+
+    login_queue.check_password(ip, password, account.password).addCallback(...)
+
+"""
+
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+# samples kept for the percentiles in stats()
+_SAMPLES = 1000
+
+
+class LoginQueueFull(RuntimeError):
+    """
+    Too many logins are waiting, in total or from one IP.
+
+    """
+
+    pass
+
+
+class _Timing:
+    """
+    Count, mean, max and 95th percentile of a duration.
+
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=_SAMPLES)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    def stats(self):
+        samples = sorted(self.samples)
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p95": samples[int(len(samples) * 0.95)] if samples else 0.0,
+            "max": self.max,
+        }
+
+
+class LoginQueue:
+    """
+    A bounded thread pool for password hashing, with a per-IP fair
+    admission queue.
+
+    """
+
+    def __init__(self, threads=4, max_queued=500, max_per_ip=5):
+        """
+        Args:
+            threads (int, optional): Hashing threads.
+            max_queued (int, optional): Max jobs waiting for a thread.
+            max_per_ip (int, optional): Max jobs waiting or running per IP.
+
+        """
+        self.threads = threads
+        self.max_queued = max_queued
+        self.max_per_ip = max_per_ip
+        self.pool = None
+        # {ip: deque([(func, args, deferred, queued_at), ...])}, in serving order
+        self.waiting = OrderedDict()
+        self.queued = 0
+        self.running = 0
+        # {ip: jobs waiting or running}
+        self.per_ip = {}
+        self.rejected = 0
+        self.wait_time = _Timing()
+        self.hash_time = _Timing()
+
+    def _get_pool(self):
+        if self.pool is None:
+            self.pool = ThreadPool(minthreads=0, maxthreads=self.threads, name="login_hash")
+            self.pool.start()
+            reactor.addSystemEventTrigger("during", "shutdown", self.pool.stop)
+        return self.pool
+
+    def submit(self, ip, func, *args):
+        """
+        Queue a hashing job. Call from the reactor thread.
+
+        Args:
+            ip (str): The address the login comes from.
+            func (callable): The job, run in a hashing thread. It must not
+                touch the database.
+            *args: Passed to `func`.
+
+        Returns:
+            Deferred: Fires with the return of `func`, or fails with
+            `LoginQueueFull`.
+
+        """
+        ip = str(ip or "")
+        if self.queued >= self.max_queued or self.per_ip.get(ip, 0) >= self.max_per_ip:
+            self.rejected += 1
+            return defer.fail(LoginQueueFull("The server is busy; please try again in a moment."))
+        deferred = defer.Deferred()
+        self.waiting.setdefault(ip, deque()).append((func, args, deferred, time.perf_counter()))
+        self.queued += 1
+        self.per_ip[ip] = self.per_ip.get(ip, 0) + 1
+        self._dispatch()
+        return deferred
+
+    def _dispatch(self):
+        while self.waiting and self.running < self.threads:
+            ip, jobs = next(iter(self.waiting.items()))
+            func, args, deferred, queued_at = jobs.popleft()
+            if jobs:
+                # the next job from this IP waits for all other IPs' turns
+                self.waiting.move_to_end(ip)
+            else:
+                del self.waiting[ip]
+            self.queued -= 1
+            self.running += 1
+            self.wait_time.add(time.perf_counter() - queued_at)
+            threads.deferToThreadPool(reactor, self._get_pool(), _timed, func, *args).addBoth(
+                self._done, ip, deferred
+            )
+
+    def _done(self, result, ip, deferred):
+        self.running -= 1
+        self.per_ip[ip] -= 1
+        if not self.per_ip[ip]:
+            del self.per_ip[ip]
+        self._dispatch()
+        if isinstance(result, tuple):
+            result, seconds = result
+            self.hash_time.add(seconds)
+            deferred.callback(result)
+        else:
+            deferred.errback(result)
+
+    def stats(self):
+        """
+        Get queue stats.
+
+        Returns:
+            dict: With keys `threads`, `running`, `queued`, `rejected`, and
+            `wait` and `hash`, each a dict with `count`, `mean`, `p95` and
+            `max` seconds.
+
+        """
+        return {
+            "threads": self.threads,
+            "running": self.running,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "wait": self.wait_time.stats(),
+            "hash": self.hash_time.stats(),
+        }
+
+
+def _timed(func, *args):
+    t0 = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - t0
+
+
+def _check(password, encoded):
+    """
+    Check a password against its hash, and rehash it if the hasher settings
+    changed since it was set.
+
+    """
+    if not encoded:
+        # unknown account; hash anyway so the reply takes as long as usual
+        hashers.make_password(password)
+        return False, None
+    if not hashers.check_password(password, encoded):
+        return False, None
+    if hashers.identify_hasher(encoded).must_update(encoded):
+        return True, hashers.make_password(password)
+    return True, None
+
+
+LOGIN_QUEUE = LoginQueue(
+    threads=settings.LOGIN_HASH_THREADS,
+    max_queued=settings.LOGIN_QUEUE_SIZE,
+    max_per_ip=settings.LOGIN_QUEUE_PER_IP,
+)
+
+
+def check_password(ip, password, encoded):
+    """
+    Check a password in the hashing pool.
+
+    Args:
+        ip (str): The address the login comes from.
+        password (str): The password given.
+        encoded (str or None): The account's stored password hash, or
+            `None` if there is no such account.
+
+    Returns:
+        Deferred: Fires with `(valid, new_hash)`, where `new_hash` is set if
+        the stored hash should be replaced with it.
+
+    """
+    return LOGIN_QUEUE.submit(ip, _check, password, encoded)
+
+
+def make_password(ip, password):
+    """
+    Hash a new password in the hashing pool.
+
+    Args:
+        ip (str): The address the request comes from.
+        password (str): The password.
+
+    Returns:
+        Deferred: Fires with the hash.
+
+    """
+    return LOGIN_QUEUE.submit(ip, hashers.make_password, password)
+
+
+def stats():
+    """
+    Get the login queue stats. See `LoginQueue.stats`.
+
+    """
+    return LOGIN_QUEUE.stats()
@@ -0,0 +1,153 @@
+"""
+Flattened prototype cache
+
+Every `spawn` of a prototype key looks the prototype up again, walks its
+whole `prototype_parent` chain (searching the module and database
+prototypes for each parent), validates the result and merges it. For hot
+spawners - respawning mobs, loot drops, `bulkspawn` - this is most of the
+work.
+
+This module keeps the fully flattened prototype per prototype key, so the
+chain is resolved and validated once:
+
+    from world import prototype_cache
+
+    goblins = prototype_cache.spawn("GOBLIN_ARCHWIZARD", "GOBLIN_ARCHWIZARD")
+    flat = prototype_cache.get_flattened("GOBLIN_ARCHWIZARD")
+
+Each cached prototype remembers the module and database prototypes it was
+built from. Evennia replaces a module prototype's dict when the prototype
+modules are (re)loaded, and a database prototype's cached dict whenever it
+is saved or deleted, so a cached prototype is rebuilt as soon as any
+prototype in its chain is no longer the one it was built from. Use
+`clear()` to drop everything by hand.
+
+Callables and protfuncs in the prototype are still run on every spawn;
+only the lookup and merging are cached.
+
+"""
+
+from evennia.prototypes import prototypes as protlib
+from evennia.prototypes import spawner
+from evennia.utils.utils import make_iter
+
+# {prototype_key: (flattened_prototype, sources)}
+_CACHE = {}
+_STATS = {"hits": 0, "misses": 0}
+
+
+def _source(prototype_key):
+    """
+    Get a marker for where a prototype currently comes from, for telling
+    later if it has changed.
+
+    Returns:
+        tuple: `(prototype_key, db_id, prototype)`, where `db_id` is None for
+        module prototypes and `prototype` is the dict Evennia currently has
+        stored for it.
+
+    """
+    if prototype_key in protlib._MODULE_PROTOTYPES:
+        return (prototype_key, None, protlib._MODULE_PROTOTYPES[prototype_key])
+    db_id = (
+        protlib.DbPrototype.objects.filter(db_key__iexact=prototype_key)
+        .values_list("id", flat=True)
+        .first()
+    )
+    return (prototype_key, db_id, protlib.DB_PROTOTYPE_CACHE.get(db_id))
+
+
+def _is_current(source):
+    prototype_key, db_id, prototype = source
+    if db_id is None:
+        return protlib._MODULE_PROTOTYPES.get(prototype_key) is prototype
+    return protlib.DB_PROTOTYPE_CACHE.get(db_id) is prototype
+
+
+def _chain_sources(prototype, sources):
+    """
+    Record the source of every named parent in a prototype's chain.
+
+    """
+    for parent in make_iter(prototype.get("prototype_parent") or ()):
+        if isinstance(parent, dict):
+            _chain_sources(parent, sources)
+            continue
+        parent_key = parent.lower()
+        if any(source[0] == parent_key for source in sources):
+            continue
+        parent_prototype = protlib.search_prototype(key=parent_key, require_single=True)[0]
+        sources.append(_source(parent_key))
+        _chain_sources(parent_prototype, sources)
+
+
+def get_flattened(prototype_key):
+    """
+    Get a prototype with its whole parent chain merged in and validated.
+
+    Args:
+        prototype_key (str): The prototype key, like `"COMBAT_DUMMY"`.
+
+    Returns:
+        dict: A copy of the flattened prototype, with no `prototype_parent`.
+
+    Raises:
+        KeyError: If the prototype (or one of its parents) is not found.
+        RuntimeError: If the prototype is invalid.
+
+    """
+    prototype_key = prototype_key.lower()
+    cached = _CACHE.get(prototype_key)
+    if cached and all(_is_current(source) for source in cached[1]):
+        _STATS["hits"] += 1
+        return dict(cached[0])
+
+    _STATS["misses"] += 1
+    prototype = protlib.search_prototype(key=prototype_key, require_single=True)[0]
+    # the search caches database prototypes, so get the sources after it
+    sources = [_source(prototype_key)]
+    _chain_sources(prototype, sources)
+    flattened = spawner.flatten_prototype(prototype, validate=True)
+    _CACHE[prototype_key] = (flattened, sources)
+    return dict(flattened)
+
+
+def spawn(*prototype_keys, **kwargs):
+    """
+    Spawn objects from prototype keys, using the flattened prototypes.
+
+    Args:
+        *prototype_keys (str): Prototype keys to spawn, one object each.
+        **kwargs: Passed on to `evennia.prototypes.spawner.spawn`.
+
+    Returns:
+        list: The new objects.
+
+    """
+    return spawner.spawn(*(get_flattened(key) for key in prototype_keys), **kwargs)
+
+
+def clear():
+    """
+    Drop all cached prototypes and reset the stats.
+
+    """
+    _CACHE.clear()
+    _STATS.update(hits=0, misses=0)
+
+
+def stats():
+    """
+    Get cache stats.
+
+    Returns:
+        dict: With keys `size`, `hits`, `misses` and `hit_rate`.
+
+    """
+    lookups = _STATS["hits"] + _STATS["misses"]
+    return {
+        "size": len(_CACHE),
+        "hits": _STATS["hits"],
+        "misses": _STATS["misses"],
+        "hit_rate": _STATS["hits"] / lookups if lookups else 0.0,
+    }
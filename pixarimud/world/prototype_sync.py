@@ -0,0 +1,439 @@
+"""
+Prototype sync
+
+Evennia's `batch_update_objects_with_prototype` (used by `spawn/update` and
+the OLC) updates objects spawned from a prototype one by one, saving every
+object and re-adding all of its Attributes and Tags. With tens of thousands
+of dummies spawned from `WORN_DUMMY` that takes minutes and blocks the
+server the whole time.
+
+A `PrototypeSync` works out once what has changed, by comparing the
+current (flattened, see `world/prototype_cache.py`) prototype with one
+*reference* object spawned from it, and then applies only those changes to
+all objects spawned from the prototype:
+
+- a changed `key` or `typeclass`
+- lock types set by the prototype (merged into each object's own locks)
+- Attributes that are new or have a new value
+- new Tags, aliases and permissions
+
+The objects are updated in chunks of `CHUNK_SIZE`, each in its own
+transaction and with bulk queries only (see `world/bulk_create.py`).
+`sync_prototype()` (or `run_sync()` for a `PrototypeSync` made
+beforehand) runs one chunk per reactor iteration, so the server
+stays responsive, and reports progress as it goes. With `dry_run`, the
+same work is done without writing anything, to find out how many objects
+would change.
+
+Things to note:
+
+- Since the diff is made against the reference object, that should be an
+  object in its freshly spawned state. By default the oldest spawned
+  object is used.
+- Nothing is removed from the objects: Attributes and Tags an object got
+  during play can't be told from those dropped from the prototype.
+- Attributes with random or other dynamic values (callables and
+  `$protfuncs`) are only set if the reference object doesn't have them yet,
+  and are then evaluated for each object.
+- `location`, `home`, `destination` and `exec` are never synced.
+- Objects created by `world/world_import.py` are skipped; importing their
+  world module again updates them.
+- `at_object_post_spawn()` is only called on changed objects whose
+  typeclass overrides it, since it needs the object loaded.
+
+"""
+
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from twisted.internet import task
+
+from evennia.objects.models import ObjectDB
+from evennia.objects.objects import DefaultObject
+from evennia.prototypes import prototypes as protlib
+from evennia.utils import logger
+from evennia.utils.dbserialize import deserialize
+from evennia.utils.utils import class_from_module
+
+from world import bulk_create, prototype_cache
+from world.world_import import IMPORT_TAG_CATEGORY
+
+# objects per transaction
+CHUNK_SIZE = 1000
+# prototype keys synced as database fields
+_FIELDS = {"key": "db_key", "typeclass": "db_typeclass_path"}
+
+
+def _is_dynamic(value):
+    """
+    Check if a prototype value is evaluated anew for every spawned object.
+
+    """
+    if callable(value):
+        return True
+    if value and isinstance(value, (list, tuple)) and callable(value[0]):
+        return True
+    return isinstance(value, str) and "$" in value
+
+
+def get_spawned_ids(prototype_key):
+    """
+    Get the ids of the objects spawned from a prototype, leaving out those
+    created by the world importer.
+
+    Args:
+        prototype_key (str): The prototype key.
+
+    Returns:
+        list: Object ids, oldest first.
+
+    """
+    imported = ObjectDB.objects.filter(db_tags__db_category=IMPORT_TAG_CATEGORY)
+    return list(
+        ObjectDB.objects.filter(
+            db_tags__db_key=prototype_key.lower(),
+            db_tags__db_category=protlib.PROTOTYPE_TAG_CATEGORY,
+            db_tags__db_tagtype=None,
+        )
+        .exclude(id__in=imported.values("id"))
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+
+
+class PrototypeSync:
+    """
+    Apply the changes to a prototype to all objects spawned from it.
+
+    """
+
+    def __init__(self, prototype_key, reference=None, caller=None, chunk_size=CHUNK_SIZE):
+        """
+        Work out the changes. This looks up the objects' ids but loads no
+        objects other than the reference object.
+
+        Args:
+            prototype_key (str): The prototype key, like `"WORN_DUMMY"`.
+            reference (Object, optional): The object to compare the
+                prototype with. Defaults to the oldest spawned object.
+            caller (Object or Account, optional): Passed on to protfuncs
+                for access checks, as for `spawn`.
+            chunk_size (int, optional): Objects per transaction.
+
+        Raises:
+            KeyError: If the prototype is not found.
+            RuntimeError: If the prototype is invalid.
+
+        """
+        self.prototype = prototype_cache.get_flattened(prototype_key)
+        self.prototype_key = self.prototype["prototype_key"]
+        self.caller = caller
+        self.chunk_size = chunk_size
+        self.object_ids = get_spawned_ids(self.prototype_key)
+
+        # the changes
+        self.fields = {}
+        self.locks = ""
+        self.attributes = []
+        self.dynamic_attributes = []
+        self.tagdefs = {}
+
+        # {part: set_of_changed_ids}
+        self.changed = defaultdict(set)
+        self.done = 0
+        self.seconds = 0.0
+
+        if reference is None and self.object_ids:
+            reference = ObjectDB.objects.get(id=self.object_ids[0])
+        self.reference = reference
+        if reference is not None:
+            self._diff(reference)
+
+    def _diff(self, reference):
+        """
+        Compare the prototype with the reference object.
+
+        """
+        prototype = self.prototype
+        for name, field in _FIELDS.items():
+            value = prototype.get(name)
+            if value and not _is_dynamic(value) and getattr(reference, field) != value:
+                self.fields[name] = value
+
+        locks = prototype.get("locks")
+        if locks and bulk_create.merge_locks(reference.db_lock_storage, locks) != (
+            reference.db_lock_storage
+        ):
+            self.locks = locks
+
+        current = {
+            (attr.key, attr.category): attr.value for attr in reference.attributes.all()
+        }
+        for attrname, value, category, lockstring in prototype.get("attrs", ()):
+            key = bulk_create._normalize(attrname, category)
+            if _is_dynamic(value):
+                if key not in current:
+                    self.dynamic_attributes.append((attrname, value, category, lockstring))
+            elif key not in current or deserialize(current[key]) != value:
+                self.attributes.append((attrname, value, category, lockstring))
+
+        tagdefs = bulk_create.get_tagdefs(
+            permissions=prototype.get("permissions", ()),
+            aliases=prototype.get("aliases", ()),
+            tags=prototype.get("tags", ()),
+        )
+        current = bulk_create.get_tagdefs(
+            permissions=reference.permissions.all(),
+            aliases=reference.aliases.all(),
+            tags=reference.tags.all(return_key_and_category=True),
+        )
+        self.tagdefs = {
+            tagdef: data for tagdef, data in tagdefs.items() if tagdef not in current
+        }
+
+    @property
+    def has_changes(self):
+        return bool(
+            self.fields
+            or self.locks
+            or self.attributes
+            or self.dynamic_attributes
+            or self.tagdefs
+        )
+
+    def describe(self):
+        """
+        Describe the changes.
+
+        Returns:
+            list: One line per change.
+
+        """
+        def _name(key, category):
+            return f"{key}[{category}]" if category else key
+
+        lines = [f"{name} -> {value}" for name, value in self.fields.items()]
+        if self.locks:
+            lines.append(f"locks += {self.locks}")
+        for attrname, value, category, _ in self.attributes:
+            lines.append(f"attribute {_name(attrname, category)} = {value!r}")
+        for attrname, value, category, _ in self.dynamic_attributes:
+            lines.append(f"attribute {_name(attrname, category)} = {value!r} (if missing)")
+        for key, category, tagtype in self.tagdefs:
+            lines.append(f"{tagtype or 'tag'} {_name(key, category)}")
+        return lines
+
+    def _init(self, value):
+        return protlib.init_spawn_value(
+            value,
+            protlib.value_to_obj_or_any,
+            caller=self.caller,
+            prototype=self.prototype,
+        )
+
+    def _sync_fields(self, ids, dry_run):
+        for name, value in self.fields.items():
+            field = _FIELDS[name]
+            query = ObjectDB.objects.filter(id__in=ids).exclude(**{field: value})
+            changed = list(query.values_list("id", flat=True))
+            self.changed[name].update(changed)
+            if dry_run or not changed:
+                continue
+            uncached = []
+            for obj_id in changed:
+                obj = ObjectDB.get_cached_instance(obj_id)
+                if obj is None:
+                    uncached.append(obj_id)
+                elif name == "typeclass":
+                    obj.swap_typeclass(value, clean_attributes=False, run_start_hooks=None)
+                else:
+                    setattr(obj, field, value)
+            ObjectDB.objects.filter(id__in=changed if name == "key" else uncached).update(
+                **{field: value}
+            )
+
+    def _sync_locks(self, ids, dry_run):
+        by_storage = defaultdict(list)
+        for obj_id, lock_storage in ObjectDB.objects.filter(id__in=ids).values_list(
+            "id", "db_lock_storage"
+        ):
+            merged = bulk_create.merge_locks(lock_storage, self.locks)
+            if merged != lock_storage:
+                by_storage[merged].append(obj_id)
+        for lock_storage, changed in by_storage.items():
+            self.changed["locks"].update(changed)
+            if dry_run:
+                continue
+            ObjectDB.objects.filter(id__in=changed).update(db_lock_storage=lock_storage)
+            for obj_id in changed:
+                obj = ObjectDB.get_cached_instance(obj_id)
+                if obj is not None:
+                    obj.db_lock_storage = lock_storage
+                    # the lock handler is re-created from the new storage when next used
+                    obj.__dict__.pop("locks", None)
+
+    def _sync_chunk(self, ids, dry_run):
+        """
+        Apply the changes to one chunk of objects, in one transaction.
+
+        """
+        with transaction.atomic():
+            if self.fields:
+                self._sync_fields(ids, dry_run)
+            if self.locks:
+                self._sync_locks(ids, dry_run)
+            if self.attributes or self.dynamic_attributes:
+                items = [
+                    (
+                        obj_id,
+                        self.attributes
+                        + [
+                            (attrname, self._init(value), category, lockstring)
+                            for attrname, value, category, lockstring in self.dynamic_attributes
+                        ],
+                    )
+                    for obj_id in ids
+                ]
+                self.changed["attributes"].update(
+                    bulk_create.bulk_set_attributes(items, dry_run=dry_run)
+                )
+            if self.tagdefs:
+                self.changed["tags"].update(
+                    bulk_create.bulk_set_tags(
+                        [(obj_id, self.tagdefs) for obj_id in ids], dry_run=dry_run
+                    )
+                )
+        if not dry_run:
+            self._post_spawn(ids)
+
+    def _post_spawn(self, ids):
+        """
+        Call `at_object_post_spawn` on the changed objects of a chunk, if
+        their typeclass has its own version of it.
+
+        """
+        typeclass = class_from_module(
+            self.prototype.get("typeclass", settings.BASE_OBJECT_TYPECLASS)
+        )
+        if typeclass.at_object_post_spawn is DefaultObject.at_object_post_spawn:
+            return
+        ids = set(ids)
+        changed = set()
+        for part in self.changed.values():
+            changed.update(part & ids)
+        for obj in ObjectDB.objects.filter(id__in=changed):
+            obj.at_object_post_spawn(prototype=self.prototype)
+
+    def run(self, dry_run=False):
+        """
+        Apply the changes, one chunk at a time.
+
+        Args:
+            dry_run (bool, optional): Don't write anything, only find out
+                which objects would change.
+
+        Yields:
+            int: The number of objects handled so far, after each chunk.
+
+        """
+        self.changed.clear()
+        self.done = 0
+        self.seconds = 0.0
+        if not self.has_changes:
+            return
+        for istart in range(0, len(self.object_ids), self.chunk_size):
+            ids = self.object_ids[istart : istart + self.chunk_size]
+            t0 = time.perf_counter()
+            self._sync_chunk(ids, dry_run)
+            self.seconds += time.perf_counter() - t0
+            self.done += len(ids)
+            yield self.done
+
+    def report(self):
+        """
+        Report how the last run went.
+
+        Returns:
+            dict: With keys `prototype`, `objects`, `done`, `changed` (number of
+            objects changed), `parts` (`{part: number_of_objects}`, for `key`,
+            `typeclass`, `locks`, `attributes` and `tags`), `changes` (as from
+            `describe()`) and `seconds` (time spent on the chunks, not
+            counting the pauses between them).
+
+        """
+        changed = set().union(*self.changed.values())
+        return {
+            "prototype": self.prototype_key,
+            "objects": len(self.object_ids),
+            "done": self.done,
+            "changed": len(changed),
+            "parts": {part: len(ids) for part, ids in self.changed.items()},
+            "changes": self.describe(),
+            "seconds": self.seconds,
+        }
+
+
+def run_sync(sync, dry_run=False, progress=None):
+    """
+    Run a sync in the background, one chunk per reactor iteration.
+
+    Args:
+        sync (PrototypeSync): The sync to run.
+        dry_run (bool, optional): Only find out what would change.
+        progress (callable, optional): Called as `progress(sync)` after
+            every chunk.
+
+    Returns:
+        Deferred: Fires with the `report()` of the sync when done.
+
+    """
+
+    def _steps():
+        for _ in sync.run(dry_run=dry_run):
+            if progress:
+                progress(sync)
+            yield
+
+    def _done(_):
+        report = sync.report()
+        logger.log_info(
+            f"Prototype sync{' (dry run)' if dry_run else ''} of '{report['prototype']}': "
+            f"{report['changed']}/{report['objects']} objects changed "
+            f"in {report['seconds']:.2f}s."
+        )
+        return report
+
+    def _failed(failure):
+        logger.log_err(
+            f"Prototype sync of '{sync.prototype_key}' failed after {sync.done} objects: "
+            f"{failure.getTraceback()}"
+        )
+        return failure
+
+    return task.coiterate(_steps()).addCallbacks(_done, _failed)
+
+
+def sync_prototype(prototype_key, dry_run=False, reference=None, caller=None, progress=None):
+    """
+    Sync all objects spawned from a prototype in the background.
+
+    Args:
+        prototype_key (str): The prototype key.
+        dry_run (bool, optional): Only find out what would change.
+        reference (Object, optional): Object to compare the prototype with.
+        caller (Object or Account, optional): Passed on to protfuncs.
+        progress (callable, optional): Called as `progress(sync)` after
+            every chunk.
+
+    Returns:
+        Deferred: Fires with the `report()` of the sync when done.
+
+    Raises:
+        KeyError: If the prototype is not found.
+        RuntimeError: If the prototype is invalid.
+
+    """
+    sync = PrototypeSync(prototype_key, reference=reference, caller=caller)
+    return run_sync(sync, dry_run=dry_run, progress=progress)
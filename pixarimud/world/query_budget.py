@@ -0,0 +1,235 @@
+"""
+Query budgets
+
+Every Attribute read that misses the cache, and every Attribute write, is
+a database query, and they add up unnoticed: a command doing three more
+queries than it used to looks the same in-game until the server is busy.
+Here commands and hooks get a *budget*, a maximum number of queries per
+call, in `settings.QUERY_BUDGETS` (keyed by command key, like `"hit"`, or
+hook name, like `"Character.die"`). Transaction control (`SAVEPOINT`,
+`RELEASE SAVEPOINT` and the like, from `transaction.atomic`) is not
+counted, only statements reading or writing data.
+
+In tests, check a budget with `assert_query_budget()` (or any count with
+`query_budget()`); it fails listing every query made, with where in the
+game code it came from:
+
+    from world.query_budget import assert_query_budget
+
+    with assert_query_budget("hit"):
+        self.call(CmdHit(), "dummy")
+
+With `settings.QUERY_BUDGET_DEV_MODE` on, the running server counts the
+queries of every call of a budgeted command (through `QueryBudgetCommandMixin`,
+used by `commands.command.Command` and, through
+`settings.COMMAND_DEFAULT_CLASS`, all of Evennia's default commands like
+`look`) and of hooks decorated with `@budgeted()`, and logs a warning with
+the queries and their stack traces for each call over budget. Recording
+stacks is slow, so this is for development servers only; with it off, the
+checks cost one setting lookup per call.
+
+"""
+
+import functools
+import os
+import traceback
+from contextlib import contextmanager
+
+import django
+import twisted
+from django.conf import settings
+from django.db import connection
+
+import evennia
+from evennia.utils import logger
+
+# transaction control, like the savepoints of `transaction.atomic`, is
+# not counted as queries
+_TRANSACTION_STATEMENTS = ("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK", "BEGIN", "COMMIT")
+# frames from these are left out of the stacks shown
+_SKIP_FRAMES = tuple(
+    os.path.dirname(module.__file__) for module in (django, twisted, evennia)
+) + (__file__,)
+
+
+class QueryTracker:
+    """
+    A database execute wrapper that counts queries and, optionally, records
+    them with where they came from. Transaction control statements are
+    passed through uncounted.
+
+    """
+
+    def __init__(self, label, budget=None, record=True):
+        """
+        Args:
+            label (str): What is tracked, for messages.
+            budget (int, optional): Max queries.
+            record (bool, optional): Keep the sql and a stack for each query.
+
+        """
+        self.label = label
+        self.budget = budget
+        self.record = record
+        self.count = 0
+        # [(sql, [frame lines])]
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith(_TRANSACTION_STATEMENTS):
+            return execute(sql, params, many, context)
+        self.count += 1
+        if self.record:
+            frames = [
+                frame
+                for frame in traceback.extract_stack()[:-1]
+                if not frame.filename.startswith(_SKIP_FRAMES)
+            ]
+            depth = settings.QUERY_BUDGET_STACK_DEPTH
+            self.queries.append((sql, traceback.format_list(frames[-depth:])))
+        return execute(sql, params, many, context)
+
+    @property
+    def over_budget(self):
+        return self.budget is not None and self.count > self.budget
+
+    def report(self):
+        """
+        Describe the queries made.
+
+        Returns:
+            str: The count, budget and each query with its stack.
+
+        """
+        lines = [f"{self.label}: {self.count} queries (budget {self.budget})"]
+        for num, (sql, stack) in enumerate(self.queries, 1):
+            lines.append(f"  {num}. {sql}")
+            lines.extend(f"    {line.rstrip()}" for line in stack)
+        return "\n".join(lines)
+
+
+def get_budget(name):
+    """
+    Get the query budget of a command or hook.
+
+    Args:
+        name (str): A command key or hook name.
+
+    Returns:
+        int or None: The budget, or `None` if it has none.
+
+    """
+    return settings.QUERY_BUDGETS.get(name)
+
+
+@contextmanager
+def query_budget(max_queries, label="block"):
+    """
+    Fail if the block makes more than `max_queries` database queries.
+
+    Args:
+        max_queries (int): The budget.
+        label (str, optional): What is checked, for the message.
+
+    Yields:
+        QueryTracker: Holds the `count` once done.
+
+    Raises:
+        AssertionError: If over budget, listing the queries.
+
+    """
+    tracker = QueryTracker(label, max_queries)
+    with connection.execute_wrapper(tracker):
+        yield tracker
+    if tracker.over_budget:
+        raise AssertionError(tracker.report())
+
+
+def assert_query_budget(name):
+    """
+    Fail if the block makes more queries than the budget of a command or
+    hook in `settings.QUERY_BUDGETS`.
+
+    Args:
+        name (str): A command key or hook name.
+
+    """
+    budget = get_budget(name)
+    if budget is None:
+        raise KeyError(f"No query budget for '{name}' in settings.QUERY_BUDGETS.")
+    return query_budget(budget, label=name)
+
+
+def _log_over_budget(tracker):
+    logger.log_warn(f"Over query budget - {tracker.report()}")
+
+
+class _CommandTracker(QueryTracker):
+    pass
+
+
+def _start(label, budget, tracker_class=QueryTracker):
+    tracker = tracker_class(label, budget)
+    connection.execute_wrappers.append(tracker)
+    return tracker
+
+
+def _stop(tracker):
+    try:
+        connection.execute_wrappers.remove(tracker)
+    except ValueError:
+        return
+    if tracker.over_budget:
+        _log_over_budget(tracker)
+
+
+class QueryBudgetCommandMixin:
+    """
+    Counts the queries of each call of a command with a budget, in dev mode.
+
+    """
+
+    def at_pre_cmd(self):
+        if settings.QUERY_BUDGET_DEV_MODE:
+            # one left by a command that raised before at_post_cmd
+            for wrapper in list(connection.execute_wrappers):
+                if isinstance(wrapper, _CommandTracker):
+                    connection.execute_wrappers.remove(wrapper)
+            budget = get_budget(self.key)
+            if budget is not None:
+                self._query_tracker = _start(f"command '{self.key}'", budget, _CommandTracker)
+        return super().at_pre_cmd()
+
+    def at_post_cmd(self):
+        ret = super().at_post_cmd()
+        tracker = self.__dict__.pop("_query_tracker", None)
+        if tracker:
+            _stop(tracker)
+        return ret
+
+
+def budgeted(name):
+    """
+    Decorator counting the queries of each call of a hook with a budget, in
+    dev mode.
+
+    Args:
+        name (str): The hook's name in `settings.QUERY_BUDGETS`, like
+            `"Character.die"`.
+
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not settings.QUERY_BUDGET_DEV_MODE or get_budget(name) is None:
+                return func(*args, **kwargs)
+            tracker = _start(name, get_budget(name))
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _stop(tracker)
+
+        return wrapper
+
+    return decorator
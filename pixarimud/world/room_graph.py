@@ -0,0 +1,403 @@
+"""
+Room graph
+
+The rooms and exits of the world as an in-memory graph, for finding routes
+without walking exits through the database. It holds just ids:
+`{room_id: {exit_id: destination_id}}` and the same reversed.
+
+- The graph is built with one query the first time it is used, and after
+  that kept up to date from the `post_save`/`post_delete` signals of
+  objects as exits are created, deleted, moved or get a new destination.
+  Bulk operations that bypass the signals (`world/bulk_create.py`,
+  `world/world_import.py`, `world/snapshot.py`) call `invalidate()` to
+  have it rebuilt.
+- Rooms tagged `hub` (category `room_graph`), like a town square or the
+  arena, are *hubs*: the shortest routes from and to every other room are
+  computed once per graph change and kept, so any route starting or ending
+  at a hub is a lookup. Tag changes are picked up at the next graph change
+  or `invalidate()`.
+- Other routes are found with A*. The hub distances give it a lower bound
+  on the distance left (by the triangle inequality), which keeps the search
+  close to the route; with no hubs it is a plain breadth-first search.
+  Recent results are cached until the graph changes.
+
+Routes are lists of `(exit_id, room_id)` steps. `ObjectParent.walk_to` (and
+the `travel` command) walk them one exit at a time; NPCs can use
+`next_exit()` to take one step at a time instead:
+
+    from world import room_graph
+
+    route = room_graph.find_path(char.location, arena)
+
+"""
+
+import heapq
+from collections import deque
+
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+
+from evennia.objects.models import ObjectDB
+
+HUB_TAG = "hub"
+HUB_CATEGORY = "room_graph"
+# routes kept per graph version, other than those from/to hubs
+_PATH_CACHE_SIZE = 2000
+
+
+def _bfs(start, adjacency):
+    """
+    Breadth-first search over one direction of the graph.
+
+    Returns:
+        tuple: `(distances, links)`, with `distances` `{room_id: steps}` and
+        `links` `{room_id: (exit_id, previous_room_id)}`, both including
+        `start`.
+
+    """
+    distances = {start: 0}
+    links = {start: (None, None)}
+    queue = deque([start])
+    while queue:
+        room = queue.popleft()
+        steps = distances[room] + 1
+        for exit_id, other in adjacency.get(room, {}).items():
+            if other not in distances:
+                distances[other] = steps
+                links[other] = (exit_id, room)
+                queue.append(other)
+    return distances, links
+
+
+class RoomGraph:
+    """
+    The exits of the world, as an adjacency graph of room ids.
+
+    """
+
+    def __init__(self):
+        self.built = False
+        # {exit_id: (room_id, destination_id)}
+        self.exits = {}
+        # {room_id: {exit_id: destination_id}}
+        self.adjacency = {}
+        # {destination_id: {exit_id: room_id}}
+        self.reverse = {}
+        self.version = 0
+        # {hub_id: ((distances, links) from hub, (distances, links) to hub)}
+        self._hubs = None
+        # {(start, goal): route}
+        self._paths = {}
+        self.queries = 0
+        self.hub_hits = 0
+        self.cache_hits = 0
+
+    def build(self):
+        """
+        (Re)build the graph from all exits in the database.
+
+        """
+        self.exits.clear()
+        self.adjacency.clear()
+        self.reverse.clear()
+        rows = ObjectDB.objects.filter(
+            db_location__isnull=False, db_destination__isnull=False
+        ).values_list("id", "db_location_id", "db_destination_id")
+        for exit_id, room_id, destination_id in rows.iterator():
+            self._link(exit_id, room_id, destination_id)
+        self.built = True
+        self._changed()
+
+    def invalidate(self):
+        """
+        Have the graph rebuilt when next used.
+
+        """
+        self.built = False
+        self._changed()
+
+    def _ensure_built(self):
+        if not self.built:
+            self.build()
+
+    def _changed(self):
+        self.version += 1
+        self._hubs = None
+        self._paths.clear()
+
+    def _link(self, exit_id, room_id, destination_id):
+        self.exits[exit_id] = (room_id, destination_id)
+        self.adjacency.setdefault(room_id, {})[exit_id] = destination_id
+        self.reverse.setdefault(destination_id, {})[exit_id] = room_id
+
+    def _unlink(self, exit_id):
+        room_id, destination_id = self.exits.pop(exit_id)
+        for index, room in ((self.adjacency, room_id), (self.reverse, destination_id)):
+            links = index[room]
+            del links[exit_id]
+            if not links:
+                del index[room]
+
+    def update_exit(self, exit_id, room_id, destination_id):
+        """
+        Update one exit.
+
+        Args:
+            exit_id (int): The object's id.
+            room_id (int or None): Where it is.
+            destination_id (int or None): Where it leads. If this or
+                `room_id` is `None`, the object is not (or no longer) an exit.
+
+        """
+        if not self.built:
+            # it is read as it is when the graph is built
+            return
+        new = (room_id, destination_id) if room_id and destination_id else None
+        if self.exits.get(exit_id) == new:
+            return
+        if exit_id in self.exits:
+            self._unlink(exit_id)
+        if new:
+            self._link(exit_id, *new)
+        self._changed()
+
+    def _hub_routes(self):
+        if self._hubs is None:
+            hub_ids = ObjectDB.objects.get_by_tag(key=HUB_TAG, category=HUB_CATEGORY).values_list(
+                "id", flat=True
+            )
+            self._hubs = {
+                hub_id: (_bfs(hub_id, self.adjacency), _bfs(hub_id, self.reverse))
+                for hub_id in hub_ids
+            }
+        return self._hubs
+
+    def find_path(self, start, goal):
+        """
+        Find a shortest route between two rooms.
+
+        Args:
+            start (int): Room id to start from.
+            goal (int): Room id to get to.
+
+        Returns:
+            tuple or None: `(exit_id, room_id)` steps, empty if `start` is
+            `goal`, or `None` if there is no way.
+
+        """
+        self._ensure_built()
+        self.queries += 1
+        if start == goal:
+            return ()
+        hubs = self._hub_routes()
+        if start in hubs:
+            self.hub_hits += 1
+            _, links = hubs[start][0]
+            if goal not in links:
+                return None
+            steps = []
+            room = goal
+            while room != start:
+                exit_id, previous = links[room]
+                steps.append((exit_id, room))
+                room = previous
+            return tuple(reversed(steps))
+        if goal in hubs:
+            self.hub_hits += 1
+            _, links = hubs[goal][1]
+            if start not in links:
+                return None
+            steps = []
+            room = start
+            while room != goal:
+                exit_id, room = links[room]
+                steps.append((exit_id, room))
+            return tuple(steps)
+
+        key = (start, goal)
+        if key in self._paths:
+            self.cache_hits += 1
+            return self._paths[key]
+        path = self._astar(start, goal, hubs)
+        if len(self._paths) >= _PATH_CACHE_SIZE:
+            self._paths.clear()
+        self._paths[key] = path
+        return path
+
+    def _astar(self, start, goal, hubs):
+        if start not in self.adjacency or goal not in self.reverse:
+            return None
+        # each hub H gives d(n, goal) >= d(H, goal) - d(H, n) and
+        # d(n, goal) >= d(n, H) - d(goal, H)
+        bounds = []
+        for (from_hub, _), (to_hub, _) in hubs.values():
+            bounds.append((from_hub, from_hub.get(goal), to_hub, to_hub.get(goal)))
+
+        def estimate(room):
+            best = 0
+            for from_hub, hub_to_goal, to_hub, goal_to_hub in bounds:
+                if hub_to_goal is not None and room in from_hub:
+                    best = max(best, hub_to_goal - from_hub[room])
+                if goal_to_hub is not None and room in to_hub:
+                    best = max(best, to_hub[room] - goal_to_hub)
+            return best
+
+        costs = {start: 0}
+        links = {}
+        # on equal estimates, go on with the room furthest along
+        heap = [(estimate(start), 0, start)]
+        while heap:
+            _, cost, room = heapq.heappop(heap)
+            cost = -cost
+            if room == goal:
+                steps = []
+                while room != start:
+                    exit_id, previous = links[room]
+                    steps.append((exit_id, room))
+                    room = previous
+                return tuple(reversed(steps))
+            if cost > costs[room]:
+                continue
+            cost += 1
+            for exit_id, other in self.adjacency.get(room, {}).items():
+                if cost < costs.get(other, cost + 1):
+                    costs[other] = cost
+                    links[other] = (exit_id, room)
+                    heapq.heappush(heap, (cost + estimate(other), -cost, other))
+        return None
+
+    def stats(self):
+        """
+        Get graph stats.
+
+        Returns:
+            dict: With keys `rooms` (with exits), `exits`, `hubs`, `version`,
+            `queries`, `hub_hits` and `cache_hits`.
+
+        """
+        return {
+            "rooms": len(self.adjacency.keys() | self.reverse.keys()),
+            "exits": len(self.exits),
+            "hubs": len(self._hubs or ()),
+            "version": self.version,
+            "queries": self.queries,
+            "hub_hits": self.hub_hits,
+            "cache_hits": self.cache_hits,
+        }
+
+
+ROOM_GRAPH = RoomGraph()
+
+
+def _after_commit(func, *args):
+    """
+    Call now, or when the current transaction commits (a rolled-back exit
+    never existed).
+
+    """
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: func(*args))
+    else:
+        func(*args)
+
+
+def _at_object_saved(sender, instance, **kwargs):
+    if not isinstance(instance, ObjectDB):
+        return
+    if instance.db_destination_id or instance.id in ROOM_GRAPH.exits:
+        _after_commit(
+            ROOM_GRAPH.update_exit,
+            instance.id,
+            instance.db_location_id,
+            instance.db_destination_id,
+        )
+
+
+def _at_object_deleted(sender, instance, **kwargs):
+    if isinstance(instance, ObjectDB) and instance.id in ROOM_GRAPH.exits:
+        _after_commit(ROOM_GRAPH.update_exit, instance.id, None, None)
+
+
+def install():
+    """
+    Keep the graph up to date as exits change. Called at server start.
+
+    """
+    # objects are saved as their typeclass, so listen to all senders
+    post_save.connect(_at_object_saved, dispatch_uid="pixarimud_room_graph")
+    post_delete.connect(_at_object_deleted, dispatch_uid="pixarimud_room_graph")
+
+
+def _id(obj):
+    return obj if obj is None or isinstance(obj, int) else obj.id
+
+
+def find_path(start, goal):
+    """
+    Find a shortest route between two rooms.
+
+    Args:
+        start (Room or int): The room (or its id) to start from.
+        goal (Room or int): The room (or its id) to get to.
+
+    Returns:
+        tuple or None: `(exit_id, room_id)` steps, empty if already there,
+        or `None` if there is no way.
+
+    """
+    start, goal = _id(start), _id(goal)
+    if start is None or goal is None:
+        return None
+    return ROOM_GRAPH.find_path(start, goal)
+
+
+def get_exit(exit_id):
+    """
+    Get an exit of a route.
+
+    Args:
+        exit_id (int): The exit's id.
+
+    Returns:
+        Exit or None: The exit, if it still exists.
+
+    """
+    exit_obj = ObjectDB.get_cached_instance(exit_id)
+    if exit_obj is None:
+        exit_obj = ObjectDB.objects.filter(id=exit_id).first()
+    return exit_obj
+
+
+def next_exit(obj, goal):
+    """
+    Get the exit to take for the first step towards a room, like for an
+    NPC walking somewhere.
+
+    Args:
+        obj (Object): The one walking.
+        goal (Room or int): The room (or its id) to get to.
+
+    Returns:
+        Exit or None: The exit, or `None` if already there or there is no
+        way.
+
+    """
+    route = find_path(obj.location, goal)
+    return get_exit(route[0][0]) if route else None
+
+
+def invalidate():
+    """
+    Have the graph rebuilt when next used, after exits were changed without
+    saving them one by one. Inside a transaction, this waits for the commit.
+
+    """
+    _after_commit(ROOM_GRAPH.invalidate)
+
+
+def stats():
+    """
+    Get the graph stats. See `RoomGraph.stats`.
+
+    """
+    return ROOM_GRAPH.stats()
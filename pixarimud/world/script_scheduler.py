@@ -0,0 +1,315 @@
+"""
+Script scheduler
+
+Evennia gives every timed Script its own `LoopingCall`, so a thousand mob
+AI scripts on a 5 second interval are a thousand reactor timers, each
+firing on its own. Here scripts with the same interval share timers
+instead:
+
+- The timers for an interval are its *phases*: `settings.SCRIPT_PHASES`
+  timers, evenly spread over the interval. A phase timer keeps the ids of
+  its scripts in a compact array and steps them all on each tick.
+- A script joins the phase that first ticks when it is due, so it fires
+  at most one phase step (interval / SCRIPT_PHASES) late. Script classes
+  with `spread_phase = True` join the phase with the fewest scripts
+  instead, so scripts started together (like a zone of spawned mobs) fire
+  spread out over the interval rather than all on the same tick. Their
+  first repeat can then come up to one interval late.
+- Each phase timer records how long its ticks take, how many took longer
+  than the interval (overruns) and how many ticks were missed because the
+  reactor was busy. See `stats()` (or `scriptstats` in-game).
+
+`typeclasses.scripts.Script` uses this for all its timed scripts, unless a
+script class sets `shared_timer = False`. The script's `ndb._task` is then
+a `SharedTask` instead of Evennia's `ExtendedLoopingCall`, with the same
+interface, so pausing, unpausing, `time_until_next_repeat()` etc work as
+usual.
+
+"""
+
+import math
+import time
+from array import array
+
+from django.conf import settings
+from twisted.internet import reactor, task
+
+from evennia.scripts.models import ScriptDB
+from evennia.utils import logger
+
+
+class SharedTask:
+    """
+    Stands in for Evennia's `ExtendedLoopingCall` as a script's timer task,
+    but is ticked by the scheduler.
+
+    """
+
+    def __init__(self, script, spread_phase=False):
+        """
+        Args:
+            script (Script): The script to step.
+            spread_phase (bool, optional): Join the least busy phase instead
+                of the first one due.
+
+        """
+        self.script_id = script.id
+        self.step = script._step_task
+        self.spread_phase = spread_phase
+        self.running = False
+        self.interval = 0
+        self.callcount = 0
+        self.start_delay = None
+        self.phase = None
+        # when the first step on the phase is due (reactor seconds)
+        self.due = 0.0
+
+    def start(self, interval, now=True, start_delay=None, count_start=0):
+        """
+        Start stepping the script every `interval` seconds. Same arguments
+        as `ExtendedLoopingCall.start`.
+
+        """
+        assert not self.running, "Tried to start an already running SharedTask."
+        if interval < 0:
+            raise ValueError("interval must be >= 0")
+        self.running = True
+        self.interval = interval
+        self.callcount = max(0, count_start)
+        self.start_delay = start_delay if start_delay is None else max(0, start_delay)
+        if now:
+            self()
+            delay = interval
+        else:
+            delay = interval if self.start_delay is None else self.start_delay
+        if self.running and interval > 0:
+            # the step may have stopped the script
+            SCHEDULER.add(self, reactor.seconds() + delay)
+
+    def stop(self):
+        """
+        Stop stepping the script.
+
+        """
+        assert self.running, "Tried to stop a SharedTask that was not running."
+        self.running = False
+        if self.phase:
+            self.phase.remove(self.script_id)
+            self.phase = None
+
+    def __call__(self):
+        self.callcount += 1
+        self.start_delay = None
+        self.due = 0.0
+        self.step()
+
+    def force_repeat(self):
+        """
+        Step the script now. The next step stays on its phase's tick.
+
+        """
+        assert self.running, "Tried to fire a SharedTask that was not running."
+        self()
+
+    def next_call_time(self):
+        """
+        Get the seconds until the next step, or `None` if not running.
+
+        """
+        if self.running and self.phase:
+            now = reactor.seconds()
+            return max(0, self.phase.next_tick(after=max(now, self.due)) - now)
+        return None
+
+
+class Phase:
+    """
+    One shared timer: all scripts of an interval at one phase offset.
+
+    """
+
+    def __init__(self, interval, origin):
+        """
+        Args:
+            interval (int): Seconds between ticks.
+            origin (float): A time (reactor seconds) the phase ticks at.
+
+        """
+        self.interval = interval
+        self.origin = origin
+        self.ids = array("q")
+        # {script_id: index in ids}
+        self.positions = {}
+        self.loop = None
+        self.start_call = None
+        self.ticks = 0
+        self.tick_time = 0.0
+        self.max_tick_time = 0.0
+        self.overruns = 0
+        self.missed = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def next_tick(self, after=None):
+        """
+        Get the time of the first tick at or after a time (default now).
+
+        """
+        after = reactor.seconds() if after is None else after
+        return self.origin + math.ceil((after - self.origin) / self.interval) * self.interval
+
+    def add(self, script_id):
+        if script_id in self.positions:
+            return
+        self.positions[script_id] = len(self.ids)
+        self.ids.append(script_id)
+        if not self.loop and not self.start_call:
+            # the loop keeps to multiples of the interval from when it starts
+            delay = self.next_tick() - reactor.seconds()
+            self.start_call = reactor.callLater(delay, self._start_loop)
+
+    def _start_loop(self):
+        self.start_call = None
+        # in case the start call came late
+        self.origin = reactor.seconds()
+        self.loop = task.LoopingCall.withCount(self._tick)
+        self.loop.start(self.interval, now=True)
+
+    def remove(self, script_id):
+        pos = self.positions.pop(script_id, None)
+        if pos is None:
+            return
+        # move the last id into the hole
+        last = self.ids.pop()
+        if pos < len(self.ids):
+            self.ids[pos] = last
+            self.positions[last] = pos
+        if not self.ids:
+            self._stop_loop()
+
+    def _stop_loop(self):
+        if self.start_call and self.start_call.active():
+            self.start_call.cancel()
+        self.start_call = None
+        loop, self.loop = self.loop, None
+        if loop and loop.running:
+            loop.stop()
+
+    def _tick(self, count):
+        t0 = time.perf_counter()
+        if count > 1:
+            self.missed += count - 1
+        # a little slack for float rounding
+        now = reactor.seconds() + 1e-6
+        get_script = ScriptDB.get_cached_instance
+        for script_id in self.ids.tolist():
+            script = get_script(script_id)
+            shared_task = script.ndb._task if script else None
+            if not (shared_task and shared_task.phase is self):
+                # gone from the cache or restarted without us noticing
+                self.remove(script_id)
+                continue
+            if shared_task.due > now:
+                # joined since the last tick; not due yet
+                continue
+            try:
+                shared_task()
+            except Exception:
+                logger.log_trace(f"Error stepping script #{script_id}.")
+        seconds = time.perf_counter() - t0
+        self.ticks += 1
+        self.tick_time += seconds
+        self.max_tick_time = max(self.max_tick_time, seconds)
+        if seconds > self.interval:
+            self.overruns += 1
+
+
+class ScriptScheduler:
+    """
+    Shared timers for timed scripts, per interval and phase.
+
+    """
+
+    def __init__(self, phases=10):
+        """
+        Args:
+            phases (int, optional): Timers per interval.
+
+        """
+        self.nphases = max(1, phases)
+        # {interval: [Phase or None, ...]}
+        self.phases = {}
+        # {interval: time the first phase ticks at}
+        self.origins = {}
+
+    def _get_phase(self, interval, num):
+        phases = self.phases.setdefault(interval, [None] * self.nphases)
+        if phases[num] is None:
+            origin = self.origins.setdefault(interval, reactor.seconds())
+            phases[num] = Phase(interval, origin + num * interval / self.nphases)
+        return phases[num]
+
+    def add(self, shared_task, due):
+        """
+        Put a task on the phase of its interval it should tick on.
+
+        Args:
+            shared_task (SharedTask): The task.
+            due (float): When it is next due (reactor seconds).
+
+        """
+        interval = shared_task.interval
+        if shared_task.spread_phase:
+            phases = self.phases.get(interval) or [None] * self.nphases
+            num = min(range(self.nphases), key=lambda n: len(phases[n] or ()))
+        else:
+            origin = self.origins.setdefault(interval, reactor.seconds())
+            step = interval / self.nphases
+            # the first phase ticking at or after `due`; round off float noise
+            num = math.ceil(round(((due - origin) % interval) / step, 6)) % self.nphases
+        phase = self._get_phase(interval, num)
+        phase.add(shared_task.script_id)
+        shared_task.phase = phase
+        shared_task.due = due
+
+    def stats(self):
+        """
+        Get stats per phase timer.
+
+        Returns:
+            list: A dict per phase with scripts, with keys `interval`,
+            `offset` (seconds into the interval), `scripts`, `ticks`,
+            `mean` and `max` (seconds per tick), `overruns` (ticks longer
+            than the interval) and `missed` (ticks skipped).
+
+        """
+        rows = []
+        for interval, phases in sorted(self.phases.items()):
+            for num, phase in enumerate(phases):
+                if not phase or not len(phase):
+                    continue
+                rows.append(
+                    {
+                        "interval": interval,
+                        "offset": num * interval / self.nphases,
+                        "scripts": len(phase),
+                        "ticks": phase.ticks,
+                        "mean": phase.tick_time / phase.ticks if phase.ticks else 0.0,
+                        "max": phase.max_tick_time,
+                        "overruns": phase.overruns,
+                        "missed": phase.missed,
+                    }
+                )
+        return rows
+
+
+SCHEDULER = ScriptScheduler(phases=settings.SCRIPT_PHASES)
+
+
+def stats():
+    """
+    Get the scheduler stats. See `ScriptScheduler.stats`.
+
+    """
+    return SCHEDULER.stats()
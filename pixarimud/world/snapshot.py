@@ -0,0 +1,631 @@
+"""
+World snapshots
+
+Resetting a test or staging server to a known world used to mean replaying
+`world/demo_setup.ev` or copying the whole database file. A snapshot is a
+compact binary dump of one zone, or of the whole world:
+
+- the objects (rooms, exits and things) with their ids, creation dates,
+  keys, typeclasses, locks, locations, homes and destinations
+- their Attributes, Tags, aliases and permissions
+- the Scripts on them, with their own Attributes and Tags
+
+A zone is all rooms with a given tag, everything inside them (recursively)
+and the exits leading out of them. Characters (`BASE_CHARACTER_TYPECLASS`
+and its children, puppeted or not, and anything else an account controls),
+and whatever they carry, are never part of a snapshot and are left alone by
+a restore, also when an old snapshot still has them or their belongings.
+
+    from world import snapshot
+
+    snapshot.export_snapshot(path, tag="arena", category="zone")
+    snapshot.restore_snapshot(path)
+
+In-game, use `snapshot/export` and `snapshot/restore`.
+
+A snapshot is a gzip stream of frames, each a kind byte, a 4-byte length
+and a pickled list of rows. Rows are the values of the database fields named
+in the header frame, so a snapshot can still be read after fields were added
+to or removed from the models. Objects are written and read a chunk at a
+time, so neither export nor restore hold the whole world in memory.
+
+A restore runs in one transaction. The objects now in the snapshot's zone
+(or world) and any other objects with the snapshot's ids are deleted, then
+everything is bulk-inserted with the original ids and creation dates, so
+`#dbrefs` and Attributes referring to restored objects stay valid. Creation
+hooks are not run; the snapshot already holds what they wrote. References
+to objects that no longer exist are cleared, objects outside the snapshot
+that were in or pointing to deleted objects (like a character standing in a
+zone room) are pointed at the restored ones again, and the restored Scripts
+are started once the transaction is committed.
+
+Snapshot files are pickles: only restore snapshots you made yourself.
+
+"""
+
+import gzip
+import os
+import pickle
+import struct
+import time
+import zlib
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+
+from evennia.objects.models import ObjectDB
+from evennia.scripts.models import ScriptDB
+from evennia.typeclasses.attributes import Attribute
+from evennia.utils import logger
+from evennia.utils.utils import class_from_module
+
+from world import bulk_create, room_graph
+
+FORMAT = "pixarimud-snapshot"
+VERSION = 1
+# objects per frame
+CHUNK_SIZE = 2000
+
+_HEADER = b"H"
+_OBJECTS = b"O"
+_SCRIPTS = b"S"
+_ATTRIBUTES = b"A"
+_TAGS = b"T"
+_END = b"E"
+_FRAME = struct.Struct(">cI")
+
+# owner kinds of Attribute and Tag rows
+_OBJECT = "o"
+_SCRIPT = "s"
+
+_REF_FIELDS = ("db_location_id", "db_home_id", "db_destination_id")
+_TAG_FIELDS = ("db_key", "db_category", "db_tagtype", "db_data")
+
+_AttributeLinks = {_OBJECT: ObjectDB.db_attributes.through, _SCRIPT: ScriptDB.db_attributes.through}
+_TagLinks = {_OBJECT: ObjectDB.db_tags.through, _SCRIPT: ScriptDB.db_tags.through}
+_OWNER_FIELDS = {_OBJECT: "objectdb_id", _SCRIPT: "scriptdb_id"}
+
+
+class SnapshotError(RuntimeError):
+    """
+    The snapshot could not be read or restored.
+
+    """
+
+    pass
+
+
+def _fields(model, exclude=()):
+    return [
+        field.attname for field in model._meta.concrete_fields if field.attname not in exclude
+    ]
+
+
+def _chunks(ids, size=bulk_create.BATCH_SIZE):
+    ids = list(ids)
+    for istart in range(0, len(ids), size):
+        yield ids[istart : istart + size]
+
+
+def _with_contents(ids, exclude=()):
+    """
+    Get objects and everything inside them, recursively.
+
+    Args:
+        ids (list): Object ids to start from.
+        exclude (set, optional): Ids to leave out, with their contents.
+
+    Returns:
+        list: Object ids, those given first.
+
+    """
+    frontier = [obj_id for obj_id in ids if obj_id not in exclude]
+    ids = list(frontier)
+    seen = set(ids) | set(exclude)
+    while frontier:
+        contents = []
+        for batch in _chunks(frontier):
+            contents.extend(
+                ObjectDB.objects.filter(db_location_id__in=batch).values_list("id", flat=True)
+            )
+        frontier = [obj_id for obj_id in contents if obj_id not in seen]
+        seen.update(frontier)
+        ids.extend(frontier)
+    return ids
+
+
+def get_character_ids():
+    """
+    Get the ids of all characters, whether anyone is playing them or not,
+    of other objects controlled by an account, and of everything they carry.
+
+    Returns:
+        set: Object ids.
+
+    """
+    typeclass = class_from_module(settings.BASE_CHARACTER_TYPECLASS)
+    characters = set(typeclass.objects.all_family().values_list("id", flat=True))
+    characters.update(
+        ObjectDB.objects.filter(db_account__isnull=False).values_list("id", flat=True)
+    )
+    return set(_with_contents(characters))
+
+
+def get_scope_ids(tag=None, category=None, characters=None):
+    """
+    Get the ids of the objects in a zone, or in the whole world, leaving
+    out characters and what they carry.
+
+    Args:
+        tag (str, optional): The tag of the zone's rooms. If not given, the
+            whole world is used.
+        category (str, optional): The tag's category.
+        characters (set, optional): The result of `get_character_ids()`, if
+            already known.
+
+    Returns:
+        list: Object ids.
+
+    """
+    if characters is None:
+        characters = get_character_ids()
+    if not tag:
+        return [
+            obj_id
+            for obj_id in ObjectDB.objects.order_by("id").values_list("id", flat=True)
+            if obj_id not in characters
+        ]
+    rooms = ObjectDB.objects.get_by_tag(key=tag, category=category)
+    return _with_contents(rooms.values_list("id", flat=True), exclude=characters)
+
+
+class _Writer:
+    """
+    Writes frames to a snapshot file.
+
+    """
+
+    def __init__(self, fil):
+        self.fil = fil
+
+    def write(self, kind, rows):
+        payload = pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL)
+        self.fil.write(_FRAME.pack(kind, len(payload)))
+        self.fil.write(payload)
+
+
+def _read_frames(fil):
+    """
+    Read the frames of a snapshot file.
+
+    Yields:
+        tuple: `(kind, rows)`.
+
+    """
+    while True:
+        head = fil.read(_FRAME.size)
+        if not head:
+            return
+        if len(head) < _FRAME.size:
+            raise SnapshotError("The snapshot is truncated.")
+        kind, length = _FRAME.unpack(head)
+        payload = fil.read(length)
+        if len(payload) < length:
+            raise SnapshotError("The snapshot is truncated.")
+        yield kind, pickle.loads(payload)
+
+
+def _export_attached(writer, kind, owner_ids, attribute_fields):
+    """
+    Write the Attributes and Tags of a chunk of objects or scripts.
+
+    Returns:
+        tuple: `(number of Attributes, number of Tags)`.
+
+    """
+    owner_field = _OWNER_FIELDS[kind]
+    attributes = list(
+        _AttributeLinks[kind]
+        .objects.filter(**{f"{owner_field}__in": owner_ids})
+        .values_list(owner_field, *(f"attribute__{field}" for field in attribute_fields))
+    )
+    if attributes:
+        writer.write(_ATTRIBUTES, [(kind, *row) for row in attributes])
+    tags = list(
+        _TagLinks[kind]
+        .objects.filter(**{f"{owner_field}__in": owner_ids})
+        .values_list(owner_field, *(f"tag__{field}" for field in _TAG_FIELDS))
+    )
+    if tags:
+        writer.write(_TAGS, [(kind, *row) for row in tags])
+    return len(attributes), len(tags)
+
+
+def export_snapshot(path, tag=None, category=None):
+    """
+    Write a snapshot of a zone, or of the whole world.
+
+    Args:
+        path (str): The file to write.
+        tag (str, optional): The tag of the zone's rooms. If not given, the
+            whole world is exported.
+        category (str, optional): The tag's category.
+
+    Returns:
+        dict: Report with keys `objects`, `scripts`, `attributes`, `tags`,
+        `bytes` and `seconds`.
+
+    """
+    t0 = time.perf_counter()
+    object_fields = _fields(ObjectDB)
+    script_fields = _fields(ScriptDB)
+    attribute_fields = _fields(Attribute, exclude=("id",))
+    counts = {"objects": 0, "scripts": 0, "attributes": 0, "tags": 0}
+
+    # read everything in one transaction, for a consistent snapshot
+    with transaction.atomic(), gzip.open(path, "wb", compresslevel=6) as fil:
+        writer = _Writer(fil)
+        writer.write(
+            _HEADER,
+            {
+                "format": FORMAT,
+                "version": VERSION,
+                "scope": (tag, category) if tag else None,
+                "created": time.time(),
+                "fields": {
+                    _OBJECTS: object_fields,
+                    _SCRIPTS: script_fields,
+                    _ATTRIBUTES: attribute_fields,
+                },
+            },
+        )
+        scope_ids = get_scope_ids(tag, category)
+        for chunk in _chunks(scope_ids, CHUNK_SIZE):
+            rows = []
+            for batch in _chunks(chunk):
+                rows.extend(ObjectDB.objects.filter(id__in=batch).values_list(*object_fields))
+            writer.write(_OBJECTS, rows)
+            counts["objects"] += len(rows)
+            for batch in _chunks(chunk):
+                num_attributes, num_tags = _export_attached(
+                    writer, _OBJECT, batch, attribute_fields
+                )
+                counts["attributes"] += num_attributes
+                counts["tags"] += num_tags
+
+                scripts = list(
+                    ScriptDB.objects.filter(db_obj_id__in=batch, db_account__isnull=True)
+                    .values_list(*script_fields)
+                )
+                if scripts:
+                    writer.write(_SCRIPTS, scripts)
+                    counts["scripts"] += len(scripts)
+                    num_attributes, num_tags = _export_attached(
+                        writer, _SCRIPT, [row[0] for row in scripts], attribute_fields
+                    )
+                    counts["attributes"] += num_attributes
+                    counts["tags"] += num_tags
+        writer.write(_END, counts)
+
+    report = {**counts, "bytes": os.path.getsize(path), "seconds": time.perf_counter() - t0}
+    logger.log_info(
+        f"Snapshot {path}: {counts['objects']} objects, {counts['scripts']} scripts "
+        f"exported in {report['seconds']:.2f}s."
+    )
+    return report
+
+
+def _flush_cached(model, ids):
+    for instance_id in ids:
+        cached = model.get_cached_instance(instance_id)
+        if cached is not None:
+            model.flush_cached_instance(cached, force=True)
+
+
+class _Restore:
+    """
+    The state of one restore.
+
+    """
+
+    def __init__(self, header, characters):
+        self.fields = header["fields"]
+        self.scope = header["scope"]
+        # never deleted or restored, only relinked
+        self.characters = characters
+        # ids of skipped scripts, on characters
+        self.skipped_script_ids = set()
+        self.object_fields = set(_fields(ObjectDB))
+        self.script_fields = set(_fields(ScriptDB))
+        self.attribute_fields = set(_fields(Attribute, exclude=("id",)))
+        # ids deleted so far, and the ids restored
+        self.deleted = set()
+        self.object_ids = set()
+        self.script_ids = set()
+        self.active_script_ids = []
+        # {obj_id: {ref_field: target_id}} for objects outside the snapshot
+        # pointing to deleted objects
+        self.outside_refs = {}
+        # {target_id: [(obj_id, ref_field), ...]} for references from
+        # restored objects to objects outside the snapshot
+        self.refs_out = {}
+        self.counts = {"objects": 0, "scripts": 0, "attributes": 0, "tags": 0, "deleted": 0}
+
+    def _rows(self, kind, rows, known_fields):
+        return [
+            {field: value for field, value in zip(self.fields[kind], row) if field in known_fields}
+            for row in rows
+        ]
+
+    def delete(self, ids):
+        """
+        Delete objects, with their Scripts and Attributes, remembering which
+        other objects pointed to them.
+
+        """
+        ids = [obj_id for obj_id in ids if obj_id not in self.deleted]
+        if not ids:
+            return
+        self.deleted.update(ids)
+        for batch in _chunks(ids):
+            for field in _REF_FIELDS:
+                for obj_id, target_id in ObjectDB.objects.filter(
+                    **{f"{field}__in": batch}
+                ).values_list("id", field):
+                    if obj_id not in self.deleted:
+                        self.outside_refs.setdefault(obj_id, {})[field] = target_id
+
+            script_ids = list(
+                ScriptDB.objects.filter(db_obj_id__in=batch).values_list("id", flat=True)
+            )
+            self._delete_attributes(_SCRIPT, script_ids)
+            for script in ScriptDB.objects.filter(id__in=script_ids):
+                # stops any timers
+                script.delete()
+            self._delete_attributes(_OBJECT, batch)
+            # counted by typeclass, so add up the ObjectDB proxies
+            _, deleted = ObjectDB.objects.filter(id__in=batch).delete()
+            self.counts["deleted"] += sum(
+                count
+                for label, count in deleted.items()
+                if issubclass(apps.get_model(label), ObjectDB)
+            )
+
+    def _delete_attributes(self, kind, owner_ids):
+        owner_field = _OWNER_FIELDS[kind]
+        for batch in _chunks(owner_ids):
+            attr_ids = list(
+                _AttributeLinks[kind]
+                .objects.filter(**{f"{owner_field}__in": batch})
+                .values_list("attribute_id", flat=True)
+            )
+            _AttributeLinks[kind].objects.filter(**{f"{owner_field}__in": batch}).delete()
+            for attr_batch in _chunks(attr_ids):
+                Attribute.objects.filter(id__in=attr_batch).delete()
+
+    def _skipped(self, kind, owner_id):
+        if kind == _OBJECT:
+            return owner_id in self.characters
+        return owner_id in self.skipped_script_ids
+
+    def add_objects(self, rows):
+        rows = [
+            row
+            for row in self._rows(_OBJECTS, rows, self.object_fields)
+            if row["id"] not in self.characters
+        ]
+        ids = [row["id"] for row in rows]
+        # objects with these ids that were moved out of the scope since
+        existing = []
+        for batch in _chunks(ids):
+            existing.extend(ObjectDB.objects.filter(id__in=batch).values_list("id", flat=True))
+        self.delete(existing)
+        # creating an instance with an id returns the cached one, if any
+        _flush_cached(ObjectDB, ids)
+        objs = []
+        for row in rows:
+            for field in _REF_FIELDS:
+                if row.get(field):
+                    self.refs_out.setdefault(row[field], []).append((row["id"], field))
+            objs.append(ObjectDB(**row))
+        ObjectDB.objects.bulk_create(objs, batch_size=bulk_create.BATCH_SIZE)
+        self.object_ids.update(ids)
+        self.counts["objects"] += len(objs)
+
+    def add_scripts(self, rows):
+        rows = self._rows(_SCRIPTS, rows, self.script_fields)
+        for row in rows:
+            if row.get("db_obj_id") in self.characters:
+                self.skipped_script_ids.add(row["id"])
+        rows = [row for row in rows if row["id"] not in self.skipped_script_ids]
+        ids = [row["id"] for row in rows]
+        for batch in _chunks(ids):
+            stale = list(ScriptDB.objects.filter(id__in=batch).values_list("id", flat=True))
+            self._delete_attributes(_SCRIPT, stale)
+            for script in ScriptDB.objects.filter(id__in=stale):
+                script.delete()
+        _flush_cached(ScriptDB, ids)
+        scripts = []
+        for row in rows:
+            if row.get("db_is_active"):
+                # started after commit
+                row["db_is_active"] = False
+                self.active_script_ids.append(row["id"])
+            scripts.append(ScriptDB(**row))
+        ScriptDB.objects.bulk_create(scripts, batch_size=bulk_create.BATCH_SIZE)
+        self.script_ids.update(ids)
+        self.counts["scripts"] += len(scripts)
+
+    def add_attributes(self, rows):
+        links = {_OBJECT: [], _SCRIPT: []}
+        attrs = []
+        for kind, owner_id, *values in rows:
+            if self._skipped(kind, owner_id):
+                continue
+            attr = Attribute(
+                **{
+                    field: value
+                    for field, value in zip(self.fields[_ATTRIBUTES], values)
+                    if field in self.attribute_fields
+                }
+            )
+            attrs.append(attr)
+            links[kind].append((owner_id, attr))
+        Attribute.objects.bulk_create(attrs, batch_size=bulk_create.BATCH_SIZE)
+        for kind, owner_attrs in links.items():
+            _AttributeLinks[kind].objects.bulk_create(
+                [
+                    _AttributeLinks[kind](
+                        **{_OWNER_FIELDS[kind]: owner_id, "attribute_id": attr.id}
+                    )
+                    for owner_id, attr in owner_attrs
+                ],
+                batch_size=bulk_create.BATCH_SIZE,
+            )
+        self.counts["attributes"] += len(attrs)
+
+    def add_tags(self, rows):
+        for kind, model in (_OBJECT, "objectdb"), (_SCRIPT, "scriptdb"):
+            owner_tags = [
+                (row[1], row[2:])
+                for row in rows
+                if row[0] == kind and not self._skipped(kind, row[1])
+            ]
+            if not owner_tags:
+                continue
+            tagdefs = {tuple(tagdef[:3]): tagdef[3] for _, tagdef in owner_tags}
+            tags = bulk_create._get_or_create_tags(tagdefs, model=model)
+            _TagLinks[kind].objects.bulk_create(
+                [
+                    _TagLinks[kind](
+                        **{_OWNER_FIELDS[kind]: owner_id, "tag_id": tags[tuple(tagdef[:3])].id}
+                    )
+                    for owner_id, tagdef in owner_tags
+                ],
+                batch_size=bulk_create.BATCH_SIZE,
+            )
+            self.counts["tags"] += len(owner_tags)
+
+    def relink(self):
+        """
+        Clear references to objects that no longer exist, and point objects
+        outside the snapshot back at the restored objects.
+
+        """
+        targets = [target_id for target_id in self.refs_out if target_id not in self.object_ids]
+        existing = set()
+        for batch in _chunks(targets):
+            existing.update(ObjectDB.objects.filter(id__in=batch).values_list("id", flat=True))
+        missing = defaultdict(list)
+        for target_id in targets:
+            if target_id not in existing:
+                for obj_id, field in self.refs_out[target_id]:
+                    missing[field].append(obj_id)
+        for field, obj_ids in missing.items():
+            for batch in _chunks(obj_ids):
+                ObjectDB.objects.filter(id__in=batch).update(**{field: None})
+
+        relinked = defaultdict(list)
+        for obj_id, refs in self.outside_refs.items():
+            if obj_id in self.object_ids or obj_id in self.deleted:
+                continue
+            for field, target_id in refs.items():
+                if target_id in self.object_ids:
+                    relinked[(field, target_id)].append(obj_id)
+        for (field, target_id), obj_ids in relinked.items():
+            for batch in _chunks(obj_ids):
+                ObjectDB.objects.filter(id__in=batch).update(**{field: target_id})
+        return relinked
+
+    def reset_caches(self, relinked=None):
+        """
+        Drop cached instances of deleted and restored objects and scripts, and
+        update the cached objects that were relinked. Also called if the
+        restore failed, without `relinked`.
+
+        """
+        _flush_cached(ObjectDB, self.deleted | self.object_ids)
+        _flush_cached(ScriptDB, self.script_ids)
+        # refresh_from_db would just return the cached instance again
+        for (field, target_id), obj_ids in (relinked or {}).items():
+            for obj_id in obj_ids:
+                cached = ObjectDB.get_cached_instance(obj_id)
+                if cached is not None:
+                    setattr(cached, field, target_id)
+        for obj in ObjectDB.get_all_cached_instances():
+            if "contents_cache" in obj.__dict__:
+                obj.contents_cache.init()
+
+
+def restore_snapshot(path):
+    """
+    Restore a snapshot written by `export_snapshot`, replacing the zone (or
+    world) it was taken from. Everything is done in one transaction.
+
+    Args:
+        path (str): The snapshot file.
+
+    Returns:
+        dict: Report with keys `scope` (`(tag, category)` or `None` for the
+        whole world), `objects`, `scripts`, `attributes`, `tags`, `deleted`
+        (objects deleted first) and `seconds`.
+
+    Raises:
+        SnapshotError: If the file is not a complete snapshot.
+
+    """
+    t0 = time.perf_counter()
+    restore = None
+    try:
+        with gzip.open(path, "rb") as fil, transaction.atomic():
+            frames = _read_frames(fil)
+            kind, header = next(frames, (None, None))
+            if kind != _HEADER or header.get("format") != FORMAT:
+                raise SnapshotError(f"{path} is not a snapshot.")
+            if header["version"] > VERSION:
+                raise SnapshotError(f"{path} is from a newer version (v{header['version']}).")
+
+            characters = get_character_ids()
+            restore = _Restore(header, characters)
+            restore.delete(get_scope_ids(*(header["scope"] or ()), characters=characters))
+            handlers = {
+                _OBJECTS: restore.add_objects,
+                _SCRIPTS: restore.add_scripts,
+                _ATTRIBUTES: restore.add_attributes,
+                _TAGS: restore.add_tags,
+            }
+            for kind, rows in frames:
+                if kind == _END:
+                    break
+                handlers[kind](rows)
+            else:
+                raise SnapshotError("The snapshot is truncated.")
+            relinked = restore.relink()
+    except (OSError, EOFError, zlib.error, pickle.UnpicklingError) as err:
+        if restore:
+            restore.reset_caches()
+        raise SnapshotError(f"Could not read {path}: {err}")
+    except Exception:
+        # everything was rolled back; don't keep instances of rows that never were
+        if restore:
+            restore.reset_caches()
+        raise
+
+    restore.reset_caches(relinked)
+    room_graph.invalidate()
+    for batch in _chunks(restore.active_script_ids):
+        for script in ScriptDB.objects.filter(id__in=batch):
+            script.start()
+
+    report = {
+        "scope": header["scope"],
+        **restore.counts,
+        "seconds": time.perf_counter() - t0,
+    }
+    logger.log_info(
+        f"Snapshot {path} restored: {restore.counts['objects']} objects, "
+        f"{restore.counts['scripts']} scripts in {report['seconds']:.2f}s."
+    )
+    return report
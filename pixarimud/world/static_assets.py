@@ -0,0 +1,215 @@
+"""
+Precompressed static assets
+
+The webclient's javascript and css (and the website's) are served from
+`settings.STATIC_ROOT`, where `collectstatic` gathers them. Evennia serves
+them as they are: uncompressed, and with no cache headers, so browsers ask
+for them again on every page load.
+
+- `PrecompressedManifestStorage` (`STORAGES["staticfiles"]`) is run by
+  `collectstatic`, which Evennia runs on every start and reload. Like
+  Django's `ManifestStaticFilesStorage`, it also stores each file under a
+  name with a hash of its content (`evennia.3f2a9c1b02d4.js`), which
+  `{% static %}` in templates links to. It also writes gzip (and, with the
+  `brotli` package installed, brotli) compressed copies next to the text
+  files, at the highest levels, and again only when a file changes.
+  Files not collected yet (before the first `collectstatic`, or in tests)
+  are linked to by their plain name.
+- `PrecompressedStaticRoot` (put at `/static` by
+  `server/conf/web_plugins.py`) serves the compressed copy the browser
+  accepts. Hashed names never change content, so they are served as
+  `immutable` for a year; other names (like links hardcoded in templates)
+  must be revalidated.
+
+"""
+
+import gzip
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from twisted.web import static
+
+from evennia.server.webserver import PrivateStaticRoot
+from evennia.utils import logger
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# {suffix: Content-Encoding}, best first
+ENCODINGS = {".br": "br", ".gz": "gzip"} if brotli else {".gz": "gzip"}
+COMPRESSED_EXTENSIONS = (".js", ".css", ".html", ".json", ".map", ".svg", ".txt", ".xml", ".ico")
+# smaller files gain too little to be worth a second request path
+_MIN_SIZE = 256
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, max-age=0, must-revalidate"
+
+
+def _compress(data, suffix):
+    if suffix == ".br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def precompress(path):
+    """
+    Write the compressed copies of a file, unless they are up to date.
+
+    Args:
+        path (str): The file.
+
+    Returns:
+        int: Compressed copies written.
+
+    """
+    mtime = os.path.getmtime(path)
+    stale = [
+        suffix
+        for suffix in ENCODINGS
+        if not os.path.exists(path + suffix) or os.path.getmtime(path + suffix) < mtime
+    ]
+    if not stale:
+        return 0
+    with open(path, "rb") as fil:
+        data = fil.read()
+    written = 0
+    for suffix in stale:
+        compressed_path = path + suffix
+        if len(data) < _MIN_SIZE:
+            compressed = None
+        else:
+            compressed = _compress(data, suffix)
+        if compressed is None or len(compressed) >= len(data) * 0.9:
+            # not worth it; make sure no old copy is served
+            if os.path.exists(compressed_path):
+                os.remove(compressed_path)
+            continue
+        tmp_path = f"{compressed_path}.tmp"
+        with open(tmp_path, "wb") as fil:
+            fil.write(compressed)
+        os.replace(tmp_path, compressed_path)
+        written += 1
+    return written
+
+
+class PrecompressedManifestStorage(ManifestStaticFilesStorage):
+    """
+    Stores static files under content-hashed names as well, and writes
+    compressed copies of them.
+
+    """
+
+    # don't rewrite references inside css/js; they keep pointing to the
+    # plain names, which stay in place (and a reference to a file that does
+    # not exist would fail the whole collectstatic)
+    patterns = ()
+    # templates linking to a file collected since the server started get
+    # its plain name instead of an error
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # not in STATIC_ROOT to hash, as before the first collectstatic
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        written = 0
+        for name in paths:
+            if not name.endswith(COMPRESSED_EXTENSIONS):
+                continue
+            for stored_name in {name, self.hashed_files.get(self.hash_key(name), name)}:
+                try:
+                    written += precompress(self.path(stored_name))
+                except OSError as err:
+                    logger.log_warn(f"Static file {stored_name} could not be compressed: {err}")
+        if written:
+            logger.log_info(f"Static files: {written} compressed copies written.")
+
+
+def load_immutable_paths(static_root):
+    """
+    Get the paths of the files stored under content-hashed names.
+
+    Args:
+        static_root (str): Where the static files are collected.
+
+    Returns:
+        set: Absolute paths.
+
+    """
+    storage = PrecompressedManifestStorage(location=static_root)
+    return {
+        os.path.abspath(os.path.join(static_root, *name.split("/")))
+        for name in storage.hashed_files.values()
+    }
+
+
+def _accepted_encodings(header):
+    """
+    Get the content codings an Accept-Encoding header allows.
+
+    """
+    accepted = set()
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q=") and params[2:] in ("0", "0.", "0.0", "0.00", "0.000"):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+class PrecompressedStaticRoot(PrivateStaticRoot):
+    """
+    Serves static files, picking a compressed copy the client accepts and
+    setting cache headers by whether the name is content-hashed.
+
+    """
+
+    # for serving the compressed copies as their originals' type
+    contentEncodings = {".gz": "gzip", ".br": "br"}
+    # absolute paths of the content-hashed files
+    immutable_paths = frozenset()
+
+    def render_GET(self, request):
+        if not self.isfile():
+            return super().render_GET(request)
+        path = self.path
+        request.setHeader(
+            b"cache-control",
+            IMMUTABLE_CACHE_CONTROL if path in self.immutable_paths else REVALIDATE_CACHE_CONTROL,
+        )
+        if path.endswith(COMPRESSED_EXTENSIONS):
+            request.setHeader(b"vary", b"Accept-Encoding")
+            accepted = _accepted_encodings(
+                (request.getHeader(b"accept-encoding") or b"").decode("latin-1")
+            )
+            for suffix, coding in ENCODINGS.items():
+                if coding in accepted and os.path.isfile(path + suffix):
+                    # served as the original's type, with Content-Encoding
+                    variant = static.File(path + suffix, defaultType=self.defaultType)
+                    variant.contentEncodings = self.contentEncodings
+                    return variant.render_GET(request)
+        return super().render_GET(request)
+
+
+def create_static_root():
+    """
+    Create the `/static` resource. Called by `server/conf/web_plugins.py`
+    as the web server starts, after `collectstatic` has run.
+
+    Returns:
+        PrecompressedStaticRoot: The resource.
+
+    """
+    static_root = settings.STATIC_ROOT
+    PrecompressedStaticRoot.immutable_paths = frozenset(load_immutable_paths(static_root))
+    return PrecompressedStaticRoot(static_root)
@@ -0,0 +1,101 @@
+"""
+Pre-rendered text variants
+
+The Portal renders Evennia markup for each session it sends to: ANSI or
+xterm256 for telnet, stripped for NOCOLOR/screenreader clients and html
+for the webclient. Text that goes to many sessions at once (connection
+screens, channel messages) can instead be rendered once per client
+capability here and sent with `RAW_OPTIONS`, so the Portal passes it
+through untouched:
+
+- `ansi` - 16-color ANSI (telnet clients without xterm256)
+- `xterm256` - xterm256 ANSI
+- `plain` - all color stripped (NOCOLOR clients, or clients reporting
+  neither ansi nor xterm256)
+- `html` - markup converted to html for the webclient
+
+Sessions whose settings no variant covers must get the text the normal
+way: screenreader clients (telnet strips more than color for them, with
+`settings.SCREENREADER_REGEX_STRIP`), telnet clients with MXP on (links
+become MXP tags) and webclients in NOCOLOR mode.
+
+"""
+
+from evennia.utils import ansi
+from evennia.utils.text2html import parse_html
+
+ANSI = "ansi"
+XTERM256 = "xterm256"
+PLAIN = "plain"
+HTML = "html"
+VARIANTS = (ANSI, XTERM256, PLAIN, HTML)
+
+# sent with pre-rendered text so the Portal does no further processing
+RAW_OPTIONS = {"raw": True, "client_raw": True}
+
+
+def render_variant(text, variant):
+    """
+    Render text with Evennia markup for one client capability.
+
+    Args:
+        text (str): Text with Evennia markup.
+        variant (str): One of `VARIANTS`.
+
+    Returns:
+        str: The rendered text.
+
+    """
+    if variant == PLAIN:
+        return ansi.parse_ansi(text, strip_ansi=True)
+    if variant == HTML:
+        return parse_html(text)
+    # end with a color reset, like the telnet protocol does for normal text
+    terminated = text + ("||n" if text.endswith("|") else "|n")
+    return ansi.parse_ansi(terminated, xterm256=variant == XTERM256)
+
+
+def render_variants(text):
+    """
+    Render text for all supported client capabilities.
+
+    Args:
+        text (str): Text with Evennia markup.
+
+    Returns:
+        dict: `{variant: rendered_string}`.
+
+    """
+    return {variant: render_variant(text, variant) for variant in VARIANTS}
+
+
+def session_variant(session):
+    """
+    Get which pre-rendered variant fits a session. This mirrors the flag
+    handling of the Portal's telnet and webclient protocols.
+
+    Args:
+        session (Session): The session to send to.
+
+    Returns:
+        str or None: The variant name, or `None` if no variant fits.
+
+    """
+    flags = session.protocol_flags
+    if flags.get("SCREENREADER", False):
+        return None
+    nocolor = flags.get("NOCOLOR", False)
+
+    if session.protocol_key.startswith("webclient"):
+        return None if nocolor else HTML
+    if flags.get("MXP", False):
+        return None
+
+    if flags.get("TTYPE", False):
+        xterm256 = flags.get("XTERM256", False)
+        useansi = flags.get("ANSI", False)
+    else:
+        xterm256 = useansi = True
+    if nocolor or not (xterm256 or useansi):
+        return PLAIN
+    return XTERM256 if xterm256 else ANSI
@@ -0,0 +1,213 @@
+"""
+Batched webclient protocol
+
+Evennia's webclient protocol sends every message to the browser as its own
+JSON text frame, `["text", ["<html>"], {}]`. In a busy room (like the
+arena) that is hundreds of tiny frames per second to every webclient, each
+with its own frame header, JSON and wakeup of the browser.
+
+`BatchedWebSocketClient` (`settings.WEBSOCKET_PROTOCOL_CLASS`) can instead
+collect the messages to a client for `settings.WEBCLIENT_BATCH_WINDOW`
+seconds and send them as one binary frame. This is negotiated: the
+webclient (`web/static/webclient/js/evennia.js`) asks for the
+`BATCH_SUBPROTOCOL` websocket subprotocol, and only gets batches if the
+server picks it. Other clients get the usual JSON frames. So do all clients
+while `settings.WEBCLIENT_BATCHING` is off; the subprotocol is still picked
+when asked for then (browsers drop the connection if it isn't), and the
+webclient reads the JSON frames within it as usual.
+
+A batch frame is a list of records, each a kind byte, the length of the
+payload as an unsigned LEB128 varint, and the payload:
+
+- `RECORD_TEXT` / `RECORD_PROMPT` - plain `text`/`prompt` messages (one
+  argument, no keyword arguments, which is nearly all of them): the UTF-8
+  text itself.
+- `RECORD_JSON` - any other message, as the usual UTF-8 JSON
+  `[cmdname, args, kwargs]`.
+
+With `settings.WEBCLIENT_DEFLATE`, the `permessage-deflate` extension
+offered by browsers is accepted too (in either format), so frames go out
+compressed.
+
+"""
+
+import html
+import json
+import re
+
+from autobahn.exception import Disconnected
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from django.conf import settings
+from twisted.internet import reactor
+
+from evennia.server.portal.webclient import WebSocketClient
+from evennia.utils.ansi import parse_ansi
+from evennia.utils.text2html import parse_html
+
+BATCH_SUBPROTOCOL = "pixarimud.batch.1"
+
+RECORD_JSON = 0
+RECORD_TEXT = 1
+RECORD_PROMPT = 2
+_TEXT_RECORDS = {"text": RECORD_TEXT, "prompt": RECORD_PROMPT}
+
+_RE_SCREENREADER_REGEX = re.compile(settings.SCREENREADER_REGEX_STRIP, re.DOTALL + re.MULTILINE)
+
+
+def encode_record(cmdname, args, kwargs):
+    """
+    Encode one message as a batch record.
+
+    Args:
+        cmdname (str): The message's name, like "text".
+        args (list or tuple): Its arguments.
+        kwargs (dict): Its keyword arguments.
+
+    Returns:
+        bytes: The record.
+
+    """
+    kind = _TEXT_RECORDS.get(cmdname)
+    if kind and len(args) == 1 and isinstance(args[0], str) and not kwargs:
+        payload = args[0].encode("utf-8")
+    else:
+        kind = RECORD_JSON
+        payload = json.dumps([cmdname, args, kwargs], separators=(",", ":")).encode("utf-8")
+    header = bytearray((kind,))
+    size = len(payload)
+    while size > 0x7F:
+        header.append(size & 0x7F | 0x80)
+        size >>= 7
+    header.append(size)
+    return bytes(header) + payload
+
+
+class BatchedWebSocketClient(WebSocketClient):
+    """
+    The webclient's websocket protocol, sending batched binary frames to
+    clients that ask for them.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batched = False
+        self._batch = []
+        self._batch_size = 0
+        self._flush_call = None
+
+    def onConnect(self, request):
+        """
+        Pick the batch subprotocol during the handshake, if the client asks
+        for it. Messages are only batched if batching is on.
+
+        Returns:
+            str or None: The subprotocol picked.
+
+        """
+        if BATCH_SUBPROTOCOL in request.protocols:
+            self.batched = settings.WEBCLIENT_BATCHING
+            return BATCH_SUBPROTOCOL
+        return None
+
+    def perMessageCompressionAccept(self, offers):
+        """
+        Accept the client's `permessage-deflate` offer, if any. Autobahn
+        looks for this on the protocol before the factory.
+
+        """
+        if settings.WEBCLIENT_DEFLATE:
+            for offer in offers:
+                if isinstance(offer, PerMessageDeflateOffer):
+                    return PerMessageDeflateOfferAccept(offer)
+        return None
+
+    def _send(self, cmdname, args, kwargs):
+        if not self.batched:
+            self.sendLine(json.dumps([cmdname, args, kwargs]))
+            return
+        record = encode_record(cmdname, args, kwargs)
+        self._batch.append(record)
+        self._batch_size += len(record)
+        if self._batch_size >= settings.WEBCLIENT_BATCH_MAX_SIZE:
+            self.flush()
+        elif not self._flush_call:
+            self._flush_call = reactor.callLater(settings.WEBCLIENT_BATCH_WINDOW, self.flush)
+
+    def flush(self):
+        """
+        Send the messages collected so far as one frame.
+
+        """
+        if self._flush_call and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+        if not self._batch:
+            return
+        frame = b"".join(self._batch)
+        self._batch = []
+        self._batch_size = 0
+        try:
+            self.sendMessage(frame, isBinary=True)
+        except Disconnected:
+            # this can happen on an unclean close of certain browsers.
+            self.disconnect(reason="Browser already closed.")
+
+    def disconnect(self, reason=None):
+        """
+        Send what is collected (like a goodbye message) before closing.
+
+        """
+        self.flush()
+        super().disconnect(reason)
+
+    def onClose(self, wasClean, code=None, reason=None):
+        if self._flush_call and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+        self._batch = []
+        self._batch_size = 0
+        super().onClose(wasClean, code=code, reason=reason)
+
+    def send_text(self, *args, **kwargs):
+        """
+        Send text data, as `WebSocketClient.send_text` does but batched
+        where negotiated.
+
+        """
+        if args:
+            args = list(args)
+            text = args[0]
+            if text is None:
+                return
+        else:
+            return
+
+        flags = self.protocol_flags
+
+        options = kwargs.pop("options", {})
+        raw = options.get("raw", flags.get("RAW", False))
+        client_raw = options.get("client_raw", False)
+        nocolor = options.get("nocolor", flags.get("NOCOLOR", False))
+        screenreader = options.get("screenreader", flags.get("SCREENREADER", False))
+        prompt = options.get("send_prompt", False)
+
+        if screenreader:
+            # screenreader mode cleans up output
+            text = parse_ansi(text, strip_ansi=True, xterm256=False, mxp=False)
+            text = _RE_SCREENREADER_REGEX.sub("", text)
+        cmd = "prompt" if prompt else "text"
+        if raw:
+            args[0] = text if client_raw else html.escape(text)
+        else:
+            args[0] = parse_html(text, strip_ansi=nocolor)
+
+        self._send(cmd, args, kwargs)
+
+    def send_default(self, cmdname, *args, **kwargs):
+        """
+        Send an OOB command, batched where negotiated.
+
+        """
+        if not cmdname == "options":
+            self._send(cmdname, args, kwargs)
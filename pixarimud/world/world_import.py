@@ -0,0 +1,478 @@
+"""
+World import
+
+Builds (or rebuilds) a part of the game world from a declarative *world
+module*, instead of replaying builder commands with a batch-command file.
+A world module is a normal python module defining:
+
+- `WORLD_KEY` - a short unique name for this world, like `"demo"`.
+- `ROOMS`, `EXITS` and `OBJECTS` - lists of entry dicts.
+
+Each entry is a prototype (see `world/prototypes.py`) with a few extra keys:
+
+- `id` (required) - unique name of the entry within the world.
+- `prototype` - key of a prototype to use as parent, like `"COMBAT_DUMMY"`.
+- `location`, `home`, `destination` - the `id` of another entry, or a
+  `#dbref` of an existing object.
+
+Use `ref(id)` for Attribute values pointing to another entry, like
+`"respawn_location": ref("respawn_chamber")`.
+
+The whole world is imported in one transaction, using the bulk inserts of
+`world/bulk_create.py`. Every imported object is tagged with
+`<world_key>:<id>` (category `world_import`), so importing the same world
+again updates the objects in place (key, location, aliases, locks and the
+Attributes and Tags from the world module) instead of creating duplicates.
+Attributes set while playing (like a dummy's `hits_taken`) are kept.
+Objects whose entry was removed from the world module are reported, and
+deleted if `prune` is set.
+
+Import from in-game with `worldimport world.demo_world`.
+
+"""
+
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from evennia.objects.models import ObjectDB
+from evennia.prototypes import prototypes as protlib
+from evennia.prototypes import spawner
+from evennia.utils import logger
+from evennia.utils.utils import dbref, is_iter, mod_import
+
+from world import bulk_create, prototype_cache, room_graph
+
+IMPORT_TAG_CATEGORY = "world_import"
+
+# entry keys that are not part of the prototype
+_ENTRY_KEYS = ("id", "prototype", "location", "home", "destination")
+
+
+class Ref:
+    """
+    A reference to another entry in the same world module.
+
+    """
+
+    __slots__ = ("id",)
+
+    def __init__(self, entry_id):
+        self.id = entry_id
+
+    def __repr__(self):
+        return f"ref({self.id!r})"
+
+
+def ref(entry_id):
+    """
+    Refer to another entry of the world module, for use in Attribute values.
+
+    Args:
+        entry_id (str): The `id` of the entry.
+
+    Returns:
+        Ref: The reference, replaced by the object when importing.
+
+    """
+    return Ref(entry_id)
+
+
+class WorldImportError(RuntimeError):
+    """
+    The world module is malformed.
+
+    """
+
+    pass
+
+
+def load_world(world):
+    """
+    Load and check a world definition.
+
+    Args:
+        world (str, module or dict): Python path to a world module, the module
+            itself, or a dict with keys `WORLD_KEY`, `ROOMS`, `EXITS` and `OBJECTS`.
+
+    Returns:
+        tuple: `(world_key, entries)` where `entries` is a list of
+        `(kind, entry)` with `kind` being `"room"`, `"exit"` or `"object"`.
+
+    Raises:
+        WorldImportError: If the world is malformed.
+
+    """
+    if isinstance(world, str):
+        module = mod_import(world)
+        if not module:
+            raise WorldImportError(f"Could not import world module '{world}'.")
+        world = module
+    if not isinstance(world, dict):
+        world = {name: getattr(world, name) for name in dir(world) if name.isupper()}
+
+    world_key = world.get("WORLD_KEY")
+    if not world_key:
+        raise WorldImportError("The world has no WORLD_KEY.")
+
+    entries = []
+    seen = set()
+    for kind, name in (("room", "ROOMS"), ("exit", "EXITS"), ("object", "OBJECTS")):
+        for entry in world.get(name, []):
+            entry_id = entry.get("id")
+            if not entry_id:
+                raise WorldImportError(f"An entry in {name} has no id: {entry}")
+            if entry_id in seen:
+                raise WorldImportError(f"Entry id '{entry_id}' is used more than once.")
+            seen.add(entry_id)
+            entries.append((kind, entry))
+
+    for _, entry in entries:
+        for field in ("location", "home", "destination"):
+            target = entry.get(field)
+            if target and not dbref(target) and target not in seen:
+                raise WorldImportError(
+                    f"Entry '{entry['id']}' has {field} '{target}', which is not an entry id "
+                    "or #dbref."
+                )
+        for value in _iter_refs(entry):
+            if value.id not in seen:
+                raise WorldImportError(f"Entry '{entry['id']}' refers to unknown entry '{value.id}'.")
+    return world_key, entries
+
+
+def _iter_refs(value):
+    """
+    Find all `Ref`s in a (possibly nested) value.
+
+    """
+    if isinstance(value, Ref):
+        yield value
+    elif isinstance(value, dict):
+        for val in value.values():
+            yield from _iter_refs(val)
+    elif is_iter(value):
+        for val in value:
+            yield from _iter_refs(val)
+
+
+def _resolve_refs(value, objects):
+    """
+    Replace all `Ref`s in a value with the imported objects.
+
+    """
+    if isinstance(value, Ref):
+        return objects[value.id]
+    if isinstance(value, dict):
+        return {key: _resolve_refs(val, objects) for key, val in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return type(value)(_resolve_refs(val, objects) for val in value)
+    return value
+
+
+def _import_tag(world_key, entry_id):
+    return f"{world_key}:{entry_id}".lower()
+
+
+def find_imported(world_key):
+    """
+    Find the objects imported earlier from a world.
+
+    Args:
+        world_key (str): The world's `WORLD_KEY`.
+
+    Returns:
+        dict: `{entry_id: object}`.
+
+    """
+    prefix = _import_tag(world_key, "")
+    rows = ObjectDB.objects.filter(
+        db_tags__db_category=IMPORT_TAG_CATEGORY,
+        db_tags__db_tagtype=None,
+        db_tags__db_key__startswith=prefix,
+    ).values_list("id", "db_tags__db_key")
+    ids = {obj_id: tagkey[len(prefix) :] for obj_id, tagkey in rows}
+    imported = {}
+    obj_ids = list(ids)
+    for istart in range(0, len(obj_ids), bulk_create.BATCH_SIZE):
+        for obj in ObjectDB.objects.filter(id__in=obj_ids[istart : istart + bulk_create.BATCH_SIZE]):
+            imported[ids[obj.id]] = obj
+    return imported
+
+
+def _entry_prototype(kind, entry, parents):
+    """
+    Turn a world entry into a prototype for the spawner.
+
+    """
+    prototype = {key: value for key, value in entry.items() if key not in _ENTRY_KEYS}
+    parent_key = entry.get("prototype")
+    if parent_key:
+        parent_key = parent_key.lower()
+        if parent_key not in parents:
+            try:
+                parents[parent_key] = prototype_cache.get_flattened(parent_key)
+            except (KeyError, RuntimeError) as err:
+                raise WorldImportError(f"Entry '{entry['id']}': {err}")
+        # embed the parent, so the spawner doesn't look it up for every entry
+        prototype["prototype_parent"] = parents[parent_key]
+        # makes the spawner tag the object as spawned from the parent
+        prototype["prototype_key"] = parent_key
+    else:
+        prototype["prototype_key"] = entry["id"].lower()
+    if "typeclass" not in prototype and not (
+        parent_key and "typeclass" in parents[parent_key]
+    ):
+        prototype["typeclass"] = {
+            "room": settings.BASE_ROOM_TYPECLASS,
+            "exit": settings.BASE_EXIT_TYPECLASS,
+        }.get(kind, settings.BASE_OBJECT_TYPECLASS)
+    return prototype
+
+
+def _entry_objparams(world_key, kind, entry, parents):
+    """
+    Get the spawner's object parameters for an entry, with the Attributes
+    referring to other entries split off so they can be set once all
+    objects exist.
+
+    Returns:
+        tuple: `(objparams, ref_attributes)`.
+
+    """
+    create_kwargs, perms, locks, aliases, nattrs, attributes, tags, execs = spawner.spawn(
+        _entry_prototype(kind, entry, parents), only_validate=True
+    )[0]
+    if not entry.get("prototype"):
+        tags = [tag for tag in tags if tag[1] != protlib.PROTOTYPE_TAG_CATEGORY]
+    tags.append((_import_tag(world_key, entry["id"]), IMPORT_TAG_CATEGORY))
+
+    plain_attributes, ref_attributes = [], []
+    for attribute in attributes:
+        if any(True for _ in _iter_refs(attribute[1])):
+            ref_attributes.append(attribute)
+        else:
+            plain_attributes.append(attribute)
+    objparams = (create_kwargs, perms, locks, aliases, nattrs, plain_attributes, tags, execs)
+    return objparams, ref_attributes
+
+
+def _target(value, objects):
+    """
+    Resolve a location/home/destination value, or return `False` if it
+    refers to an entry that isn't created yet.
+
+    """
+    if not value:
+        return None
+    if dbref(value):
+        return ObjectDB.objects.get(id=dbref(value))
+    return objects.get(value, False)
+
+
+def import_world(world, prune=False, dry_run=False):
+    """
+    Import a world module, creating new objects and updating those imported
+    before, all in one transaction.
+
+    Args:
+        world (str, module or dict): The world, as for `load_world`.
+        prune (bool, optional): Delete objects imported earlier whose entry
+            is no longer in the world.
+        dry_run (bool, optional): Roll everything back at the end; only
+            report what would have changed.
+
+    Returns:
+        dict: Report with keys `world`, `created`, `updated`, `orphans` (list of
+        entry ids), `pruned` (bool) and `seconds`.
+
+    Raises:
+        WorldImportError: If the world is malformed.
+
+    """
+    t0 = time.perf_counter()
+    world_key, entries = load_world(world)
+    parents = {}
+
+    with transaction.atomic():
+        objects = find_imported(world_key)
+        existing = dict(objects)
+        params = {}
+        ref_attributes = {}
+        for kind, entry in entries:
+            params[entry["id"]], ref_attributes[entry["id"]] = _entry_objparams(
+                world_key, kind, entry, parents
+            )
+        entries_by_id = {entry["id"]: entry for _, entry in entries}
+
+        # create new objects in waves, so locations etc exist before their contents
+        pending = [entry_id for entry_id in params if entry_id not in existing]
+        created = 0
+        while pending:
+            ready, waiting = [], []
+            for entry_id in pending:
+                entry = entries_by_id[entry_id]
+                targets = [
+                    _target(entry.get(field), objects) for field in ("location", "home", "destination")
+                ]
+                if False in targets:
+                    waiting.append(entry_id)
+                    continue
+                create_kwargs = params[entry_id][0]
+                location, home, destination = targets
+                create_kwargs["db_location"] = location
+                create_kwargs["db_destination"] = destination
+                if home:
+                    create_kwargs["db_home"] = home
+                ready.append(entry_id)
+            if not ready:
+                raise WorldImportError(
+                    f"Entries {', '.join(waiting)} have circular location/home/destination."
+                )
+            for entry_id, obj in zip(
+                ready, bulk_create.bulk_create_objects(*(params[entry_id] for entry_id in ready))
+            ):
+                objects[entry_id] = obj
+            created += len(ready)
+            pending = waiting
+
+        updated = _update_existing(existing, entries_by_id, params, objects)
+        if updated:
+            # exits may have moved, without signals
+            room_graph.invalidate()
+
+        # Attributes referring to other entries, now that all exist
+        bulk_create.bulk_set_attributes(
+            [
+                (
+                    objects[entry_id],
+                    [(attr[0], _resolve_refs(attr[1], objects), *attr[2:]) for attr in attributes],
+                )
+                for entry_id, attributes in ref_attributes.items()
+                if attributes
+            ]
+        )
+
+        orphans = sorted(entry_id for entry_id in existing if entry_id not in entries_by_id)
+        if prune:
+            for entry_id in orphans:
+                existing[entry_id].delete()
+
+        if dry_run:
+            transaction.set_rollback(True)
+
+    if dry_run:
+        # the rolled-back objects must not stay cached
+        for entry_id, obj in objects.items():
+            if entry_id not in existing:
+                ObjectDB.flush_cached_instance(obj, force=True)
+                location = obj.db_location
+                if location and "contents_cache" in location.__dict__:
+                    location.contents_cache.remove(obj)
+        # and the updated ones must go back to their stored state (refresh_from_db
+        # would just return the cached instance again)
+        fields = ("db_key", "db_lock_storage", "db_location_id", "db_home_id", "db_destination_id")
+        ids = [obj.id for obj in existing.values()]
+        stored = {}
+        for istart in range(0, len(ids), bulk_create.BATCH_SIZE):
+            for row in ObjectDB.objects.filter(
+                id__in=ids[istart : istart + bulk_create.BATCH_SIZE]
+            ).values("id", *fields):
+                stored[row["id"]] = row
+        for obj in existing.values():
+            for field in fields:
+                setattr(obj, field, stored[obj.id][field])
+            obj.locks.reset()
+            for handler in ("attributes", "tags", "aliases", "permissions"):
+                if handler in obj.__dict__:
+                    obj.__dict__[handler].reset_cache()
+        for obj in existing.values():
+            for container in (obj, obj.db_location):
+                if container and "contents_cache" in container.__dict__:
+                    container.contents_cache.init()
+
+    report = {
+        "world": world_key,
+        "created": created,
+        "updated": updated,
+        "orphans": orphans,
+        "pruned": prune and bool(orphans),
+        "seconds": time.perf_counter() - t0,
+    }
+    if not dry_run:
+        logger.log_info(
+            f"World import '{world_key}': {created} created, {updated} updated, "
+            f"{len(orphans)} orphaned{' (deleted)' if prune else ''} "
+            f"in {report['seconds']:.2f}s."
+        )
+    return report
+
+
+def _update_existing(existing, entries_by_id, params, objects):
+    """
+    Update objects imported earlier to match their entries.
+
+    Returns:
+        int: Number of objects whose fields, Attributes or Tags changed.
+
+    """
+    changed_fields = defaultdict(set)
+    moved = []
+    attribute_items = []
+    tag_items = []
+    for entry_id, obj in existing.items():
+        if entry_id not in entries_by_id:
+            continue
+        entry = entries_by_id[entry_id]
+        create_kwargs, perms, locks, aliases, _, attributes, tags, _ = params[entry_id]
+
+        if create_kwargs["db_typeclass_path"] != obj.db_typeclass_path:
+            obj.swap_typeclass(create_kwargs["db_typeclass_path"], clean_attributes=False)
+            changed_fields[obj].add("db_typeclass_path")
+
+        location = _target(entry.get("location"), objects)
+        destination = _target(entry.get("destination"), objects)
+        home = _target(entry.get("home"), objects) or create_kwargs.get("db_home")
+        if obj.db_key != create_kwargs["db_key"]:
+            obj.db_key = create_kwargs["db_key"]
+            changed_fields[obj].add("db_key")
+        lock_storage = bulk_create.merge_locks(obj.db_lock_storage, locks)
+        if obj.db_lock_storage != lock_storage:
+            obj.db_lock_storage = lock_storage
+            changed_fields[obj].add("db_lock_storage")
+        # compare ids, so unchanged relations are never loaded
+        for field, target in (("db_location", location), ("db_home", home), ("db_destination", destination)):
+            if field == "db_destination" and not target:
+                continue
+            if getattr(obj, f"{field}_id") != (target.id if target else None):
+                if field == "db_location":
+                    moved.append((obj, obj.db_location))
+                setattr(obj, field, target)
+                changed_fields[obj].add(field)
+
+        attribute_items.append((obj, attributes))
+        tag_items.append((obj, bulk_create.get_tagdefs(perms, aliases, tags)))
+
+    fields = set()
+    for obj_fields in changed_fields.values():
+        fields.update(obj_fields)
+    fields.discard("db_typeclass_path")
+    if fields:
+        ObjectDB.objects.bulk_update(
+            list(changed_fields), sorted(fields), batch_size=bulk_create.BATCH_SIZE
+        )
+    for obj in changed_fields:
+        if "db_lock_storage" in changed_fields[obj]:
+            obj.locks.reset()
+    for obj, old_location in moved:
+        if old_location and "contents_cache" in old_location.__dict__:
+            old_location.contents_cache.remove(obj)
+        if obj.db_location and "contents_cache" in obj.db_location.__dict__:
+            obj.db_location.contents_cache.add(obj)
+
+    changed_ids = {obj.id for obj in changed_fields}
+    changed_ids |= bulk_create.bulk_set_attributes(attribute_items)
+    changed_ids |= bulk_create.bulk_set_tags(tag_items, replace_tagtypes=("alias",))
+    return len(changed_ids)